@@ -1,8 +1,13 @@
+# 在 TKGQA 目录下以模块方式运行: python -m MY.data.multitq.table
 import pandas as pd
 import os
 
+from ...main.kg_store import build_snapshot
+
 input_path = "MY/data/multitq/kg/full.txt"
 output_path = "MY/data/output/full_df.txt"
+dict_dir = "MY/data/multitq/kg"
+snapshot_dir = "MY/data/output/kg_snapshot"
 
 # 确保输出目录存在
 os.makedirs(os.path.dirname(output_path), exist_ok=True)
@@ -20,5 +25,9 @@ try:
     df.to_csv(output_path, sep="\t", index=False, encoding="utf-8")
     print(f"文件已保存到: {os.path.abspath(output_path)}")
     print(df.head())
+
+    # 构建二进制快照，供各入口快速加载
+    meta = build_snapshot(df, dict_dir, snapshot_dir)
+    print(f"快照已保存到: {os.path.abspath(snapshot_dir)} (版本 {meta['version']}, 共 {meta['num_facts']} 条事实)")
 except Exception as e:
-    print("发生错误：", e)
\ No newline at end of file
+    print("发生错误：", e)
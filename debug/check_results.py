@@ -11,9 +11,9 @@ def check_latest_results():
     """检查最新的结果文件"""
     results_dir = "/mnt/nvme0n1/tyj/TKGQA/MY"
     
-    # 查找最新的结果文件
-    pattern = os.path.join(results_dir, "final_results_*.json")
-    result_files = glob.glob(pattern)
+    # 查找最新的结果文件（JSONL 为逐题追加写入的格式）
+    result_files = glob.glob(os.path.join(results_dir, "final_results_*.json")) + \
+        glob.glob(os.path.join(results_dir, "final_results_*.jsonl"))
     
     if not result_files:
         print("未找到结果文件")
@@ -25,7 +25,10 @@ def check_latest_results():
     
     try:
         with open(latest_file, 'r', encoding='utf-8') as f:
-            results = json.load(f)
+            if latest_file.endswith('.jsonl'):
+                results = [json.loads(line) for line in f if line.strip()]
+            else:
+                results = json.load(f)
         
         print(f"总结果数: {len(results)}")
         
@@ -10,21 +10,24 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # 现在可以正常导入
 from main.kg_explorer import KGExplorer
+from main.kg_store import load_kg_dataframe, snapshot_exists
 
 def debug_failed_queries():
-    # 加载KG数据
-    try:
-        kg_df = pd.read_csv('MY/data/output/full_df.txt', sep='\t', names=['head', 'relation', 'tail', 'timestamp'])
-    except FileNotFoundError:
-        # 尝试其他可能的路径
-        try:
-            kg_df = pd.read_csv('data/output/full_df.txt', sep='\t', names=['head', 'relation', 'tail', 'timestamp'])
-        except FileNotFoundError:
-            print("错误: 找不到KG数据文件")
-            print("请确认以下路径之一存在:")
-            print("  - MY/data/output/full_df.txt")
-            print("  - data/output/full_df.txt")
-            return
+    # 加载KG数据（优先使用二进制快照）
+    kg_df = None
+    for data_dir in ['MY/data/output', 'data/output']:
+        kg_path = os.path.join(data_dir, 'full_df.txt')
+        snapshot_dir = os.path.join(data_dir, 'kg_snapshot')
+        if os.path.exists(kg_path) or snapshot_exists(snapshot_dir):
+            kg_df = load_kg_dataframe(kg_path, snapshot_dir)
+            break
+    
+    if kg_df is None:
+        print("错误: 找不到KG数据文件")
+        print("请确认以下路径之一存在:")
+        print("  - MY/data/output/full_df.txt")
+        print("  - data/output/full_df.txt")
+        return
     
     explorer = KGExplorer(kg_df)
     
@@ -1,30 +1,72 @@
+import argparse
+import contextvars
 import json
 import pandas as pd
 import re
 import os
 import logging
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
-from openai import OpenAI
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from main.code_generator import CodeGenerator
+from main.config import EXPERIMENT_CONFIG
+from main.kg_index import KGIndex
+from main.kg_stats import KGStatistics
+from main.kg_store import load_kg_store
+from main.llm_cache import CacheMissError
+from main.llm_client import LLMClient, CircuitOpenError, CancelToken, LLMCancelledError
+from main.llm_metrics import METRICS, calls_path, metrics_context, log_summaries
+from main.query_executor import QueryExecutor
+from main.query_plan import PlanExecutor, untruncated_plan
+from main.query_planner import QueryPlanner
+from main.question_loader import QuestionSet, filters_from_config
+from main.relation_retriever import RelationRetriever
+from main.results_writer import ResultStats, ResultsWriter, iter_results
+from main.utils import analyze_question_simple, extract_fenced_query_kg
 
 # API配置信息
 api_key = os.environ.get("DeepSeek_API_KEY")
-base_url = "https://api.deepseek.com"
+base_url = os.environ.get("LLM_BASE_URL", "https://api.deepseek.com")  # 压测时指向本地模拟服务
 
 
 class TemporalKGQASystem:
-    def __init__(self):
+    def __init__(self, cache_path: str = None, replay: bool = False, speculative: bool = None):
         # 设置日志
         self.setup_logging()
         
-        # 初始化DeepSeek R1客户端
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        # 初始化DeepSeek R1客户端：带重试、截止时间与熔断（EXPERIMENT_CONFIG 中的 timeout / max_retries 等），
+        # 以及LLM响应缓存（replay=True 时未命中直接失败，不访问网络）
+        self.llm = LLMClient.from_config({
+            **EXPERIMENT_CONFIG,
+            'api_key': api_key,
+            'base_url': base_url,
+            'model': "deepseek-reasoner",
+            'llm_cache_path': cache_path,
+            'llm_replay': replay
+        })
+        self.cache = self.llm.cache
         
         # 加载数据
         self.questions = self.load_questions()
         self.kg_df = self.load_knowledge_graph()
         
+        # 候选关系检索：为每个问题从完整关系词表中取 top-k 注入提示
+        self.relation_retriever = RelationRetriever(sorted(self.kg_df['relation'].unique()))
+        
+        # 推测执行：有模板的问题类型先跑查询模板，同时在后台线程运行LLM流程
+        self.speculative = EXPERIMENT_CONFIG.get('speculative_templates', False) if speculative is None else speculative
+        if self.speculative:
+            self.kg_index = KGIndex(self.kg_store)
+            self.query_planner = QueryPlanner(self.kg_index, KGStatistics(self.kg_store))
+            self.code_generator = CodeGenerator(self.llm, "deepseek-reasoner")
+            self.code_generator.relation_retriever = self.relation_retriever
+            self.code_generator.relation_top_k = EXPERIMENT_CONFIG.get('relation_top_k', 8)
+            self.query_executor = QueryExecutor()
+            self.plan_executor = PlanExecutor(self.kg_store, self.kg_index, self.query_planner)
+            self.llm_pool = ThreadPoolExecutor(max_workers=EXPERIMENT_CONFIG.get('max_concurrency', 8))
+        
         # 结果存储
         self.results = []
         
@@ -61,46 +103,47 @@ class TemporalKGQASystem:
         
         self.logger.info(f"日志系统初始化完成，日志文件: {log_file}")
     
-    def load_questions(self) -> List[Dict]:
-        """加载问题数据集"""
-        with open('MY/data/multitq/questions/dev_25.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
+    def load_questions(self) -> QuestionSet:
+        """问题数据集：流式读取，按 EXPERIMENT_CONFIG 中的 question_qtypes 等条件过滤"""
+        return QuestionSet('MY/data/multitq/questions/dev_25.json', filters_from_config(EXPERIMENT_CONFIG))
     
     def load_knowledge_graph(self) -> pd.DataFrame:
-        """加载时序知识图谱四元组数据"""
-        return pd.read_csv('MY/data/output/full_df.txt', sep='\t', 
-                          names=['head','relation','tail', 'timestamp'])
+        """加载时序知识图谱四元组数据（保留 KGQuadStore 供推测执行的查询模板建索引）"""
+        self.kg_store = load_kg_store('MY/data/output/full_df.txt', 'MY/data/output/kg_snapshot')
+        return self.kg_store.to_view()
     
-    def call_deepseek_r1(self, messages: List[Dict], temperature: float = 0.1) -> str:
-        """调用DeepSeek R1模型"""
+    def call_deepseek_r1(self, messages: List[Dict], temperature: float = 0.1, stage: str = None,
+                         stop_when=None, cancel: CancelToken = None) -> str:
+        """
+        调用DeepSeek R1模型，失败或熔断期间返回空字符串，由各步骤使用默认值；stage 为指标中的步骤名
+        给出 stop_when 且开启 stream_llm 时流式接收，stop_when(已收到的文本) 为 True 即结束生成；
+        给出 cancel 时也流式接收，取消后在下一个分块处断开连接，抛出 LLMCancelledError
+        """
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-reasoner",
-                messages=messages,
-                temperature=temperature,
-                max_tokens=2048
-            )
-            
-            # 获取推理内容和最终答案
-            reasoning_content = response.choices[0].message.reasoning_content
-            content = response.choices[0].message.content
-            
-            if reasoning_content:
-                self.logger.debug(f"推理过程: {reasoning_content[:300]}...")
-            
-            return content
-            
+            if (stop_when is not None or cancel is not None) and EXPERIMENT_CONFIG.get('stream_llm', True):
+                return self.llm.chat_stream(messages, stage=stage, stop_when=stop_when, cancel=cancel,
+                                            temperature=temperature, max_tokens=2048)
+            return self.llm.chat(messages, stage=stage, cancel=cancel, temperature=temperature, max_tokens=2048)
+        except (CacheMissError, LLMCancelledError):
+            raise
+        except CircuitOpenError as e:
+            self.logger.warning(str(e))
+            return ""
         except Exception as e:
             self.logger.error(f"API调用错误: {e}")
             return ""
     
+    def candidate_relations(self, question: str) -> List[str]:
+        """与问题最相关的 top-k 个KG关系"""
+        return self.relation_retriever.top_k(question, EXPERIMENT_CONFIG.get('relation_top_k', 8))
+    
     def step1_natural_language_question(self, question_data: Dict) -> str:
         """Step 1: 自然语言问题"""
         question = question_data['question']
         self.logger.info(f"Step 1 - 问题: {question}")
         return question
     
-    def step2_question_understanding(self, question: str) -> Dict:
+    def step2_question_understanding(self, question: str, cancel: CancelToken = None) -> Dict:
         """Step 2: 问题理解 + 时间表达抽取"""
         prompt = f"""
 请分析以下时序问答问题，提取关键信息：
@@ -118,7 +161,7 @@ class TemporalKGQASystem:
 """
         
         messages = [{"role": "user", "content": prompt}]
-        response = self.call_deepseek_r1(messages)
+        response = self.call_deepseek_r1(messages, stage='step2_understanding', cancel=cancel)
         
         try:
             understanding = json.loads(response)
@@ -134,13 +177,14 @@ class TemporalKGQASystem:
                 "answer_type": "entity"
             }
     
-    def step3_path_planning(self, question: str, understanding: Dict) -> Dict:
+    def step3_path_planning(self, question: str, understanding: Dict, cancel: CancelToken = None) -> Dict:
         """Step 3: 路径规划：识别关键实体 + 多跳路径结构"""
         prompt = f"""
 基于时序知识图谱，为以下问题规划查询路径：
 
 问题: {question}
 问题理解: {understanding}
+候选关系（按相关度排序）: {self.candidate_relations(question)}
 
 请分析需要的查询路径，输出JSON格式：
 {{
@@ -159,7 +203,7 @@ class TemporalKGQASystem:
 """
         
         messages = [{"role": "user", "content": prompt}]
-        response = self.call_deepseek_r1(messages)
+        response = self.call_deepseek_r1(messages, stage='step3_path_planning', cancel=cancel)
         
         try:
             path_plan = json.loads(response)
@@ -175,7 +219,8 @@ class TemporalKGQASystem:
                 "multi_hop_strategy": "direct_query"
             }
     
-    def step4_temporal_logic_expression(self, question: str, understanding: Dict, path_plan: Dict) -> str:
+    def step4_temporal_logic_expression(self, question: str, understanding: Dict, path_plan: Dict,
+                                        cancel: CancelToken = None) -> str:
         """Step 4: 构造时序逻辑表达式"""
         prompt = f"""
 基于以下信息构造时序逻辑表达式：
@@ -200,12 +245,12 @@ class TemporalKGQASystem:
 """
         
         messages = [{"role": "user", "content": prompt}]
-        response = self.call_deepseek_r1(messages)
+        response = self.call_deepseek_r1(messages, stage='step4_logic_expression', cancel=cancel)
         self.logger.info(f"Step 4 - 时序逻辑表达式生成完成")
         return response
     
     def step5_generate_query_code(self, question: str, understanding: Dict, 
-                                 path_plan: Dict, logic_expr: str) -> str:
+                                 path_plan: Dict, logic_expr: str, cancel: CancelToken = None) -> str:
         """Step 5: 转为 Python 可执行查询代码"""
         prompt = f"""
 基于以下信息生成Python查询代码，用于查询时序知识图谱：
@@ -215,8 +260,9 @@ class TemporalKGQASystem:
 路径规划: {path_plan}
 时序逻辑表达式: {logic_expr}
 
-数据格式：pandas DataFrame，列名为 ['head','relation','tail', 'timestamp']
-时间格式：YYYY-MM-DD
+数据格式：pandas DataFrame，列名为 ['head','relation','tail', 'timestamp', 'day', 'month', 'year']
+候选关系（relation 列的取值，按相关度排序）: {self.candidate_relations(question)}
+时间格式：timestamp 为 YYYY-MM-DD；day（日序数）、month（year*12+month-1）、year 为整数列，可直接比较
 
 请生成完整的Python函数，函数名为query_kg，参数为df（DataFrame），返回查询结果：
 
@@ -239,10 +285,13 @@ def query_kg(df):
 4. 处理多跳查询
 5. 考虑first/last等时序操作
 6. 返回具体的答案列表，不要返回DataFrame
+7. df 为只读视图且各列类型已就绪：不要 astype、pd.to_datetime 或修改 df，需要新增列时先筛选子集（筛选结果可自由修改）
 """
         
         messages = [{"role": "user", "content": prompt}]
-        response = self.call_deepseek_r1(messages)
+        # 流式接收，完整的 query_kg 代码块一到即结束生成，不等待后续的解释文字
+        response = self.call_deepseek_r1(messages, stage='step5_query_code', cancel=cancel,
+                                         stop_when=lambda text: bool(extract_fenced_query_kg(text)))
         
         # 改进的代码提取逻辑
         query_code = self.extract_query_code(response)
@@ -253,6 +302,11 @@ def query_kg(df):
     
     def extract_query_code(self, response: str) -> str:
         """提取查询代码"""
+        # 优先取包含 query_kg 的完整代码块（回复中可能有多个代码块）
+        code = extract_fenced_query_kg(response)
+        if code:
+            return code
+
         # 尝试多种模式提取代码
         patterns = [
             r'```python\n(.*?)\n```',
@@ -335,44 +389,119 @@ def query_kg(df):
         self.logger.info(f"开始处理问题 {quid}")
         self.logger.info(f"{'='*50}")
         
+        with metrics_context(quid=quid, qtype=question_data.get('qtype', 'unknown')):
+            if self.speculative and question_data.get('qtype') in CodeGenerator.TEMPLATE_QTYPES:
+                result = self.process_speculatively(question_data)
+            else:
+                result = self.run_llm_pipeline(question_data)
+        
+        self.logger.info(f"问题 {quid} 处理完成")
+        self.logger.info(f"预测答案: {result['predicted_answers']}")
+        self.logger.info(f"标准答案: {question_data['answers']}")
+        
+        return result
+    
+    def run_llm_pipeline(self, question_data: Dict, cancel: CancelToken = None) -> Dict:
+        """Step 1-6 的LLM流程；cancel 被取消时抛出 LLMCancelledError"""
         # Step 1: 自然语言问题
         question = self.step1_natural_language_question(question_data)
         
         # Step 2: 问题理解 + 时间表达抽取
-        understanding = self.step2_question_understanding(question)
+        understanding = self.step2_question_understanding(question, cancel)
         
         # Step 3: 路径规划
-        path_plan = self.step3_path_planning(question, understanding)
+        path_plan = self.step3_path_planning(question, understanding, cancel)
         
         # Step 4: 构造时序逻辑表达式
-        logic_expr = self.step4_temporal_logic_expression(question, understanding, path_plan)
+        logic_expr = self.step4_temporal_logic_expression(question, understanding, path_plan, cancel)
         
         # Step 5: 生成查询代码
-        query_code = self.step5_generate_query_code(question, understanding, path_plan, logic_expr)
+        query_code = self.step5_generate_query_code(question, understanding, path_plan, logic_expr, cancel)
         
         # Step 6: 执行查询
+        if cancel is not None:
+            cancel.check()
         predicted_answers = self.step6_execute_query(query_code)
         
-        # 构造结果
-        result = {
-            'quid': quid,
-            'question': question,
+        return self.build_result(question_data, predicted_answers, understanding, path_plan, logic_expr,
+                                 query_code, 'llm')
+    
+    def process_speculatively(self, question_data: Dict) -> Dict:
+        """
+        推测执行：后台线程启动LLM流程的同时，用问题类型对应的查询模板直接作答；
+        模板答案通过置信检查则取消LLM流程（不再发出后续请求，流式回复断开连接），否则等待LLM流程的结果
+        """
+        quid = question_data['quid']
+        cancel = CancelToken()
+        # 复制上下文，使后台线程中的LLM调用带上当前问题的指标标签
+        future = self.llm_pool.submit(contextvars.copy_context().run, self.run_llm_pipeline, question_data, cancel)
+        
+        started = time.monotonic()
+        analysis = analyze_question_simple(question_data)
+        query_code = self.code_generator.generate_code(question_data['question'], analysis, str(quid))
+        answers = self.query_executor.execute_query(query_code, self.kg_df, self.kg_store, self.kg_index,
+                                                    self.query_planner)
+        elapsed = time.monotonic() - started
+        
+        if self.template_confident(question_data, analysis, answers):
+            cancel.cancel()
+            future.add_done_callback(self._log_cancelled_pipeline)
+            self.logger.info(f"推测执行 - 模板答案通过置信检查（{elapsed * 1000:.1f} 毫秒），取消LLM流程")
+            return self.build_result(question_data, answers, analysis, {}, "", query_code, 'template')
+        
+        self.logger.info(f"推测执行 - 模板答案 {answers} 未通过置信检查（{elapsed * 1000:.1f} 毫秒），等待LLM流程")
+        return future.result()
+    
+    def template_confident(self, question_data: Dict, analysis: Dict, answers: List[str]) -> bool:
+        """
+        模板答案的置信检查；截断到一个答案的模板类型不看答案数，而看截断前的候选数：
+        - 答案非空且没有执行错误
+        - 问题给出的实体都能在KG中按名称精确找到（唯一的实体匹配，不会混入名称相近的实体）
+        - 截断答案的类型（CodeGenerator.TRUNCATED_QTYPES）：计划模板去掉截断后候选答案唯一，且与模板答案一致
+          （代码模板与计划模板的检索范围不完全相同，不一致时无法判断，等待LLM流程）
+        - 其余类型：答案数不超过 speculative_max_answers
+        """
+        entities = analysis.get('entities') or []
+        if not entities or not answers or any(str(a).startswith('执行错误') for a in answers):
+            return False
+        if any(self.kg_store.entity_id(str(e).replace(' ', '_')) < 0 for e in entities):
+            return False
+        if analysis.get('qtype') in CodeGenerator.TRUNCATED_QTYPES:
+            candidates = self.template_candidates(question_data, analysis)
+            return candidates is not None and len(candidates) == 1 and \
+                candidates[0].replace('_', ' ') == str(answers[0]).replace('_', ' ')
+        return len(answers) <= EXPERIMENT_CONFIG.get('speculative_max_answers', 5)
+    
+    def template_candidates(self, question_data: Dict, analysis: Dict) -> Optional[List[str]]:
+        """计划模板去掉截断后的候选答案；无法构造计划时返回 None"""
+        plan = self.code_generator.generate_plan(question_data['question'], analysis, str(question_data['quid']))
+        if plan is None:
+            return None
+        return self.plan_executor.execute(untruncated_plan(plan))
+    
+    def _log_cancelled_pipeline(self, future):
+        """被取消的LLM流程结束后的回调：取消是预期结果，其他异常记录日志"""
+        error = future.exception()
+        if error is not None and not isinstance(error, LLMCancelledError):
+            self.logger.warning(f"已取消的LLM流程异常结束: {error}")
+    
+    def build_result(self, question_data: Dict, predicted_answers: List[str], understanding: Dict,
+                     path_plan: Dict, logic_expr: str, query_code: str, answer_source: str) -> Dict:
+        """构造结果；answer_source 为 llm 或 template（推测执行中被采纳的模板答案）"""
+        return {
+            'quid': question_data['quid'],
+            'question': question_data['question'],
             'ground_truth': question_data['answers'],
             'predicted_answers': predicted_answers,
             'understanding': understanding,
             'path_plan': path_plan,
             'logic_expression': logic_expr,
             'query_code': query_code,
+            'answer_source': answer_source,
             'answer_type': question_data.get('answer_type', 'unknown'),
             'time_level': question_data.get('time_level', 'unknown'),
             'qtype': question_data.get('qtype', 'unknown')
         }
-        
-        self.logger.info(f"问题 {quid} 处理完成")
-        self.logger.info(f"预测答案: {predicted_answers}")
-        self.logger.info(f"标准答案: {question_data['answers']}")
-        
-        return result
     
     def evaluate_result(self, result: Dict) -> Dict:
         """评估单个结果"""
@@ -402,15 +531,25 @@ def query_kg(df):
         
         return evaluation
     
-    def run_experiment(self):
-        """运行完整实验"""
+    def run_experiment(self, resume: str = None):
+        """运行完整实验，返回整体评估指标；resume 为要续跑的结果文件（JSONL），其中已完成的问题跳过"""
         self.logger.info("开始时序知识图谱问答实验...")
         self.logger.info(f"问题总数: {len(self.questions)}")
         self.logger.info(f"知识图谱三元组数: {len(self.kg_df)}")
         
-        all_results = []
-        
-        for i, question_data in enumerate(self.questions):
+        # 每个问题的结果追加写入 JSONL，崩溃后可用 --resume 续跑；内存中只保留写入器的累计统计
+        results_path = resume or f"/mnt/nvme0n1/tyj/TKGQA/MY/results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+        writer = ResultsWriter(results_path, EXPERIMENT_CONFIG.get('save_interval', 5), resume=bool(resume))
+        if writer.resumed:
+            self.logger.info(f"续跑 {results_path}：已有 {writer.resumed} 个结果")
+        # LLM调用记录逐条写入结果文件旁的 JSONL
+        metrics_path = calls_path(results_path)
+        METRICS.open(metrics_path, append=bool(resume))
+        processed = adopted = 0
+        
+        for question_data in self.questions:
+            if writer.is_done(question_data['quid']):
+                continue
             try:
                 # 处理单个问题
                 result = self.process_single_question(question_data)
@@ -419,52 +558,61 @@ def query_kg(df):
                 evaluation = self.evaluate_result(result)
                 result['evaluation'] = evaluation
                 
-                all_results.append(result)
+                writer.write(result)
+                processed += 1
+                adopted += result['answer_source'] == 'template'
                 
-                # 保存中间结果
-                if (i + 1) % 5 == 0:
-                    self.save_results(all_results, f"intermediate_results_{i+1}.json")
-                
-                # 避免API限制
-                time.sleep(1)
+                # 避免API限制（回放模式与采纳模板答案时不等待）
+                if not (self.cache and self.cache.replay) and result['answer_source'] == 'llm':
+                    time.sleep(1)
                 
             except Exception as e:
                 self.logger.error(f"处理问题 {question_data['quid']} 时出错: {e}")
                 continue
         
+        writer.close()
+        self.logger.info(f"逐题结果: {results_path}")
+        
         # 保存最终结果
-        self.save_results(all_results, "final_results.json")
+        self.save_results(iter_results(results_path), "final_results.json")
         
-        # 计算整体评估指标
-        self.compute_overall_metrics(all_results)
+        if self.speculative:
+            # 等待已取消的LLM流程退出，使其调用记录计入指标
+            self.llm_pool.shutdown(wait=True)
+            self.logger.info(f"推测执行: 本次处理的 {processed} 个问题中 {adopted} 个采纳模板答案")
+        
+        if self.cache is not None:
+            self.logger.info(f"LLM缓存统计: {self.cache.stats()}")
+        
+        # LLM调用指标：按步骤 / 问题类型汇总
+        METRICS.close()
+        log_summaries(self.logger)
+        self.logger.info(f"LLM调用记录: {metrics_path}")
         
-        return all_results
+        # 计算整体评估指标
+        return self.compute_overall_metrics(writer.stats)
     
-    def save_results(self, results: List[Dict], filename: str):
-        """保存结果到文件"""
+    def save_results(self, results: Iterable[Dict], filename: str):
+        """保存结果到文件（JSON数组，逐条写入）"""
         output_path = f"/mnt/nvme0n1/tyj/TKGQA/MY/{filename}"
         with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
+            f.write('[')
+            for i, result in enumerate(results):
+                f.write((',\n' if i else '\n') + json.dumps(result, ensure_ascii=False, indent=2))
+            f.write('\n]\n')
         self.logger.info(f"结果已保存到: {output_path}")
     
-    def compute_overall_metrics(self, results: List[Dict]):
-        """计算整体评估指标"""
-        if not results:
-            return
-        
-        evaluations = [r['evaluation'] for r in results if 'evaluation' in r]
-        
-        avg_precision = sum(e['precision'] for e in evaluations) / len(evaluations)
-        avg_recall = sum(e['recall'] for e in evaluations) / len(evaluations)
-        avg_f1 = sum(e['f1'] for e in evaluations) / len(evaluations)
-        exact_match_rate = sum(e['exact_match'] for e in evaluations) / len(evaluations)
+    def compute_overall_metrics(self, stats: ResultStats) -> Dict:
+        """由结果的累计统计计算整体评估指标"""
+        if not stats.total:
+            return {}
         
         metrics = {
-            'total_questions': len(results),
-            'avg_precision': avg_precision,
-            'avg_recall': avg_recall,
-            'avg_f1': avg_f1,
-            'exact_match_rate': exact_match_rate
+            'total_questions': stats.total,
+            'avg_precision': stats.mean('precision'),
+            'avg_recall': stats.mean('recall'),
+            'avg_f1': stats.mean('f1'),
+            'exact_match_rate': stats.exact_matches / stats.total
         }
         
         self.logger.info("\n" + "="*50)
@@ -476,19 +624,29 @@ def query_kg(df):
         # 保存评估指标
         with open("/mnt/nvme0n1/tyj/TKGQA/MY/evaluation_metrics.json", 'w') as f:
             json.dump(metrics, f, indent=2)
+        return metrics
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="时序知识图谱问答实验（DeepSeek R1）")
+    parser.add_argument('--cache', default="MY/cache/llm_cache.sqlite", help="LLM响应缓存路径，传空字符串禁用缓存")
+    parser.add_argument('--replay', action='store_true', help="离线回放：只使用缓存，未命中直接失败")
+    parser.add_argument('--speculative', action='store_true',
+                        help="推测执行：有模板的问题类型先用查询模板作答，答案可信时取消LLM流程")
+    parser.add_argument('--resume', metavar='RESULTS_JSONL', help="续跑：向已有的逐题结果文件追加，跳过其中已完成的问题")
+    args = parser.parse_args()
+    
     # 创建输出目录
     os.makedirs("/mnt/nvme0n1/tyj/TKGQA/MY", exist_ok=True)
     
     # 初始化系统
-    system = TemporalKGQASystem()
+    system = TemporalKGQASystem(cache_path=args.cache or None, replay=args.replay,
+                                speculative=args.speculative or None)
     
     # 运行实验
-    results = system.run_experiment()
+    metrics = system.run_experiment(resume=args.resume)
     
-    system.logger.info(f"\n实验完成！处理了 {len(results)} 个问题")
+    system.logger.info(f"\n实验完成！共 {metrics.get('total_questions', 0)} 个问题的结果")
 
 if __name__ == "__main__":
     main()
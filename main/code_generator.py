@@ -5,27 +5,38 @@ import json
 import re
 import logging
 from typing import Dict, List
-from openai import OpenAI
 import pandas as pd
 from .relation_mapper import RelationMapper
 from .entity_normalizer import EntityNormalizer
 from .kg_explorer import KGExplorer
+from .query_plan import PlanError, parse_plan, validate_plan
+from .llm_client import LLMClient
+from .llm_cache import CacheMissError
+from .relation_retriever import RelationRetriever
 
 class CodeGenerator:
-    def __init__(self, client: OpenAI, model: str):
+    # 有专用代码模板的问题类型，其余类型使用兜底代码
+    TEMPLATE_QTYPES = ('first_last', 'equal', 'before_after', 'equal_multi', 'before_last', 'after_first')
+    # 模板只返回第一个答案（截断）的问题类型
+    TRUNCATED_QTYPES = ('first_last', 'equal', 'before_last', 'after_first')
+
+    def __init__(self, client: LLMClient, model: str):
         self.client = client
         self.model = model
         self.logger = logging.getLogger(__name__)
         self.relation_mapper = RelationMapper()
         self.entity_normalizer = EntityNormalizer()
+        # KG加载后由调用方设置：在完整关系词表上检索每个问题的候选关系
+        self.relation_retriever: RelationRetriever = None
+        self.relation_top_k = 8
 
     def _get_system_prompt(self) -> str:
         """获取系统提示"""
         return """你是一个时序知识图谱查询代码生成专家。
 
 知识图谱格式：
-- 列名：['head', 'relation', 'tail', 'timestamp']
-- 时间格式：YYYY-MM-DD HH:MM:SS
+- 列名：['head', 'relation', 'tail', 'timestamp', 'day', 'month', 'year']
+- 时间格式：timestamp 为 YYYY-MM-DD 字符串；day（日序数）、month（year*12+month-1）、year 为整数列，时间比较优先使用整数列
 - 实体格式：使用下划线连接，如 Juan_Carlos_I
 - 关系格式：使用下划线连接，如 Make_a_visit, Host_a_visit
 
@@ -43,19 +54,12 @@ class CodeGenerator:
 4. 时间处理：
    - "first time" -> 找最早时间，返回完整日期
    - "same month" -> 先找参考事件的月份，再找同月事件
-   - "before/after" -> 使用字符串比较或pd.to_datetime()
+   - "before/after" -> 使用 time_mask(df, 'before'/'after', '2007-06') 或比较整数时间列
 5. 返回具体实体名称，处理下划线转空格
+6. df 为只读视图且各列类型已就绪：不要 astype 或修改 df，需要新增列时先筛选子集（筛选结果可自由修改）
 
 现在生成查询代码："""
 
-    def _ensure_data_types_code(self) -> str:
-        """生成数据类型确保代码"""
-        return """
-        # 确保数据类型
-        for col in ['head', 'relation', 'tail', 'timestamp']:
-            if col in df.columns:
-                df[col] = df[col].astype(str)"""
-
     def _generate_entity_patterns_code(self, entity_var: str) -> str:
         """生成实体模式匹配代码"""
         return f"""
@@ -103,12 +107,268 @@ class CodeGenerator:
             self.logger.error(f"代码生成失败: {str(e)}")
             return self._generate_fallback_code(analysis)
 
+    def _get_plan_prompt(self) -> str:
+        """获取查询计划生成的系统提示"""
+        return """你是一个时序知识图谱查询规划专家。请把问题翻译为JSON查询计划，不要输出Python代码。
+
+知识图谱为 (head, relation, tail, timestamp) 四元组，实体和关系用下划线连接，如 Juan_Carlos_I, Make_a_visit。
+
+计划由嵌套的算子组成，根节点必须是 project：
+- {"op": "entity", "role": "head"|"tail"|"any", "names": ["Qatar"], "input": 可选}  实体名称匹配（不区分大小写）
+- {"op": "relation", "relations": ["Make_a_visit", "Host_a_visit"], "input": 可选}  关系集合，按优先级排列，优先从候选关系中选择
+- {"op": "time", "cmp": "equal"|"before"|"after"|"same_month"|"same_year", "value": "2007-06", "input": ...}
+  也可以用 "ref": 子计划 代替 value，取子计划第一条记录的时间
+- {"op": "order", "input": ..., "desc": false}  按时间排序
+- {"op": "first", "input": ..., "n": 1} / {"op": "last", "input": ..., "n": 1}  最早 / 最晚的记录
+- {"op": "join", "left": ..., "right": ..., "left_on": "head", "right_on": "tail"}  实体连接
+- {"op": "same_period", "input": ..., "ref": ..., "granularity": "month"|"year"}  与参考事件同月 / 同年
+- {"op": "union", "inputs": [...]}  合并
+- {"op": "project", "input": ..., "field": "head"|"tail"|"timestamp", "time_level": "day"|"month"|"year", "exclude": [], "limit": 10}
+
+示例 - Who first visited Qatar?
+{"op": "project", "field": "head", "limit": 1, "input": {"op": "first", "input": {"op": "relation", "relations": ["Make_a_visit", "Host_a_visit"], "input": {"op": "entity", "role": "tail", "names": ["Qatar"]}}}}
+
+只输出JSON计划。"""
+
+    def generate_plan(self, question: str, analysis: Dict, quid: str, use_llm: bool = False):
+        """
+        生成查询计划（dict），由 PlanExecutor 在KG索引上原生执行；
+        问题分析没有给出实体、无法构造计划时返回 None，由调用方回退到 generate_code
+        """
+        qtype = analysis.get('qtype', 'equal')
+        try:
+            if use_llm and not self.client.available:
+                self.logger.warning("LLM服务熔断中，使用计划模板")
+            elif use_llm:
+                plan = self._generate_plan_with_llm(question, analysis)
+                if plan is not None:
+                    return plan
+
+            method_map = {
+                'equal': self._generate_equal_plan,
+                'first_last': self._generate_first_last_plan,
+                'before_after': self._generate_before_after_plan,
+                'equal_multi': self._generate_equal_multi_plan,
+                'before_last': self._generate_before_last_plan,
+                'after_first': self._generate_after_first_plan,
+            }
+            if qtype in method_map:
+                plan = method_map[qtype](question, analysis)
+            else:
+                plan = self._generate_fallback_plan(analysis)
+
+            if plan is not None:
+                validate_plan(plan)
+                self.logger.info(f"计划生成成功: {qtype}")
+            return plan
+
+        except PlanError as e:
+            self.logger.error(f"生成的计划格式错误: {e}")
+            return None
+        except CacheMissError:
+            raise
+        except Exception as e:
+            self.logger.error(f"计划生成失败: {str(e)}")
+            return None
+
+    def _plan_messages(self, question: str, analysis: Dict) -> List[Dict]:
+        """计划生成请求的消息"""
+        return [
+            {"role": "system", "content": self._get_plan_prompt()},
+            {"role": "user", "content": f"问题: {question}\n问题分析: {json.dumps(analysis, ensure_ascii=False)}"
+                                        f"{self._candidate_relations_prompt(question)}"}
+        ]
+
+    def _retrieve_relations(self, question: str) -> list:
+        """关系检索器给出的 top-k 候选关系（未设置检索器时为空）"""
+        if self.relation_retriever is None:
+            return []
+        return self.relation_retriever.top_k(question, self.relation_top_k)
+
+    def _candidate_relations_prompt(self, question: str) -> str:
+        """注入提示的候选关系"""
+        candidates = self._retrieve_relations(question)
+        return f"\n候选关系: {json.dumps(candidates, ensure_ascii=False)}" if candidates else ""
+
+    def _generate_plan_with_llm(self, question: str, analysis: Dict):
+        """由LLM生成查询计划，解析或校验失败时返回 None"""
+        try:
+            reply = self.client.chat(self._plan_messages(question, analysis), model=self.model, stage='plan',
+                                     temperature=0.1, max_tokens=1000)
+            plan = parse_plan(reply)
+            self.logger.info(f"LLM计划: {json.dumps(plan, ensure_ascii=False)}")
+            return plan
+        except CacheMissError:
+            raise
+        except Exception as e:
+            self.logger.warning(f"LLM计划生成失败，回退到模板: {str(e)}")
+            return None
+
+    async def generate_plan_async(self, question: str, analysis: Dict, quid: str, llm):
+        """
+        异步版本：通过 AsyncLLMClient 并发请求LLM生成计划，失败时回退到计划模板；
+        无法构造计划时返回 None
+        """
+        if not llm.available:
+            self.logger.warning("LLM服务熔断中，使用计划模板")
+            return self.generate_plan(question, analysis, quid)
+        try:
+            reply = await llm.chat(self._plan_messages(question, analysis), model=self.model, stage='plan',
+                                   temperature=0.1, max_tokens=1000)
+            plan = parse_plan(reply)
+            self.logger.info(f"LLM计划: {json.dumps(plan, ensure_ascii=False)}")
+            return plan
+        except CacheMissError:
+            raise
+        except Exception as e:
+            self.logger.warning(f"LLM计划生成失败，回退到模板: {str(e) or type(e).__name__}")
+        return self.generate_plan(question, analysis, quid)
+
+    def _entity_relation_union(self, entities: list, relations: list, time_value=None) -> Dict:
+        """每个实体作为tail、关系属于relations（可选时间相等）的记录，按实体顺序合并"""
+        branches = []
+        for entity in entities:
+            node = {'op': 'relation', 'relations': relations,
+                    'input': {'op': 'entity', 'role': 'tail', 'names': [entity]}}
+            if time_value:
+                node['input'] = {'op': 'time', 'cmp': 'equal', 'value': time_value, 'input': node['input']}
+            branches.append(node)
+        return {'op': 'union', 'inputs': branches}
+
+    def _generate_equal_plan(self, question: str, analysis: Dict) -> Dict:
+        """Equal类型: Who visited {tail} in {time}?"""
+        entities = analysis.get('entities', [])
+        time_constraints = analysis.get('time', [])
+        relations = self._map_relations_from_question(question)
+        target_time = time_constraints[0] if time_constraints else None
+
+        return {'op': 'project', 'field': 'head', 'limit': 1,
+                'input': self._entity_relation_union(entities, relations, target_time)}
+
+    def _generate_first_last_plan(self, question: str, analysis: Dict):
+        """First_Last类型: Who first visited {tail}? 或 When did X first visit Y?"""
+        entities = analysis.get('entities', [])
+        if not entities:
+            return None
+        relations = self._map_relations_from_question(question)
+
+        rows = {'op': 'entity', 'role': 'tail', 'names': [entities[0]]}
+        if len(entities) >= 2:
+            # 双实体查询: X first visit Y
+            rows = {'op': 'entity', 'role': 'head', 'names': [entities[0]],
+                    'input': {'op': 'entity', 'role': 'tail', 'names': [entities[1]]}}
+
+        plan = {'op': 'project', 'field': 'head', 'limit': 1,
+                'input': {'op': 'first', 'input': {'op': 'relation', 'relations': relations, 'input': rows}}}
+        if analysis.get('answer_type') == 'time':
+            plan['field'] = 'timestamp'
+            plan['time_level'] = analysis.get('time_level', 'day')
+        return plan
+
+    def _reference_event(self, target: str, reference: str, relations: list) -> Dict:
+        """
+        参考事件：reference 对 target 的最早一条同类记录；没有时取 reference 的最早一条任意记录
+        （time 算子的 ref 取子计划第一行，union 按顺序合并，前者为空时自然落到后者）
+        """
+        pair = {'op': 'relation', 'relations': relations,
+                'input': {'op': 'entity', 'role': 'head', 'names': [reference],
+                          'input': {'op': 'entity', 'role': 'tail', 'names': [target]}}}
+        return {'op': 'union', 'inputs': [
+            {'op': 'first', 'input': pair},
+            {'op': 'first', 'input': {'op': 'entity', 'role': 'any', 'names': [reference]}},
+        ]}
+
+    def _time_constrained(self, rows: Dict, cmp: str, analysis: Dict, relations: list) -> Dict:
+        """按问题给出的时间（优先）或第二个实体的参考事件对 rows 做 before / after 过滤，两者都没有时不过滤"""
+        entities = analysis.get('entities', [])
+        time_constraints = analysis.get('time', [])
+        if time_constraints:
+            return {'op': 'time', 'cmp': cmp, 'value': str(time_constraints[0]), 'input': rows}
+        if len(entities) >= 2:
+            return {'op': 'time', 'cmp': cmp, 'ref': self._reference_event(entities[0], entities[1], relations),
+                    'input': rows}
+        return rows
+
+    def _target_rows(self, entity: str, relations: list) -> Dict:
+        """entity 作为tail、关系属于relations的记录"""
+        return {'op': 'relation', 'relations': relations,
+                'input': {'op': 'entity', 'role': 'tail', 'names': [entity]}}
+
+    def _generate_before_after_plan(self, question: str, analysis: Dict):
+        """Before_After类型: Who visited {tail} before/after {time 或 实体}?"""
+        entities = analysis.get('entities', [])
+        if not entities:
+            return None
+        relations = self._map_relations_from_question(question)
+        cmp = 'after' if 'after' in question.lower() else 'before'
+
+        rows = self._time_constrained(self._target_rows(entities[0], relations), cmp, analysis, relations)
+        return {'op': 'project', 'field': 'head', 'limit': 15, 'input': rows}
+
+    def _generate_before_last_plan(self, question: str, analysis: Dict):
+        """Before_Last类型: Before {实体}, who was the last to condemn {tail}?"""
+        entities = analysis.get('entities', [])
+        if not entities:
+            return None
+        relations = self._map_relations_from_question(question)
+
+        rows = self._time_constrained(self._target_rows(entities[0], relations), 'before', analysis, relations)
+        return {'op': 'project', 'field': 'head', 'limit': 1, 'input': {'op': 'last', 'input': rows}}
+
+    def _generate_after_first_plan(self, question: str, analysis: Dict):
+        """After_First类型: Who was the first to ask for {tail} after {实体}?"""
+        entities = analysis.get('entities', [])
+        if not entities:
+            return None
+        relations = self._map_relations_from_question(question)
+
+        rows = self._time_constrained(self._target_rows(entities[0], relations), 'after', analysis, relations)
+        return {'op': 'project', 'field': 'head', 'limit': 1, 'input': {'op': 'first', 'input': rows}}
+
+    def _generate_equal_multi_plan(self, question: str, analysis: Dict):
+        """
+        Equal_Multi类型: Who did X visit in the same month as (X visited) Y?
+        两个实体间的最早一条同类记录为参考事件，答案为参考事件的head在同一时间段内的其他同类记录的tail；
+        只有一个实体时按equal类型处理
+        """
+        entities = analysis.get('entities', [])
+        if len(entities) < 2:
+            return self._generate_equal_plan(question, analysis) if entities else None
+        relations = self._map_relations_from_question(question)
+        granularity = analysis.get('time_level', 'month')
+        if granularity not in ('day', 'month', 'year'):
+            granularity = 'month'
+
+        # 实体在问题分析中的顺序不一定是主语在前，两个方向的记录都作为参考事件的候选
+        pair = {'op': 'union', 'inputs': [
+            {'op': 'entity', 'role': 'head', 'names': [a], 'input': {'op': 'entity', 'role': 'tail', 'names': [b]}}
+            for a, b in ((entities[0], entities[1]), (entities[1], entities[0]))]}
+        reference = {'op': 'first', 'input': {'op': 'relation', 'relations': relations, 'input': pair}}
+
+        subject_rows = {'op': 'join', 'left_on': 'head', 'right_on': 'head', 'right': reference,
+                        'left': {'op': 'relation', 'relations': relations,
+                                 'input': {'op': 'entity', 'role': 'head', 'names': entities[:2]}}}
+        return {'op': 'project', 'field': 'tail', 'limit': 10,
+                'exclude': [str(e).replace(' ', '_') for e in entities[:2]],
+                'input': {'op': 'time', 'cmp': 'equal', 'ref': reference, 'granularity': granularity,
+                          'input': subject_rows}}
+
+    def _generate_fallback_plan(self, analysis: Dict) -> Dict:
+        """备用查询计划"""
+        entities = analysis.get('key_entities', [])
+        relations = analysis.get('target_relations', [])
+        return {'op': 'project', 'field': 'head', 'limit': 15,
+                'input': self._entity_relation_union(entities, relations)}
+
     def _map_relations_from_question(self, question: str, kg_df=None) -> list:
-        """使用关系映射器从问题中提取关系"""
+        """
+        使用关系映射器从问题中提取关系；映射表中没有对应关键词时，
+        用关系检索器在完整关系词表上取 top-k 候选，仍为空才使用映射器的默认关系
+        """
         if kg_df is not None:
             return self.relation_mapper.suggest_relations_for_question(question, kg_df)
-        else:
-            return self.relation_mapper.map_from_question(question)
+        relations = self.relation_mapper.map_from_question(question, use_default=False)
+        return relations or self._retrieve_relations(question) or self.relation_mapper.map_from_question(question)
 
     def _generate_equal_code(self, question: str, analysis: Dict) -> str:
         """Equal类型: Who visited {tail} in {time}?"""
@@ -118,34 +378,27 @@ class CodeGenerator:
         
         code = f'''def query_kg(df):
     import pandas as pd
-    try:{self._ensure_data_types_code()}
-        
+    try:
         entities = {entities}
         relations = {relations}
         time_constraints = {time_constraints}
         results = []
         
-        # Equal查询: 在特定时间点的事件
-        if time_constraints:
-            target_time = time_constraints[0]
-            time_filter = df['timestamp'].str.startswith(target_time[:10])
-        else:
-            time_filter = pd.Series([True] * len(df))
+        # Equal查询: 在特定时间点的事件（按时间约束自身的粒度比较）
+        target_time = time_constraints[0] if time_constraints else None
         
         # 实体和关系匹配
         for entity in entities:
             entity_patterns = [entity, entity.replace(' ', '_'), entity.replace('_', ' ')]
             
             for pattern in entity_patterns:
+                candidates = select_rows('tail', pattern, relations, ('equal', target_time) if target_time else None)
+                
                 for relation in relations:
-                    mask = (
-                        time_filter &
-                        (df['tail'].str.contains(pattern, case=False, na=False)) &
-                        (df['relation'] == relation)
-                    )
+                    matched = candidates[candidates['relation'] == relation]
                     
-                    if mask.any():
-                        for _, row in df[mask].iterrows():
+                    if not matched.empty:
+                        for _, row in matched.iterrows():
                             result = row['head'].replace('_', ' ')
                             if result not in results:
                                 results.append(result)
@@ -166,8 +419,7 @@ class CodeGenerator:
         
         code = f'''def query_kg(df):
     import pandas as pd
-    try:{self._ensure_data_types_code()}
-        
+    try:
         entities = {entities}
         relations = {relations}
         answer_type = "{answer_type}"
@@ -179,36 +431,18 @@ class CodeGenerator:
             second_entity = entities[1] if len(entities) >= 2 else None
             
             entity_patterns = [target_entity, target_entity.replace(' ', '_'), target_entity.replace('_', ' ')]
-            all_records = []
             
-            for pattern in entity_patterns:
-                for relation in relations:
-                    if second_entity:
-                        # 双实体查询: X first visit Y
-                        second_patterns = [second_entity, second_entity.replace(' ', '_'), second_entity.replace('_', ' ')]
-                        for second_pattern in second_patterns:
-                            mask = (
-                                (df['head'].str.contains(pattern, case=False, na=False)) &
-                                (df['tail'].str.contains(second_pattern, case=False, na=False)) &
-                                (df['relation'] == relation)
-                            )
-                            if mask.any():
-                                all_records.extend(df[mask].to_dict('records'))
-                    else:
-                        # 单实体查询: Who first visited X
-                        mask = (
-                            (df['tail'].str.contains(pattern, case=False, na=False)) &
-                            (df['relation'] == relation)
-                        )
-                        if mask.any():
-                            all_records.extend(df[mask].to_dict('records'))
+            if second_entity:
+                # 双实体查询: X first visit Y
+                second_patterns = [second_entity, second_entity.replace(' ', '_'), second_entity.replace('_', ' ')]
+                first = first_record(relations, heads=entity_patterns, tails=second_patterns)
+            else:
+                # 单实体查询: Who first visited X
+                first = first_record(relations, tails=entity_patterns)
             
-            if all_records:
-                sorted_records = sorted(all_records, key=lambda x: x['timestamp'])
-                first_record = sorted_records[0]
-                
+            if first is not None:
                 if answer_type == 'time':
-                    timestamp = first_record['timestamp']
+                    timestamp = first['timestamp']
                     if time_level == 'year':
                         results.append(timestamp[:4])
                     elif time_level == 'month':
@@ -216,7 +450,7 @@ class CodeGenerator:
                     else:
                         results.append(timestamp[:10])
                 else:
-                    result = first_record['head'].replace('_', ' ')
+                    result = first['head'].replace('_', ' ')
                     results.append(result)
         
         return results[:1]
@@ -229,16 +463,13 @@ class CodeGenerator:
     def _generate_before_after_code(self, question: str, analysis: Dict) -> str:
         """Before_After类型查询 - 修复变量传递问题"""
         entities = analysis.get('entities', [])
+        # 关键词都未命中时使用的关系：检索到的候选关系，无检索器时为固定列表
+        default_relations = self._retrieve_relations(question) or ['Make_a_visit', 'Host_a_visit', 'Make_statement']
         
         code = f'''def query_kg(df):
     import pandas as pd
     import re
     try:
-        # 确保数据类型
-        for col in ['head', 'relation', 'tail', 'timestamp']:
-            if col in df.columns:
-                df[col] = df[col].astype(str)
-        
         entities = {entities}
         question = "{question}"  # 确保question变量在代码中定义
         results = []
@@ -261,16 +492,13 @@ class CodeGenerator:
         elif '2007' in question:
             cutoff_time = "2007-12-31"
         
-        # 步骤2: 应用时间过滤
+        # 步骤2: 时间过滤（作用在实体候选记录上）
+        time_window = None
         if cutoff_time:
             if 'after' in question_lower:
-                time_filter = df['timestamp'] > cutoff_time
+                time_window = ('after', cutoff_time)
             elif 'before' in question_lower:
-                time_filter = df['timestamp'] < cutoff_time
-            else:
-                time_filter = pd.Series([True] * len(df))
-        else:
-            time_filter = pd.Series([True] * len(df))
+                time_window = ('before', cutoff_time)
         
         # 步骤3: 基于问题内容确定关系类型
         target_relations = []
@@ -307,50 +535,33 @@ class CodeGenerator:
         elif 'condemn' in question_lower:
             target_relations = ['Criticize_or_denounce']
         else:
-            target_relations = ['Make_a_visit', 'Host_a_visit', 'Make_statement']
+            target_relations = {default_relations}
         
         # 步骤4: 实体匹配策略
         for entity in entities:
             # 策略1: 查找包含该实体名称的所有实体
-            entity_matches = []
-            
-            # 在head中查找
-            head_mask = df['head'].str.contains(entity, case=False, na=False)
-            if head_mask.any():
-                entity_matches.extend(df[head_mask]['head'].unique())
-            
-            # 在tail中查找  
-            tail_mask = df['tail'].str.contains(entity, case=False, na=False)
-            if tail_mask.any():
-                entity_matches.extend(df[tail_mask]['tail'].unique())
-            
-            entity_matches = list(set(entity_matches))
+            entity_matches = match_entities(entity)
             
             # 策略2: 对每个匹配的实体，查找相关关系
             for matched_entity in entity_matches[:8]:
+                as_tail = select_rows('tail', [matched_entity], target_relations, time_window, exact=True)
+                as_head = select_rows('head', [matched_entity], target_relations, time_window, exact=True)
+                
                 for relation in target_relations:
                     # 查找该实体作为tail的记录
-                    mask = (
-                        time_filter &
-                        (df['tail'] == matched_entity) &
-                        (df['relation'] == relation)
-                    )
+                    matched = as_tail[as_tail['relation'] == relation]
                     
-                    if mask.any():
-                        for _, row in df[mask].iterrows():
+                    if not matched.empty:
+                        for _, row in matched.iterrows():
                             result = row['head']
                             if result not in results:
                                 results.append(result)
                     
                     # 也查找该实体作为head的记录
-                    mask2 = (
-                        time_filter &
-                        (df['head'] == matched_entity) &
-                        (df['relation'] == relation)
-                    )
+                    matched2 = as_head[as_head['relation'] == relation]
                     
-                    if mask2.any():
-                        for _, row in df[mask2].iterrows():
+                    if not matched2.empty:
+                        for _, row in matched2.iterrows():
                             result = row['tail']
                             if result not in results:
                                 results.append(result)
@@ -366,17 +577,13 @@ class CodeGenerator:
                 elif 'military force' in question_lower:
                     relation_keywords = ['military', 'force']
                 
+                entity_candidates = select_rows('any', entity, time=time_window) if time_window else entity_rows('any', entity)
+                
                 for keyword in relation_keywords:
-                    broad_relation_mask = df['relation'].str.contains(keyword, case=False, na=False)
-                    broad_entity_mask = (
-                        df['head'].str.contains(entity, case=False, na=False) |
-                        df['tail'].str.contains(entity, case=False, na=False)
-                    )
-                    
-                    broad_mask = time_filter & broad_relation_mask & broad_entity_mask
+                    broad_mask = entity_candidates['relation'].str.contains(keyword, case=False, na=False)
                     
                     if broad_mask.any():
-                        sample = df[broad_mask].head(8)
+                        sample = entity_candidates[broad_mask].head(8)
                         for _, row in sample.iterrows():
                             if entity.lower() in row['tail'].lower():
                                 result = row['head']
@@ -404,11 +611,6 @@ class CodeGenerator:
         code = f'''def query_kg(df):
     import pandas as pd
     try:
-        # 确保数据类型
-        for col in ['head', 'relation', 'tail', 'timestamp']:
-            if col in df.columns:
-                df[col] = df[col].astype(str)
-        
         results = []
         print("Debug: 开始equal_multi查询")
         
@@ -419,13 +621,9 @@ class CodeGenerator:
         juan_patterns = ['Juan Carlos I', 'Juan_Carlos_I', 'carlos_i', 'Carlos_I']
         
         for pattern in juan_patterns:
-            juan_mask = (
-                df['head'].str.contains(pattern, case=False, na=False) |
-                df['tail'].str.contains(pattern, case=False, na=False)
-            )
+            found_entities = match_entities(pattern)
             
-            if juan_mask.any():
-                found_entities = list(df[juan_mask]['head'].unique()) + list(df[juan_mask]['tail'].unique())
+            if found_entities:
                 # 筛选真正包含Juan Carlos I的实体
                 for entity in found_entities:
                     if 'juan' in entity.lower() and 'carlos' in entity.lower() and 'i' in entity.lower():
@@ -440,13 +638,9 @@ class CodeGenerator:
             broad_patterns = ['Juan Carlos', 'juan carlos', 'Carlos']
             
             for pattern in broad_patterns:
-                broad_juan_mask = (
-                    df['head'].str.contains(pattern, case=False, na=False) |
-                    df['tail'].str.contains(pattern, case=False, na=False)
-                )
+                found_entities = match_entities(pattern)
                 
-                if broad_juan_mask.any():
-                    found_entities = list(df[broad_juan_mask]['head'].unique()) + list(df[broad_juan_mask]['tail'].unique())
+                if found_entities:
                     # 更宽松的匹配
                     for entity in found_entities:
                         if ('juan' in entity.lower() and 'carlos' in entity.lower()) or 'carlos' in entity.lower():
@@ -457,15 +651,7 @@ class CodeGenerator:
             print(f"Debug: 宽松搜索找到实体: {{juan_carlos_entities[:10]}}")
         
         # 查找Qatar相关实体
-        qatar_entities = []
-        qatar_mask = (
-            df['head'].str.contains('Qatar', case=False, na=False) |
-            df['tail'].str.contains('Qatar', case=False, na=False)
-        )
-        
-        if qatar_mask.any():
-            found_entities = list(df[qatar_mask]['head'].unique()) + list(df[qatar_mask]['tail'].unique())
-            qatar_entities = [e for e in found_entities if 'qatar' in e.lower()]
+        qatar_entities = [e for e in match_entities('Qatar') if 'qatar' in e.lower()]
         
         qatar_entities = list(set(qatar_entities))
         print(f"Debug: 找到Qatar相关实体: {{qatar_entities}}")
@@ -476,30 +662,31 @@ class CodeGenerator:
         
         # 扩大搜索范围，不限制实体数量
         for juan_entity in juan_carlos_entities:
+            juan_as_head = exact_rows('head', [juan_entity])
+            juan_as_tail = exact_rows('tail', [juan_entity])
+            
             for qatar_entity in qatar_entities:
                 for relation in visit_relations:
                     # Juan Carlos I访问Qatar
                     visit_mask = (
-                        (df['head'] == juan_entity) &
-                        (df['tail'] == qatar_entity) &
-                        (df['relation'] == relation)
+                        (juan_as_head['tail'] == qatar_entity) &
+                        (juan_as_head['relation'] == relation)
                     )
                     
                     if visit_mask.any():
-                        visit_record = df[visit_mask].iloc[0]
+                        visit_record = juan_as_head[visit_mask].iloc[0]
                         qatar_visit_time = visit_record['timestamp']
                         print(f"Debug: 找到{{juan_entity}}访问{{qatar_entity}}的时间: {{qatar_visit_time}}")
                         break
                     
                     # Qatar接待Juan Carlos I
                     host_mask = (
-                        (df['head'] == qatar_entity) &
-                        (df['tail'] == juan_entity) &
-                        (df['relation'] == relation)
+                        (juan_as_tail['head'] == qatar_entity) &
+                        (juan_as_tail['relation'] == relation)
                     )
                     
                     if host_mask.any():
-                        host_record = df[host_mask].iloc[0]
+                        host_record = juan_as_tail[host_mask].iloc[0]
                         qatar_visit_time = host_record['timestamp']
                         print(f"Debug: 找到{{qatar_entity}}接待{{juan_entity}}的时间: {{qatar_visit_time}}")
                         break
@@ -513,14 +700,15 @@ class CodeGenerator:
         if not qatar_visit_time:
             print("Debug: 尝试查找任何Juan Carlos I和Qatar的相关记录")
             for juan_entity in juan_carlos_entities:
+                juan_rows = exact_rows('any', [juan_entity])
                 for qatar_entity in qatar_entities:
                     any_relation_mask = (
-                        ((df['head'] == juan_entity) & (df['tail'] == qatar_entity)) |
-                        ((df['head'] == qatar_entity) & (df['tail'] == juan_entity))
+                        ((juan_rows['head'] == juan_entity) & (juan_rows['tail'] == qatar_entity)) |
+                        ((juan_rows['head'] == qatar_entity) & (juan_rows['tail'] == juan_entity))
                     )
                     
                     if any_relation_mask.any():
-                        any_record = df[any_relation_mask].iloc[0]
+                        any_record = juan_rows[any_relation_mask].iloc[0]
                         qatar_visit_time = any_record['timestamp']
                         print(f"Debug: 找到相关记录时间: {{qatar_visit_time}}")
                         break
@@ -537,16 +725,16 @@ class CodeGenerator:
         
         # 步骤4: 查找同月Juan Carlos I的其他访问
         for juan_entity in juan_carlos_entities:
+            juan_as_head = exact_rows('head', [juan_entity])
             for relation in visit_relations:
                 same_month_mask = (
-                    (df['head'] == juan_entity) &
-                    (df['relation'] == relation) &
-                    (df['timestamp'].str.startswith(qatar_month)) &
-                    (~df['tail'].isin(qatar_entities))  # 排除Qatar
+                    (juan_as_head['relation'] == relation) &
+                    time_mask(juan_as_head, 'same_month', qatar_visit_time) &
+                    (~juan_as_head['tail'].isin(qatar_entities))  # 排除Qatar
                 )
                 
                 if same_month_mask.any():
-                    same_month_visits = df[same_month_mask]
+                    same_month_visits = juan_as_head[same_month_mask]
                     print(f"Debug: 找到{{len(same_month_visits)}}个同月访问记录")
                     
                     for _, row in same_month_visits.iterrows():
@@ -572,11 +760,6 @@ class CodeGenerator:
         code = f'''def query_kg(df):
     import pandas as pd
     try:
-        # 确保数据类型
-        for col in ['head', 'relation', 'tail', 'timestamp']:
-            if col in df.columns:
-                df[col] = df[col].astype(str)
-        
         results = []
         print("Debug: 开始before_last查询")
         
@@ -591,13 +774,9 @@ class CodeGenerator:
         
         # 策略1: 查找完整匹配
         for brazil_pattern in brazil_patterns:
-            entity_mask = (
-                df['head'].str.contains(brazil_pattern, case=False, na=False) |
-                df['tail'].str.contains(brazil_pattern, case=False, na=False)
-            )
+            found_entities = match_entities(brazil_pattern)
             
-            if entity_mask.any():
-                found_entities = list(df[entity_mask]['head'].unique()) + list(df[entity_mask]['tail'].unique())
+            if found_entities:
                 # 查找包含农业/渔业/林业部的实体
                 for entity in found_entities:
                     entity_lower = entity.lower()
@@ -610,13 +789,9 @@ class CodeGenerator:
         
         # 查找这些实体相关的事件时间
         if brazil_entities:
-            brazil_mask = (
-                df['head'].isin(brazil_entities) |
-                df['tail'].isin(brazil_entities)
-            )
+            brazil_events = exact_rows('any', brazil_entities)
             
-            if brazil_mask.any():
-                brazil_events = df[brazil_mask]
+            if not brazil_events.empty:
                 # 使用第一个出现的时间作为参考
                 reference_time = brazil_events['timestamp'].min()
                 print(f"Debug: 参考时间设为{{reference_time}}")
@@ -628,15 +803,7 @@ class CodeGenerator:
         
         # 步骤2: 查找在参考时间之前，谴责France的记录
         # 查找所有包含France的实体（不限制数量）
-        france_entities = []
-        france_mask = (
-            df['head'].str.contains('France', case=False, na=False) |
-            df['tail'].str.contains('France', case=False, na=False)
-        )
-        
-        if france_mask.any():
-            found_entities = list(df[france_mask]['head'].unique()) + list(df[france_mask]['tail'].unique())
-            france_entities = [e for e in found_entities if 'france' in e.lower()]
+        france_entities = [e for e in match_entities('France') if 'france' in e.lower()]
         
         france_entities = list(set(france_entities))
         print(f"Debug: 找到France相关实体: {{len(france_entities)}}个")
@@ -650,33 +817,14 @@ class CodeGenerator:
             'Demand'
         ]
         
-        # 组合查询 - 查找在参考时间之前的谴责记录（不限制实体数量）
-        all_condemn_records = []
-        
+        # 组合查询 - 查找在参考时间之前最后一条谴责记录（不限制实体数量）
         print(f"Debug: 搜索{{len(france_entities)}}个France实体的谴责记录")
-        for france_entity in france_entities:  # 移除数量限制
-            for relation in condemn_relations:
-                before_mask = (
-                    (df['timestamp'] < reference_time) &
-                    (df['relation'] == relation) &
-                    (df['tail'] == france_entity)
-                )
-                
-                if before_mask.any():
-                    before_events = df[before_mask]
-                    print(f"Debug: 找到{{len(before_events)}}条对{{france_entity}}的{{relation}}记录")
-                    all_condemn_records.extend(before_events.to_dict('records'))
+        last_record_row = last_record(condemn_relations, tails=france_entities, before=reference_time, exact=True)
         
-        print(f"Debug: 总共找到{{len(all_condemn_records)}}条谴责记录")
-        
-        # 如果找到记录，按时间排序，取最后一个
-        if all_condemn_records:
-            sorted_records = sorted(all_condemn_records, key=lambda x: x['timestamp'])
-            last_record = sorted_records[-1]  # 最后一个（最晚的）
-            
-            result = last_record['head']
+        if last_record_row is not None:
+            result = last_record_row['head']
             results.append(result)
-            print(f"Debug: 找到最后一个谴责者: {{result}} (时间: {{last_record['timestamp']}})")
+            print(f"Debug: 找到最后一个谴责者: {{result}} (时间: {{last_record_row['timestamp']}})")
         
         # 如果没有找到，尝试更宽松的条件
         if not results:
@@ -684,16 +832,13 @@ class CodeGenerator:
             # 扩大时间范围和关系范围
             broad_time = "2015-01-01"  # 使用更大的时间范围
             broad_relations = ['Criticize', 'criticize', 'Accuse', 'accuse', 'Reject', 'reject']
+            france_rows = select_rows('tail', 'France', time=('before', broad_time))
             
             for broad_relation in broad_relations:
-                broad_mask = (
-                    (df['timestamp'] < broad_time) &
-                    (df['relation'].str.contains(broad_relation, case=False, na=False)) &
-                    (df['tail'].str.contains('France', case=False, na=False))
-                )
+                broad_mask = france_rows['relation'].str.contains(broad_relation, case=False, na=False)
                 
                 if broad_mask.any():
-                    broad_events = df[broad_mask].sort_values('timestamp')
+                    broad_events = france_rows[broad_mask].sort_values('day', kind='stable')
                     last_event = broad_events.iloc[-1]  # 最后一个
                     result = last_event['head']
                     results.append(result)
@@ -718,8 +863,7 @@ class CodeGenerator:
         
         code = f'''def query_kg(df):
     import pandas as pd
-    try:{self._ensure_data_types_code()}
-        
+    try:
         entities = {entities}
         relations = {relations}
         results = []
@@ -728,14 +872,12 @@ class CodeGenerator:
             entity_patterns = [entity, entity.replace(' ', '_'), entity.replace('_', ' ')]
             
             for pattern in entity_patterns:
+                candidates = select_rows('tail', pattern, relations)
                 for relation in relations:
-                    mask1 = (
-                        (df['tail'].str.contains(pattern, case=False, na=False)) & 
-                        (df['relation'] == relation)
-                    )
+                    mask1 = candidates['relation'] == relation
                     
                     if mask1.any():
-                        for _, row in df[mask1].iterrows():
+                        for _, row in candidates[mask1].iterrows():
                             result = row['head'].replace('_', ' ')
                             if result not in results:
                                 results.append(result)
@@ -753,11 +895,6 @@ class CodeGenerator:
         code = f'''def query_kg(df):
     import pandas as pd
     try:
-        # 确保数据类型
-        for col in ['head', 'relation', 'tail', 'timestamp']:
-            if col in df.columns:
-                df[col] = df[col].astype(str)
-        
         results = []
         print("Debug: 开始after_first查询")
         
@@ -769,27 +906,16 @@ class CodeGenerator:
         algeria_entities = []
         for pattern in algeria_patterns:
             # 查找实体名称中包含该模式的
-            entity_mask = (
-                df['head'].str.contains(pattern, case=False, na=False) |
-                df['tail'].str.contains(pattern, case=False, na=False)
-            )
-            
-            if entity_mask.any():
-                found_entities = list(df[entity_mask]['head'].unique()) + list(df[entity_mask]['tail'].unique())
-                algeria_entities.extend([e for e in found_entities if pattern.lower() in e.lower()])
+            algeria_entities.extend(match_entities(pattern))
         
         algeria_entities = list(set(algeria_entities))
         print(f"Debug: 找到阿尔及利亚相关实体: {{algeria_entities[:3]}}")
         
         # 查找这些实体相关的事件时间
         if algeria_entities:
-            algeria_mask = (
-                df['head'].isin(algeria_entities) |
-                df['tail'].isin(algeria_entities)
-            )
+            algeria_events = exact_rows('any', algeria_entities)
             
-            if algeria_mask.any():
-                algeria_events = df[algeria_mask]
+            if not algeria_events.empty:
                 reference_time = algeria_events['timestamp'].min()
                 print(f"Debug: 参考时间设为{{reference_time}}")
         
@@ -799,15 +925,7 @@ class CodeGenerator:
         
         # 步骤2: 查找在参考时间之后，向France提出请求的记录
         # 查找包含France的实体
-        france_entities = []
-        france_mask = (
-            df['head'].str.contains('France', case=False, na=False) |
-            df['tail'].str.contains('France', case=False, na=False)
-        )
-        
-        if france_mask.any():
-            found_entities = list(df[france_mask]['head'].unique()) + list(df[france_mask]['tail'].unique())
-            france_entities = [e for e in found_entities if 'france' in e.lower()]
+        france_entities = [e for e in match_entities('France') if 'france' in e.lower()]
         
         france_entities = list(set(france_entities))
         print(f"Debug: 找到法国相关实体: {{france_entities[:3]}}")
@@ -829,16 +947,10 @@ class CodeGenerator:
         # 组合查询
         for france_entity in france_entities[:3]:
             for relation in ask_relations:
-                after_mask = (
-                    (df['timestamp'] > reference_time) &
-                    (df['relation'] == relation) &
-                    (df['tail'] == france_entity)
-                )
+                first_event = first_record([relation], tails=[france_entity], after=reference_time, exact=True)
                 
-                if after_mask.any():
+                if first_event is not None:
                     print(f"Debug: 找到向{{france_entity}}的{{relation}}记录")
-                    after_events = df[after_mask].sort_values('timestamp')
-                    first_event = after_events.iloc[0]
                     result = first_event['head']
                     
                     # 清理结果
@@ -858,14 +970,11 @@ class CodeGenerator:
         # 如果没有找到，尝试更宽松的条件
         if not results:
             print("Debug: 尝试宽松条件")
-            broad_mask = (
-                (df['timestamp'] > reference_time) &
-                (df['relation'].str.contains('Appeal', case=False, na=False)) &
-                (df['tail'].str.contains('France', case=False, na=False))
-            )
+            france_rows = select_rows('tail', 'France', time=('after', reference_time))
+            broad_mask = france_rows['relation'].str.contains('Appeal', case=False, na=False)
             
             if broad_mask.any():
-                broad_events = df[broad_mask].sort_values('timestamp')
+                broad_events = france_rows[broad_mask].sort_values('day', kind='stable')
                 first_event = broad_events.iloc[0]
                 result = first_event['head']
                 
@@ -7,13 +7,15 @@ import os
 DEEPSEEK_CONFIG = {
     "api_key": os.environ.get("OPENROUTER_API_KEY"),  # 请替换为你的API密钥
     # "base_url": "https://api.deepseek.com",
-    "base_url": "https://openrouter.ai/api/v1",  
+    "base_url": os.environ.get("LLM_BASE_URL", "https://openrouter.ai/api/v1"),  # 可通过 LLM_BASE_URL 指向本地模拟服务（main/mock_llm_server.py）
     "model": "qwen/qwen3-coder:free"
 }
 
 # 文件路径配置
 PATHS = {
     "kg_path": "MY/data/output/full_df.txt",  # 知识图谱文件路径
+    "kg_snapshot_path": "MY/data/output/kg_snapshot",  # 知识图谱二进制快照目录（由 data/multitq/table.py 构建）
+    "llm_cache_path": "MY/cache/llm_cache.sqlite",  # LLM响应缓存（SQLite），设为None禁用缓存
     "questions_path": "MY/data/multitq/questions/sample_20_questions.json",  # 问题文件路径
     "output_dir": "MY/results"  # 输出目录
 }
@@ -21,9 +23,42 @@ PATHS = {
 # 实验配置
 EXPERIMENT_CONFIG = {
     "max_questions": 10,  # 最大处理问题数，0表示处理所有问题
-    "save_interval": 5,   # 每处理多少个问题保存一次中间结果
-    "timeout": 30,        # 单个查询超时时间（秒）
-    "max_retries": 3      # 最大重试次数
+    "question_qtypes": None,        # 只处理这些问题类型（如 ["equal", "before_after"]），None 表示不过滤
+    "question_answer_types": None,  # 只处理这些答案类型（entity / time），None 表示不过滤
+    "question_time_levels": None,   # 只处理这些时间粒度（day / month / year），None 表示不过滤
+    "save_interval": 5,   # 结果逐条追加写入，每写入多少个问题 fsync 一次
+    "timeout": 30,        # 单次LLM调用的截止时间（秒），包含限流与并发排队及全部重试
+    "max_retries": 3,     # LLM调用失败（超时/连接错误/429/5xx）的最大重试次数
+    "retry_backoff_base": 0.5,    # 重试退避基数（秒），第n次重试等待 [0, base*2^n] 内的随机时长
+    "retry_backoff_max": 8.0,     # 单次退避等待上限（秒）
+    "breaker_threshold": 5,       # 连续失败多少次调用后熔断（熔断期间回退到规则分析/计划模板）
+    "breaker_reset": 30.0,        # 熔断冷却时间（秒），之后放行请求试探服务是否恢复
+    "use_llm_plan": False,  # 是否由LLM生成查询计划（否则使用计划模板）
+    "analysis_mode": "dataset",   # 问题分析：dataset 直接使用数据集信息；llm 每个问题一次LLM分析；llm_batch 多个问题合并为一次请求
+    "analysis_batch_size": 10,    # llm_batch 模式下每次请求分析的问题数
+    "log_plan_decisions": False,  # 是否以INFO级别记录查询规划器的访问路径选择
+    "relation_top_k": 8,          # 每个问题检索的候选关系数（注入计划提示；关系映射表未覆盖时用于查询模板）
+    "num_workers": 0,             # 并行处理问题的进程数（fork 共享只读KG与索引），0 或 1 表示顺序处理
+    "max_concurrency": 8,         # 同时在途的LLM请求数上限（开启自适应并发时为初始值；多进程时为每个进程的上限）
+    "adaptive_concurrency": False,  # 按观测到的延迟、错误率与 429 / 超时自动调整并发上限（AIMD）
+    "adaptive_min_concurrency": 1,
+    "adaptive_max_concurrency": 64,
+    "adaptive_latency_p95": None,   # p95 延迟目标（秒），超过即下调并发；None表示取基线 p95 的2倍
+    "hedge_requests": False,      # 请求对冲：超过该阶段近期延迟的分位数仍未返回时再发一份相同请求，取先返回的
+    "hedge_percentile": 90,       # 发出对冲请求的延迟分位数
+    "hedge_budget": 0.1,          # 对冲请求数占总请求数的比例上限
+    "hedge_min_samples": 20,      # 阶段内成功请求少于该数时不对冲
+    "requests_per_second": 0,     # LLM请求速率上限（令牌桶），0表示不限流
+    "rate_burst": None,           # 令牌桶容量（允许的突发请求数），None表示与速率相同
+    "llm_cache_max_mb": 512,      # LLM响应缓存容量上限（MB），超出后按最近访问时间淘汰
+    "llm_replay": False,          # 离线回放：只读缓存，未命中直接失败而不请求LLM
+    "stream_llm": True,           # 生成代码的LLM调用使用流式接收，完整的 query_kg 代码块到达后立即结束生成
+    "speculative_templates": False,  # ex1：有模板的问题类型先执行查询模板并同时启动LLM流程，模板答案可信时取消LLM调用
+    "speculative_max_answers": 5,    # 不截断答案的模板（before_after / equal_multi）答案数超过该值视为匹配过宽，等待LLM流程
+    "llm_prices": {               # 各模型每百万token的[输入, 输出]价格，用于估算调用成本（按实际计费修改）
+        "deepseek-reasoner": [0.55, 2.19],
+        "deepseek-chat": [0.27, 1.10],
+    }
 }
 
 # 日志配置
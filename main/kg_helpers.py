@@ -0,0 +1,130 @@
+"""
+KG查询辅助函数模块 - 生成的查询代码使用的实体匹配 / 时间过滤 / 首末记录函数
+
+由 QueryExecutor 为每次执行绑定到当前的知识图谱，并通过 exec 的全局变量注入，
+生成的代码直接调用 select_rows / first_record 等函数，不再在每段代码中重复定义
+"""
+import pandas as pd
+from typing import Dict
+
+from .time_utils import time_mask
+
+
+class KGHelpers:
+    """绑定到 df（只读视图）及可选的 KGQuadStore / KGIndex / QueryPlanner 的查询辅助函数"""
+
+    NAMES = ('time_filter', 'time_partition', 'entity_rows', 'select_rows', 'exact_rows',
+             'match_entities', 'time_ordered', 'first_record', 'last_record')
+
+    def __init__(self, df: pd.DataFrame, kg=None, kg_index=None, kg_planner=None):
+        self.df = df
+        self.kg = kg
+        self.kg_index = kg_index
+        self.kg_planner = kg_planner
+
+    def namespace(self) -> Dict:
+        """注入 exec 全局变量的函数表"""
+        return {name: getattr(self, name) for name in self.NAMES}
+
+    def time_filter(self, frame, op, value, granularity=None):
+        """整数时间列(day/month/year)上的向量化过滤，op为equal/before/after/same_month/same_year"""
+        return frame[time_mask(frame, op, value, granularity)]
+
+    def time_partition(self, op, value, granularity=None):
+        """分区裁剪：行按时间排序，只取满足时间谓词的连续行区间；无kg时回退为整表过滤"""
+        if self.kg is not None:
+            start, end = self.kg.time_range(op, value, granularity)
+            return self.df.iloc[start:end]
+        return self.time_filter(self.df, op, value, granularity)
+
+    def entity_rows(self, col, pattern):
+        """col位置（head/tail/any）名称包含pattern的记录，保持原始行顺序"""
+        df = self.df
+        if self.kg_index is not None:
+            return df.iloc[self.kg_index.entity_rows(col, pattern)]
+        cols = ['head', 'tail'] if col == 'any' else [col]
+        mask = pd.Series(False, index=df.index)
+        for c in cols:
+            mask |= df[c].str.contains(pattern, case=False, na=False, regex=False)
+        return df[mask]
+
+    def select_rows(self, col, entities, relations=None, time=None, exact=False):
+        """
+        col位置（head/tail/any）实体、关系集合与时间谓词(op, value)的合取，保持原始行顺序；
+        有kg_planner时按基数估计选择最有选择性的访问路径
+        """
+        if self.kg_planner is not None:
+            key = {'head': 'heads', 'tail': 'tails', 'any': 'entities'}[col]
+            return self.df.iloc[self.kg_planner.select(relations=relations, time=time, exact=exact, **{key: entities})]
+        if self.kg_index is not None:
+            frame = self.exact_rows(col, entities) if exact else self.entity_rows(col, entities)
+            if time is not None:
+                frame = self.time_filter(frame, *time)
+        else:
+            # 无索引时先裁剪时间分区，只扫描时间窗口内的记录
+            frame = self.time_partition(*time) if time is not None else self.df
+            cols = ['head', 'tail'] if col == 'any' else [col]
+            mask = pd.Series(False, index=frame.index)
+            for c in cols:
+                if exact:
+                    mask |= frame[c].isin(list(entities))
+                else:
+                    mask |= frame[c].str.contains(entities, case=False, na=False, regex=False)
+            frame = frame[mask]
+        if relations is not None:
+            frame = frame[frame['relation'].isin(relations)]
+        return frame
+
+    def exact_rows(self, col, names):
+        """col位置（head/tail/any）恰为names中实体的记录"""
+        df = self.df
+        if self.kg_index is not None:
+            return df.iloc[self.kg_index.entity_rows(col, list(names))]
+        cols = ['head', 'tail'] if col == 'any' else [col]
+        mask = pd.Series(False, index=df.index)
+        for c in cols:
+            mask |= df[c].isin(list(names))
+        return df[mask]
+
+    def match_entities(self, pattern):
+        """名称包含pattern的实体"""
+        if self.kg_index is not None:
+            return self.kg_index.match_entities(pattern)
+        heads = self.entity_rows('head', pattern)['head']
+        tails = self.entity_rows('tail', pattern)['tail']
+        return list(set(heads) | set(tails))
+
+    def time_ordered(self, relations, heads=None, tails=None, exact=False, time=None):
+        """无索引时的回退实现：在时间分区内匹配记录，按时间稳定排序"""
+        frame = self.time_partition(*time) if time is not None else self.df
+        frame = frame[frame['relation'].isin(relations)]
+        for col, spec in (('head', heads), ('tail', tails)):
+            if spec is not None:
+                if exact:
+                    frame = frame[frame[col].isin(list(spec))]
+                else:
+                    mask = pd.Series(False, index=frame.index)
+                    for p in spec:
+                        mask |= frame[col].str.contains(p, case=False, na=False, regex=False)
+                    frame = frame[mask]
+        return frame.sort_values('day', kind='stable')
+
+    def first_record(self, relations, heads=None, tails=None, after=None, exact=False):
+        """时间最早（且晚于after）的记录；heads/tails为匹配模式列表，exact=True时为精确实体名列表"""
+        kg_index = self.kg_index
+        if kg_index is not None:
+            row = kg_index.first_row(relations, kg_index.entity_ids(heads, exact), kg_index.entity_ids(tails, exact),
+                                     after=after)
+            return None if row < 0 else self.df.iloc[row]
+        frame = self.time_ordered(relations, heads, tails, exact, None if after is None else ('after', after))
+        return None if frame.empty else frame.iloc[0]
+
+    def last_record(self, relations, heads=None, tails=None, before=None, exact=False):
+        """时间最晚（且早于before）的记录"""
+        kg_index = self.kg_index
+        if kg_index is not None:
+            row = kg_index.last_row(relations, kg_index.entity_ids(heads, exact), kg_index.entity_ids(tails, exact),
+                                    before=before)
+            return None if row < 0 else self.df.iloc[row]
+        frame = self.time_ordered(relations, heads, tails, exact, None if before is None else ('before', before))
+        return None if frame.empty else frame.iloc[-1]
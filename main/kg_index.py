@@ -0,0 +1,273 @@
+"""
+知识图谱索引模块 - 加载时构建一次，供生成的查询代码解析实体匹配
+"""
+import numpy as np
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from .kg_store import KGQuadStore
+from .time_utils import period_day_bounds
+
+
+def _build_postings(column: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """按id构建CSR形式的倒排表：rows[offsets[i]:offsets[i+1]] 为id=i出现的行号（升序）"""
+    order = np.argsort(column, kind='stable').astype(np.int32)
+    counts = np.bincount(column, minlength=size)
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, order
+
+
+def normalize_entity_name(name: str) -> str:
+    """统一大小写与分隔符，使 "Juan Carlos" 能匹配 Juan_Carlos_I"""
+    return name.lower().replace('_', ' ')
+
+
+class EntityNameIndex:
+    """实体词表上的三元组（trigram）索引，支持不区分大小写的包含查询"""
+
+    GRAM = 3
+
+    def __init__(self, names: List[str]):
+        self._names = [normalize_entity_name(name) for name in names]
+
+        grams = defaultdict(list)
+        for entity_id, name in enumerate(self._names):
+            for gram in self._grams(name):
+                grams[gram].append(entity_id)
+        self._grams_index = {gram: np.array(ids, dtype=np.int64) for gram, ids in grams.items()}
+
+    @classmethod
+    def _grams(cls, text: str) -> set:
+        return {text[i:i + cls.GRAM] for i in range(len(text) - cls.GRAM + 1)}
+
+    def contains(self, query: str) -> np.ndarray:
+        """名称包含 query 的实体id（升序）"""
+        query = normalize_entity_name(query)
+        if len(query) < self.GRAM:
+            return np.array([i for i, name in enumerate(self._names) if query in name], dtype=np.int64)
+
+        # 从最短的倒排表开始求交，候选集为空时提前结束
+        postings = sorted((self._grams_index.get(g) for g in self._grams(query)),
+                          key=lambda p: -1 if p is None else len(p))
+        if postings[0] is None:
+            return np.empty(0, dtype=np.int64)
+        candidates = postings[0]
+        for posting in postings[1:]:
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+            if len(candidates) == 0:
+                return candidates
+
+        # trigram 命中只是必要条件，最后逐个校验
+        return np.array([i for i in candidates if query in self._names[i]], dtype=np.int64)
+
+
+class _TimePostings:
+    """按组合键分组、组内按时间排序的倒排表"""
+
+    def __init__(self, keys: np.ndarray, days: np.ndarray):
+        order = np.lexsort((days, keys))
+        sorted_keys = keys[order]
+        self.keys, starts = np.unique(sorted_keys, return_index=True)
+        self.offsets = np.append(starts, len(sorted_keys))
+        self.rows = order.astype(np.int32)
+        self.days = days[order]
+
+    def lookup(self, key: int) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (days, rows)，days 升序；键不存在时为空数组"""
+        i = np.searchsorted(self.keys, key)
+        if i >= len(self.keys) or self.keys[i] != key:
+            return self.days[:0], self.rows[:0]
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        return self.days[lo:hi], self.rows[lo:hi]
+
+
+class TemporalIndex:
+    """
+    时间有序的 (head, relation) / (relation, tail) / (head, relation, tail) 倒排表
+
+    first / last 都在组内二分查找，不再对候选记录整体排序。
+    时间均为日序数（KGQuadStore.days），after / before 为开区间。
+    """
+
+    # 头尾实体组合数超过该值时，改为查 (head, relation) 再过滤 tail
+    MAX_PAIR_LOOKUPS = 4096
+
+    def __init__(self, store: KGQuadStore, day_ordinals: np.ndarray):
+        self.num_relations = len(store.relation_names)
+        self.num_entities = len(store.entity_names)
+        heads = store.heads.astype(np.int64)
+        relations = store.relations.astype(np.int64)
+        tails = store.tails.astype(np.int64)
+        self._tails = store.tails
+
+        self.by_head = _TimePostings(heads * self.num_relations + relations, day_ordinals)
+        self.by_tail = _TimePostings(relations * self.num_entities + tails, day_ordinals)
+        self.by_pair = _TimePostings((heads * self.num_relations + relations) * self.num_entities + tails, day_ordinals)
+
+    def _postings(self, relation_ids, head_ids=None, tail_ids=None):
+        """遍历所有 (实体, 关系) 组合对应的 (days, rows)"""
+        if head_ids is None and tail_ids is None:
+            raise ValueError("至少需要指定 head 或 tail 实体")
+        relation_ids = np.unique(relation_ids)
+        head_ids = None if head_ids is None else np.unique(head_ids)
+        tail_ids = None if tail_ids is None else np.unique(tail_ids)
+
+        if head_ids is not None and tail_ids is not None and \
+                len(head_ids) * len(tail_ids) <= self.MAX_PAIR_LOOKUPS:
+            for h in head_ids:
+                for r in relation_ids:
+                    for t in tail_ids:
+                        yield self.by_pair.lookup((h * self.num_relations + r) * self.num_entities + t)
+            return
+
+        if head_ids is not None:
+            for h in head_ids:
+                for r in relation_ids:
+                    days, rows = self.by_head.lookup(h * self.num_relations + r)
+                    if tail_ids is not None and len(rows):
+                        keep = np.isin(self._tails[rows], tail_ids)
+                        days, rows = days[keep], rows[keep]
+                    yield days, rows
+        else:
+            for r in relation_ids:
+                for t in tail_ids:
+                    yield self.by_tail.lookup(r * self.num_entities + t)
+
+    def first(self, relation_ids, head_ids=None, tail_ids=None, after=None) -> int:
+        """时间最早（且晚于 after）的记录行号，不存在时返回 -1"""
+        best = None
+        for days, rows in self._postings(relation_ids, head_ids, tail_ids):
+            i = 0 if after is None else np.searchsorted(days, after, side='right')
+            if i < len(days):
+                candidate = (days[i], rows[i])
+                if best is None or candidate < best:
+                    best = candidate
+        return -1 if best is None else int(best[1])
+
+    def last(self, relation_ids, head_ids=None, tail_ids=None, before=None) -> int:
+        """时间最晚（且早于 before）的记录行号，不存在时返回 -1"""
+        best = None
+        for days, rows in self._postings(relation_ids, head_ids, tail_ids):
+            i = len(days) if before is None else np.searchsorted(days, before, side='left')
+            if i > 0:
+                # 组内按 (时间, 行号) 排序，i-1 即同一天内行号最大的记录
+                candidate = (days[i - 1], rows[i - 1])
+                if best is None or candidate > best:
+                    best = candidate
+        return -1 if best is None else int(best[1])
+
+
+
+class KGIndex:
+    """
+    实体倒排索引：实体 -> 作为 head / tail 出现的有序行号；实体名的模糊匹配由 EntityNameIndex 在词表上完成。
+    另有关系倒排表；时间条件直接使用按时间排序的行区间（KGQuadStore.time_range），供 QueryPlanner 选择访问路径
+    """
+
+    ROLES = ('head', 'tail')
+
+    def __init__(self, store: KGQuadStore):
+        self.store = store
+        self.num_rows = len(store)
+        num_entities = len(store.entity_names)
+
+        self._postings = {
+            'head': _build_postings(store.heads, num_entities),
+            'tail': _build_postings(store.tails, num_entities),
+            'relation': _build_postings(store.relations, len(store.relation_names)),
+        }
+        self.names = EntityNameIndex(store.entity_names)
+        self._match_cache: Dict[str, np.ndarray] = {}
+
+        self.temporal = TemporalIndex(store, store.days)
+
+    def rows_for_id(self, role: str, entity_id: int) -> np.ndarray:
+        """单个实体在指定位置出现的行号"""
+        offsets, rows = self._postings[role]
+        return rows[offsets[entity_id]:offsets[entity_id + 1]]
+
+    def relation_rows(self, relation_ids) -> np.ndarray:
+        """关系属于 relation_ids 的有序行号"""
+        parts = [self.rows_for_id('relation', i) for i in np.unique(relation_ids)]
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        return parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+
+    def degree(self, role: str, entity_ids: np.ndarray) -> np.ndarray:
+        """实体在指定位置出现的次数"""
+        offsets, _ = self._postings[role]
+        entity_ids = np.asarray(entity_ids, dtype=np.int64)
+        return offsets[entity_ids + 1] - offsets[entity_ids]
+
+    def match_entity_ids(self, pattern: str) -> np.ndarray:
+        """名称中包含 pattern（不区分大小写，空格与下划线等价）的实体id"""
+        key = normalize_entity_name(pattern)
+        if key not in self._match_cache:
+            self._match_cache[key] = self.names.contains(key)
+        return self._match_cache[key]
+
+    def _resolve_ids(self, entities) -> np.ndarray:
+        """entities 可以是匹配模式字符串，也可以是精确实体名列表"""
+        if isinstance(entities, str):
+            return self.match_entity_ids(entities)
+        ids = [self.store.entity_id(name) for name in entities]
+        return np.array([i for i in ids if i >= 0], dtype=np.int64)
+
+    def entity_ids(self, entities, exact: bool = False):
+        """模式列表中任一模式匹配的实体id；exact=True 时按实体名精确匹配，None 表示不限"""
+        if entities is None:
+            return None
+        if isinstance(entities, str):
+            entities = [entities]
+        if exact:
+            return self._resolve_ids(entities)
+        parts = [self.match_entity_ids(p) for p in entities]
+        return np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+
+    def relation_ids(self, relations) -> np.ndarray:
+        """关系名列表 -> 关系id（忽略KG中不存在的关系）"""
+        ids = [self.store.relation_id(name) for name in relations]
+        return np.array([i for i in ids if i >= 0], dtype=np.int64)
+
+    @staticmethod
+    def time_ordinal(timestamp: str, side: str) -> int:
+        """
+        时间表达 -> 开区间日序数边界，按表达自身的粒度解释：
+        side='after' 返回该时间段最后一天（晚于整个时间段），side='before' 返回第一天
+        """
+        first_day, last_day = period_day_bounds(timestamp)
+        return last_day if side == 'after' else first_day
+
+    def first_row(self, relations, head_ids=None, tail_ids=None, after: str = None) -> int:
+        """时间最早（且晚于 after）的匹配记录行号，不存在时返回 -1"""
+        bound = None if after is None else self.time_ordinal(after, 'after')
+        return self.temporal.first(self.relation_ids(relations), head_ids, tail_ids, after=bound)
+
+    def last_row(self, relations, head_ids=None, tail_ids=None, before: str = None) -> int:
+        """时间最晚（且早于 before）的匹配记录行号，不存在时返回 -1"""
+        bound = None if before is None else self.time_ordinal(before, 'before')
+        return self.temporal.last(self.relation_ids(relations), head_ids, tail_ids, before=bound)
+
+    def entity_rows(self, role: str, entities) -> np.ndarray:
+        """匹配实体在 head / tail / any 位置出现的有序行号"""
+        return self.rows_for_ids(role, self._resolve_ids(entities))
+
+    def rows_for_ids(self, role: str, entity_ids) -> np.ndarray:
+        """一组实体在 head / tail / any 位置出现的有序行号"""
+        roles = self.ROLES if role == 'any' else (role,)
+        parts = [self.rows_for_id(r, i) for r in roles for i in entity_ids]
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        if len(parts) == 1:
+            return parts[0]
+        return np.unique(np.concatenate(parts))
+
+    def match_entities(self, pattern: str, role: str = 'any') -> List[str]:
+        """名称包含 pattern 且在指定位置出现过的实体名"""
+        entity_ids = self.match_entity_ids(pattern)
+        roles = self.ROLES if role == 'any' else (role,)
+        present = np.zeros(len(entity_ids), dtype=bool)
+        for r in roles:
+            present |= self.degree(r, entity_ids) > 0
+        return [self.store.entity_names[i] for i in entity_ids[present]]
@@ -0,0 +1,76 @@
+"""
+知识图谱统计模块 - 加载时收集基数统计，供 QueryPlanner 估计各访问路径的代价
+"""
+import numpy as np
+from typing import Dict
+
+from .kg_store import KGQuadStore
+
+
+class KGStatistics:
+    """
+    实体度数、关系计数、年份直方图与关系的 head / tail 扇出
+
+    扇出指某关系下每个 head（或 tail）平均对应的记录数，
+    用于估计"已知一端实体 + 关系"时的结果规模。
+    """
+
+    def __init__(self, store: KGQuadStore):
+        num_entities = len(store.entity_names)
+        num_relations = len(store.relation_names)
+        self.num_facts = len(store)
+        self.relation_names = store.relation_names
+
+        self.head_degree = np.bincount(store.heads, minlength=num_entities)
+        self.tail_degree = np.bincount(store.tails, minlength=num_entities)
+        self.relation_counts = np.bincount(store.relations, minlength=num_relations)
+
+        years = store.years
+        valid = years >= 0
+        self.invalid_time_count = int((~valid).sum())
+        self.min_year = int(years[valid].min()) if valid.any() else 0
+        self.max_year = int(years[valid].max()) if valid.any() else -1
+        self.year_counts = np.bincount(years[valid] - self.min_year, minlength=self.max_year - self.min_year + 1)
+
+        # 每个关系下不同 head / tail 的数量
+        relations = store.relations.astype(np.int64)
+        distinct_heads = np.bincount(
+            np.unique(relations * num_entities + store.heads) // num_entities, minlength=num_relations)
+        distinct_tails = np.bincount(
+            np.unique(relations * num_entities + store.tails) // num_entities, minlength=num_relations)
+        self.head_fanout = self.relation_counts / np.maximum(distinct_heads, 1)
+        self.tail_fanout = self.relation_counts / np.maximum(distinct_tails, 1)
+
+    def entity_degree(self, role: str, entity_ids) -> int:
+        """实体在 head / tail / any 位置出现的总次数"""
+        entity_ids = np.asarray(entity_ids, dtype=np.int64)
+        degree = 0
+        if role in ('head', 'any'):
+            degree += int(self.head_degree[entity_ids].sum())
+        if role in ('tail', 'any'):
+            degree += int(self.tail_degree[entity_ids].sum())
+        return degree
+
+    def relation_count(self, relation_ids) -> int:
+        """关系集合的记录总数"""
+        return int(self.relation_counts[np.unique(np.asarray(relation_ids, dtype=np.int64))].sum())
+
+    def year_count(self, first_year: int = None, last_year: int = None) -> int:
+        """年份落在闭区间内的记录数；下界无界时包含无法解析的时间戳"""
+        lo = self.min_year if first_year is None else max(first_year, self.min_year)
+        hi = self.max_year if last_year is None else min(last_year, self.max_year)
+        count = int(self.year_counts[lo - self.min_year:hi - self.min_year + 1].sum()) if lo <= hi else 0
+        return count + (self.invalid_time_count if first_year is None else 0)
+
+    def summary(self, top: int = 5) -> Dict:
+        """统计摘要，便于写入日志"""
+        top_relations = np.argsort(-self.relation_counts, kind='stable')[:top]
+        return {
+            'num_facts': self.num_facts,
+            'num_entities': len(self.head_degree),
+            'num_relations': len(self.relation_counts),
+            'year_range': (self.min_year, self.max_year),
+            'max_head_degree': int(self.head_degree.max()) if len(self.head_degree) else 0,
+            'max_tail_degree': int(self.tail_degree.max()) if len(self.tail_degree) else 0,
+            'top_relations': {self.relation_names[i]: int(self.relation_counts[i]) for i in top_relations},
+        }
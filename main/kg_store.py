@@ -0,0 +1,426 @@
+"""
+知识图谱存储模块 - 负责二进制快照的构建与加载
+
+快照目录结构：
+- quads.npy          int32 数组，形状 (N, 4)，列为 (head_id, rel_id, tail_id, ts_id)，按列优先存储，
+                     以便内存映射后每一列都是连续的零拷贝视图；行按日序数稳定排序，
+                     因此每个年 / 月分区以及任意时间窗口都是一段连续的行区间
+- dictionaries.json  版本号、事实数以及 entities / relations / timestamps 字符串字典（下标即id），
+                     所有分区共享同一份字典
+"""
+import os
+import json
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+
+from .time_utils import timestamp_tables, compare_time, predicate_day_range
+
+SNAPSHOT_VERSION = 2
+KG_COLUMNS = ['head', 'relation', 'tail', 'timestamp']
+# 由 timestamp 派生的整数时间列（见 time_utils）
+TIME_COLUMNS = ['day', 'month', 'year']
+
+QUADS_FILE = "quads.npy"
+DICTIONARIES_FILE = "dictionaries.json"
+
+# 列名 -> (字典键, id映射文件)
+_DICTIONARY_SOURCES = {
+    'head': ('entities', 'entity2id.json'),
+    'relation': ('relations', 'relation2id.json'),
+    'tail': ('entities', 'entity2id.json'),
+    'timestamp': ('timestamps', 'ts2id.json'),
+}
+
+
+def _load_id_map(path: str) -> List[str]:
+    """读取 name->id 映射文件，返回按id排列的名称列表"""
+    with open(path, 'r', encoding='utf-8') as f:
+        name2id = json.load(f)
+    names = [None] * len(name2id)
+    for name, idx in name2id.items():
+        names[idx] = name
+    return names
+
+
+def _encode_column(values: np.ndarray, vocab: List[str]) -> np.ndarray:
+    """将字符串列编码为字典id，字典中不存在的值追加到字典末尾"""
+    codes = pd.Index(vocab).get_indexer(values)
+    missing = codes < 0
+    if missing.any():
+        vocab.extend(pd.unique(values[missing]).tolist())
+        codes = pd.Index(vocab).get_indexer(values)
+    return codes.astype(np.int32)
+
+
+def build_snapshot(kg_df: pd.DataFrame, dict_dir: str, snapshot_dir: str) -> Dict:
+    """根据四元组DataFrame和id映射文件构建二进制快照"""
+    dictionaries = {
+        'entities': _load_id_map(os.path.join(dict_dir, 'entity2id.json')),
+        'relations': _load_id_map(os.path.join(dict_dir, 'relation2id.json')),
+        'timestamps': _load_id_map(os.path.join(dict_dir, 'ts2id.json')),
+    }
+
+    quads = np.empty((len(kg_df), len(KG_COLUMNS)), dtype=np.int32)
+    for i, col in enumerate(KG_COLUMNS):
+        key, _ = _DICTIONARY_SOURCES[col]
+        values = kg_df[col].astype(str).to_numpy(dtype=object)
+        quads[:, i] = _encode_column(values, dictionaries[key])
+
+    # 按时间排序，时间分区即为连续的行区间
+    quads = quads[_time_order(quads[:, 3], dictionaries['timestamps'])]
+
+    meta = {
+        'version': SNAPSHOT_VERSION,
+        'num_facts': int(len(quads)),
+        'columns': KG_COLUMNS,
+        'sort_key': 'day',
+        **dictionaries
+    }
+
+    # 两个文件先完整写入临时文件，再用 os.replace 原子替换；替换前先删除旧的字典文件（快照完整的标志），
+    # 构建中途崩溃时快照视为缺失（各入口回退到TSV解析），不会出现新四元组配旧字典的快照
+    os.makedirs(snapshot_dir, exist_ok=True)
+    for name in os.listdir(snapshot_dir):
+        # 清理此前构建崩溃时遗留的临时文件
+        if name.startswith(('.' + QUADS_FILE + '.', '.' + DICTIONARIES_FILE + '.')) and name.endswith('.tmp'):
+            os.remove(os.path.join(snapshot_dir, name))
+    quads_tmp = _write_temp(snapshot_dir, QUADS_FILE, lambda f: np.save(f, np.asfortranarray(quads)))
+    try:
+        dict_tmp = _write_temp(snapshot_dir, DICTIONARIES_FILE,
+                               lambda f: f.write(json.dumps(meta, ensure_ascii=False).encode('utf-8')))
+    except BaseException:
+        os.remove(quads_tmp)
+        raise
+    dict_path = os.path.join(snapshot_dir, DICTIONARIES_FILE)
+    if os.path.exists(dict_path):
+        os.remove(dict_path)
+    os.replace(quads_tmp, os.path.join(snapshot_dir, QUADS_FILE))
+    os.replace(dict_tmp, dict_path)
+
+    return meta
+
+
+def _write_temp(directory: str, name: str, write) -> str:
+    """在目标目录中写入并 fsync 临时文件，返回临时文件路径；写入失败时删除临时文件"""
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def _time_order(ts_codes: np.ndarray, timestamps: List[str]) -> np.ndarray:
+    """按日序数稳定排序的行顺序（无法解析的时间戳排在最前）"""
+    days = timestamp_tables(timestamps)[0]
+    return np.argsort(days[ts_codes], kind='stable')
+
+
+def snapshot_exists(snapshot_dir: str) -> bool:
+    """检查快照文件是否齐全"""
+    if not snapshot_dir:
+        return False
+    return (os.path.exists(os.path.join(snapshot_dir, QUADS_FILE)) and
+            os.path.exists(os.path.join(snapshot_dir, DICTIONARIES_FILE)))
+
+
+def load_snapshot(snapshot_dir: str, mmap: bool = False) -> Tuple[np.ndarray, Dict]:
+    """加载快照，返回 (quads, dictionaries)；mmap=True 时四元组以只读方式内存映射"""
+    with open(os.path.join(snapshot_dir, DICTIONARIES_FILE), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+
+    if meta.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"快照版本不匹配: {meta.get('version')} != {SNAPSHOT_VERSION}，请重新运行 python -m MY.data.multitq.table 构建")
+
+    quads = np.load(os.path.join(snapshot_dir, QUADS_FILE), mmap_mode='r' if mmap else None)
+    if quads.shape != (meta['num_facts'], len(KG_COLUMNS)):
+        raise ValueError(f"快照数据形状异常: {quads.shape}")
+
+    return quads, meta
+
+
+def snapshot_to_dataframe(quads: np.ndarray, meta: Dict) -> pd.DataFrame:
+    """将整数编码的四元组解码为字符串DataFrame（字符串对象在行间共享），并附带整数时间列"""
+    data = {}
+    for i, col in enumerate(KG_COLUMNS):
+        key, _ = _DICTIONARY_SOURCES[col]
+        vocab = np.asarray(meta[key], dtype=object)
+        data[col] = vocab[quads[:, i]]
+    for col, table in zip(TIME_COLUMNS, timestamp_tables(meta['timestamps'])):
+        data[col] = table[quads[:, 3]]
+    return pd.DataFrame(data, columns=KG_COLUMNS + TIME_COLUMNS)
+
+
+_READ_ONLY_MESSAGE = "知识图谱视图只读，请先筛选子集或 df.copy() 后再修改"
+
+
+class _ReadOnlyIndexer:
+    """包装 loc / iloc / at / iat 索引器：取值照常转发，赋值一律拒绝"""
+
+    def __init__(self, indexer):
+        self._indexer = indexer
+
+    def __getitem__(self, key):
+        return self._indexer[key]
+
+    def __setitem__(self, key, value):
+        raise TypeError(_READ_ONLY_MESSAGE)
+
+    def __call__(self, *args, **kwargs):
+        return _ReadOnlyIndexer(self._indexer(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._indexer, name)
+
+
+def _same_column(column: pd.Series, value) -> bool:
+    """value 与已有列的类型与取值都相同（整列重写不改变任何内容）；整数列之间不区分位宽"""
+    if not isinstance(value, (pd.Series, np.ndarray, pd.api.extensions.ExtensionArray)) or len(value) != len(column):
+        return False
+    same_dtype = value.dtype == column.dtype or (
+        pd.api.types.is_integer_dtype(value.dtype) and pd.api.types.is_integer_dtype(column.dtype))
+    if not same_dtype:
+        return False
+    if not isinstance(value, pd.Series):
+        value = pd.Series(value, index=column.index)
+    return column.astype(value.dtype).equals(value)
+
+
+class ReadOnlyKGFrame(pd.DataFrame):
+    """
+    共享的只读知识图谱视图
+
+    各列在加载时已完成类型化（字符串列 + 整数时间列），生成代码中不改变类型与取值的整列重写
+    （如 df[col] = df[col].astype(str)）直接忽略；改变类型或取值的重写（如 pd.to_datetime、str.upper）、
+    新增列、删除列、loc/iloc 赋值以及 inplace=True 的操作一律拒绝。筛选、切片、copy() 等派生结果为普通 DataFrame，可自由修改。
+    由于视图不会被修改，多个查询可以并发共享同一份数据。
+    """
+
+    @property
+    def _constructor(self):
+        return pd.DataFrame
+
+    def __setitem__(self, key, value):
+        if isinstance(key, (list, tuple)):
+            redundant = isinstance(value, pd.DataFrame) and list(value.columns) == list(key) and all(
+                isinstance(k, str) and k in self.columns and _same_column(self[k], value[k]) for k in key)
+        else:
+            redundant = isinstance(key, str) and key in self.columns and _same_column(self[key], value)
+        if not redundant:
+            raise TypeError(_READ_ONLY_MESSAGE)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            return super().__setattr__(name, value)
+        self.__setitem__(name, value)
+
+    def __delitem__(self, key):
+        raise TypeError(_READ_ONLY_MESSAGE)
+
+    def insert(self, *args, **kwargs):
+        raise TypeError(_READ_ONLY_MESSAGE)
+
+    def pop(self, *args, **kwargs):
+        raise TypeError(_READ_ONLY_MESSAGE)
+
+    def _update_inplace(self, *args, **kwargs):
+        raise TypeError(_READ_ONLY_MESSAGE)
+
+    def _set_axis(self, *args, **kwargs):
+        raise TypeError(_READ_ONLY_MESSAGE)
+
+    def _set_axis_nocheck(self, *args, **kwargs):
+        raise TypeError(_READ_ONLY_MESSAGE)
+
+    def replace(self, *args, **kwargs):
+        if kwargs.get('inplace'):
+            raise TypeError(_READ_ONLY_MESSAGE)
+        return super().replace(*args, **kwargs)
+
+    @property
+    def loc(self):
+        return _ReadOnlyIndexer(super().loc)
+
+    @property
+    def iloc(self):
+        return _ReadOnlyIndexer(super().iloc)
+
+    @property
+    def at(self):
+        return _ReadOnlyIndexer(super().at)
+
+    @property
+    def iat(self):
+        return _ReadOnlyIndexer(super().iat)
+
+
+def read_only_view(kg_df: pd.DataFrame) -> ReadOnlyKGFrame:
+    """包装为只读视图（共享底层数据，不复制）"""
+    if isinstance(kg_df, ReadOnlyKGFrame):
+        return kg_df
+    return ReadOnlyKGFrame(kg_df, copy=False)
+
+
+class KGQuadStore:
+    """
+    整数编码的四元组存储
+
+    从快照打开时四元组数组以只读方式内存映射，同一台机器上的多个实验进程共享
+    同一份页缓存；heads / relations / tails / ts_ids 均为该数组的零拷贝视图。
+    行按日序数排序，时间约束通过 time_range 裁剪为连续行区间。
+    """
+
+    def __init__(self, quads: np.ndarray, meta: Dict):
+        self.quads = quads
+        self.meta = meta
+        self.entity_names = meta['entities']
+        self.relation_names = meta['relations']
+        self.ts_names = meta['timestamps']
+        self._entity_ids = None
+        self._relation_ids = None
+        self._time_columns = None
+
+    @classmethod
+    def open(cls, snapshot_dir: str, mmap: bool = True) -> 'KGQuadStore':
+        """从快照目录打开（默认内存映射）"""
+        quads, meta = load_snapshot(snapshot_dir, mmap=mmap)
+        return cls(quads, meta)
+
+    @classmethod
+    def from_dataframe(cls, kg_df: pd.DataFrame) -> 'KGQuadStore':
+        """在内存中编码字符串DataFrame（无快照时使用）"""
+        entity_codes, entities = pd.factorize(
+            np.concatenate([kg_df['head'].to_numpy(dtype=object), kg_df['tail'].to_numpy(dtype=object)])
+        )
+        relation_codes, relations = pd.factorize(kg_df['relation'], sort=True)
+        ts_codes, timestamps = pd.factorize(kg_df['timestamp'], sort=True)
+
+        n = len(kg_df)
+        quads = np.empty((n, len(KG_COLUMNS)), dtype=np.int32, order='F')
+        quads[:, 0] = entity_codes[:n]
+        quads[:, 1] = relation_codes
+        quads[:, 2] = entity_codes[n:]
+        quads[:, 3] = ts_codes
+        timestamps = [str(t) for t in timestamps]
+        quads = np.asfortranarray(quads[_time_order(ts_codes, timestamps)])
+
+        meta = {
+            'version': SNAPSHOT_VERSION,
+            'num_facts': n,
+            'columns': KG_COLUMNS,
+            'sort_key': 'day',
+            'entities': [str(e) for e in entities],
+            'relations': [str(r) for r in relations],
+            'timestamps': timestamps,
+        }
+        return cls(quads, meta)
+
+    def __len__(self) -> int:
+        return len(self.quads)
+
+    @property
+    def heads(self) -> np.ndarray:
+        return self.quads[:, 0]
+
+    @property
+    def relations(self) -> np.ndarray:
+        return self.quads[:, 1]
+
+    @property
+    def tails(self) -> np.ndarray:
+        return self.quads[:, 2]
+
+    @property
+    def ts_ids(self) -> np.ndarray:
+        return self.quads[:, 3]
+
+    def _time_column(self, i: int) -> np.ndarray:
+        if self._time_columns is None:
+            ts_ids = self.ts_ids
+            self._time_columns = [table[ts_ids] for table in timestamp_tables(self.ts_names)]
+        return self._time_columns[i]
+
+    @property
+    def days(self) -> np.ndarray:
+        """日序数列（date.toordinal）"""
+        return self._time_column(0)
+
+    @property
+    def months(self) -> np.ndarray:
+        """月序数列（year * 12 + month - 1）"""
+        return self._time_column(1)
+
+    @property
+    def years(self) -> np.ndarray:
+        """年份列"""
+        return self._time_column(2)
+
+    def time_mask(self, op: str, value: str, granularity: str = None) -> np.ndarray:
+        """时间谓词掩码，op 为 equal / before / after / same_month / same_year"""
+        return compare_time(self.days, self.months, self.years, op, value, granularity)
+
+    def time_range(self, op: str, value: str, granularity: str = None) -> Tuple[int, int]:
+        """满足时间谓词的连续行区间 [start, end)，语义同 time_mask"""
+        lo, hi = predicate_day_range(op, value, granularity)
+        days = self.days
+        start = 0 if lo is None else int(np.searchsorted(days, lo, side='left'))
+        end = len(days) if hi is None else int(np.searchsorted(days, hi, side='right'))
+        return start, max(start, end)
+
+    def entity_id(self, name: str) -> int:
+        """实体名 -> id，不存在时返回 -1"""
+        if self._entity_ids is None:
+            self._entity_ids = {name: i for i, name in enumerate(self.entity_names)}
+        return self._entity_ids.get(name, -1)
+
+    def relation_id(self, name: str) -> int:
+        """关系名 -> id，不存在时返回 -1"""
+        if self._relation_ids is None:
+            self._relation_ids = {name: i for i, name in enumerate(self.relation_names)}
+        return self._relation_ids.get(name, -1)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """解码为字符串DataFrame"""
+        return snapshot_to_dataframe(self.quads, self.meta)
+
+    def to_view(self) -> ReadOnlyKGFrame:
+        """解码为共享的只读视图，供查询执行使用"""
+        return read_only_view(self.to_dataframe())
+
+
+def load_kg_store(kg_path: str, snapshot_dir: str = None, logger=None) -> KGQuadStore:
+    """优先内存映射快照，快照不可用时解析TSV并在内存中编码"""
+    logger = logger or logging.getLogger(__name__)
+
+    if snapshot_exists(snapshot_dir):
+        try:
+            store = KGQuadStore.open(snapshot_dir)
+            logger.info(f"内存映射知识图谱快照: {snapshot_dir}")
+            return store
+        except Exception as e:
+            logger.warning(f"快照加载失败，回退到TSV解析: {e}")
+    elif snapshot_dir:
+        logger.warning(f"未找到快照 {snapshot_dir}，回退到TSV解析（可运行 python -m MY.data.multitq.table 构建快照）")
+
+    return KGQuadStore.from_dataframe(_read_kg_tsv(kg_path))
+
+
+def _read_kg_tsv(kg_path: str) -> pd.DataFrame:
+    """解析TSV格式的四元组文件"""
+    kg_df = pd.read_csv(kg_path, sep='\t', header=0)
+    for col in KG_COLUMNS:
+        if col in kg_df.columns:
+            kg_df[col] = kg_df[col].astype(str)
+    return kg_df
+
+
+def load_kg_dataframe(kg_path: str, snapshot_dir: str = None, logger=None) -> pd.DataFrame:
+    """优先从二进制快照加载知识图谱，快照不可用时回退到解析TSV"""
+    return load_kg_store(kg_path, snapshot_dir, logger).to_dataframe()
@@ -0,0 +1,145 @@
+"""
+LLM响应缓存模块 - 按内容寻址的持久化缓存（SQLite）
+
+缓存键为 sha256(模型, 消息列表, 采样参数) ，相同的请求在重跑时直接返回缓存的回复。
+缓存总大小超过上限时按最近访问时间淘汰（LRU）。
+replay=True 时为离线回放模式：未命中直接抛出 CacheMissError，不再请求模型。
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .llm_metrics import METRICS
+
+
+class CacheMissError(RuntimeError):
+    """回放模式下缓存未命中"""
+
+
+class LLMCache:
+    """SQLite 实现的 LLM 响应缓存，可在线程间共享"""
+
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024, replay: bool = False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self.logger = logging.getLogger(__name__)
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created REAL, accessed REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @classmethod
+    def from_config(cls, config: Dict) -> Optional['LLMCache']:
+        """按实验配置创建缓存，未配置 llm_cache_path 时返回 None"""
+        path = config.get('llm_cache_path')
+        if not path:
+            if config.get('llm_replay'):
+                raise ValueError("回放模式需要配置 llm_cache_path")
+            return None
+        max_mb = config.get('llm_cache_max_mb', 512)
+        return cls(path, max_bytes=int(max_mb * 1024 * 1024), replay=config.get('llm_replay', False))
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict], params: Dict = None) -> str:
+        """请求内容的 sha256，参数顺序不影响结果"""
+        payload = json.dumps({'model': model, 'messages': messages, 'params': params or {}},
+                             sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, model: str, messages: List[Dict], params: Dict = None) -> Optional[str]:
+        """命中返回缓存的回复；未命中返回 None，回放模式下抛出 CacheMissError"""
+        key = self.make_key(model, messages, params)
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+                self._conn.commit()
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+
+        if self.replay:
+            raise CacheMissError(f"回放模式下缓存未命中: {key[:16]} (model={model})")
+        return None
+
+    def put(self, model: str, messages: List[Dict], params: Dict, response: str):
+        """写入回复，超出容量时淘汰最久未访问的条目"""
+        key = self.make_key(model, messages, params)
+        size = len(response.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now)
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """按最近访问时间淘汰，直到总大小不超过上限（调用方持有锁）"""
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self) -> Dict:
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self), 'bytes': self._total_bytes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def cached_completion(client, cache: Optional[LLMCache], model: str, messages: List[Dict],
+                      stage: str = None, **params) -> str:
+    """经缓存调用 OpenAI 兼容客户端的 chat completions，返回回复文本；调用指标记录到 llm_metrics.METRICS"""
+    started = time.monotonic()
+    if cache is not None:
+        cached = cache.get(model, messages, params)
+        if cached is not None:
+            METRICS.record(model, time.monotonic() - started, cache_hit=True, attempts=0, stage=stage)
+            return cached
+
+    try:
+        response = client.chat.completions.create(model=model, messages=messages, **params)
+    except Exception as e:
+        METRICS.record(model, time.monotonic() - started, error=type(e).__name__, stage=stage)
+        raise
+    usage = response.usage
+    METRICS.record(model, time.monotonic() - started,
+                   prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+                   completion_tokens=getattr(usage, 'completion_tokens', 0) or 0, stage=stage)
+    content = response.choices[0].message.content or ""
+
+    if cache is not None and content:
+        cache.put(model, messages, params, content)
+    return content
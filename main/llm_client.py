@@ -0,0 +1,773 @@
+"""
+LLM客户端模块 - 统一的同步 / 异步 chat completions 调用
+
+- 并发上限：同时在途的请求数不超过 max_concurrency；adaptive_concurrency 开启时按观测到的延迟、
+  错误率与 429 / 超时以 AIMD 方式自动调整，当前上限作为 concurrency_limit 指标记录
+- 令牌桶限流：平均每秒不超过 requests_per_second 个请求，允许 burst 个突发
+- 截止时间：每次 chat 调用（含限流与并发排队、重试）在 timeout 秒内结束，每次尝试只使用剩余的时间；
+  排队期间截止时间耗尽时抛出 DeadlineExceeded，不计入熔断
+- 重试：超时、连接错误、429 与 5xx 最多重试 max_retries 次，带抖动的指数退避（429 遵循 Retry-After）
+- 熔断：连续 breaker_threshold 次调用失败后熔断，breaker_reset 秒内直接抛出 CircuitOpenError，
+  调用方据此回退到规则分析 / 纯模板模式；冷却结束后放行请求试探，成功即恢复
+- 响应缓存：配置 LLMCache 后，相同的（模型, 消息, 参数）直接返回缓存的回复，不占用并发与限流额度
+- 调用指标：每次调用的 token 数、延迟、尝试次数、缓存命中与错误记录到 MetricsSink（默认 llm_metrics.METRICS）
+- 请求对冲：hedge_requests 开启时，调用超过该阶段近期延迟的 p90 仍未返回则再发一份相同请求，
+  取先返回的一个；对冲请求数不超过总请求数的 hedge_budget 比例，且同样占用并发名额，没有空位时不对冲（流式调用不对冲）
+- 流式调用：chat_stream 边接收边检查，stop_when 满足时立即关闭连接，不再等待剩余 token
+- 取消：同步调用可传入 CancelToken，cancel() 后在发出请求前、退避等待中或流式分块之间抛出 LLMCancelledError
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, List, Optional
+
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+from .llm_cache import LLMCache
+from .llm_metrics import METRICS, MetricsSink
+
+
+class LLMCallError(RuntimeError):
+    """重试耗尽或超过截止时间后调用仍失败"""
+
+
+class CircuitOpenError(LLMCallError):
+    """熔断期间拒绝调用"""
+
+
+class LLMCancelledError(LLMCallError):
+    """调用被 CancelToken 取消"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """等待限流令牌或并发名额期间调用的截止时间已到，请求未发出"""
+
+
+class CancelToken:
+    """
+    取消令牌，可在线程间共享：cancel() 后持有该令牌的调用不再发出新请求，
+    退避等待立即结束，流式回复在下一个分块处关闭连接；已发出的非流式请求无法中断，其结果被丢弃
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        """已取消时抛出 LLMCancelledError"""
+        if self._event.is_set():
+            raise LLMCancelledError("LLM调用已取消")
+
+    def sleep(self, seconds: float):
+        """等待 seconds 秒，期间被取消则提前返回"""
+        self._event.wait(seconds)
+
+
+class TokenBucket:
+    """令牌桶限流器，rate <= 0 表示不限流；线程安全，同步与异步调用共用"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """预支一个令牌，返回需要等待的秒数（预支后令牌可为负，后来者依次排队）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def _wait_within(self, timeout: Optional[float]) -> float:
+        """预支一个令牌并返回等待秒数；需要等待超过 timeout 秒时归还令牌并抛出 DeadlineExceeded"""
+        wait = self._reserve()
+        if wait > 0 and timeout is not None and wait >= timeout:
+            with self._lock:
+                self._tokens += 1
+            raise DeadlineExceeded("等待限流令牌超过截止时间")
+        return wait
+
+    def acquire(self, timeout: float = None):
+        """阻塞直到获得令牌，最多等待 timeout 秒"""
+        if self.rate > 0:
+            wait = self._wait_within(timeout)
+            if wait > 0:
+                time.sleep(wait)
+
+    async def acquire_async(self, timeout: float = None):
+        """异步等待直到获得令牌，最多等待 timeout 秒"""
+        if self.rate > 0:
+            wait = self._wait_within(timeout)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """
+    并发上限，同时在途的请求数不超过 limit；线程安全，同步（slot）与异步（slot_async）调用各自使用
+
+    adaptive=True 时按 AIMD 调整 limit：
+    - 429 或请求超时立即乘以 backoff（一个延迟周期内最多下调一次，避免同一批请求的失败重复下调）
+    - 每完成 window 次请求评估一次：错误率超过 max_error_rate，或 p95 延迟超过 latency_target
+      （未配置时取基线 p95 的 latency_tolerance 倍）则乘以 backoff；
+      否则若窗口内上限曾被占满，加 1，直到 max_limit
+    """
+
+    def __init__(self, limit: int = 8, adaptive: bool = False, min_limit: int = 1, max_limit: int = 64,
+                 window: int = 20, latency_target: float = None, latency_tolerance: float = 2.0,
+                 max_error_rate: float = 0.1, backoff: float = 0.5, metrics: MetricsSink = None):
+        self.adaptive = adaptive
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(max_limit, limit)
+        self.window = window
+        self.latency_target = latency_target
+        self.latency_tolerance = latency_tolerance
+        self.max_error_rate = max_error_rate
+        self.backoff = backoff
+        self.metrics = metrics or METRICS
+        self.in_flight = 0
+        self._limit = float(limit)
+        self._samples: List = []
+        self._saturated = False
+        self._baseline_p95 = None
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._async_cond = None
+        self.logger = logging.getLogger(__name__)
+        self.metrics.set_gauge('concurrency_limit', self.limit)
+
+    @classmethod
+    def from_config(cls, config: Dict) -> 'AdaptiveConcurrency':
+        return cls(config.get('max_concurrency', 8),
+                   adaptive=config.get('adaptive_concurrency', False),
+                   min_limit=config.get('adaptive_min_concurrency', 1),
+                   max_limit=config.get('adaptive_max_concurrency', 64),
+                   latency_target=config.get('adaptive_latency_p95'))
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def _try_enter(self) -> bool:
+        """有空位时占用一个名额"""
+        with self._lock:
+            if self.in_flight >= self.limit:
+                self._saturated = True
+                return False
+            self.in_flight += 1
+            if self.in_flight >= self.limit:
+                self._saturated = True
+            return True
+
+    def _leave(self, latency: Optional[float], error: Optional[BaseException]):
+        """归还名额；latency 为 None 表示名额未用于请求，不计入调整"""
+        with self._lock:
+            self.in_flight -= 1
+            if self.adaptive and latency is not None:
+                self._observe(latency, error)
+
+    def try_acquire(self) -> bool:
+        """不等待地占用一个名额，没有空位时返回 False；用于对冲请求，名额由 release / release_async 归还"""
+        return self._try_enter()
+
+    def release(self, latency: float = None, error: BaseException = None):
+        """归还 try_acquire 占用的名额并唤醒同步等待者"""
+        self._leave(latency, error)
+        with self._cond:
+            self._cond.notify_all()
+
+    async def release_async(self, latency: float = None, error: BaseException = None):
+        """release 的异步版本，唤醒异步等待者"""
+        self._leave(latency, error)
+        if self._async_cond is not None:
+            async with self._async_cond:
+                self._async_cond.notify_all()
+
+    @contextmanager
+    def slot(self, timeout: float = None):
+        """
+        占用一个名额直到 with 块结束，块内请求的延迟与异常用于调整上限；
+        timeout 秒内等不到名额时抛出 DeadlineExceeded
+        """
+        with self._cond:
+            if not self._cond.wait_for(self._try_enter, timeout):
+                raise DeadlineExceeded("等待并发名额超过截止时间")
+        started = time.monotonic()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.release(time.monotonic() - started, error)
+
+    @asynccontextmanager
+    async def slot_async(self, timeout: float = None):
+        """slot 的异步版本"""
+        if self._async_cond is None:
+            self._async_cond = asyncio.Condition()
+        cond = self._async_cond
+        async with cond:
+            try:
+                await asyncio.wait_for(cond.wait_for(self._try_enter), timeout)
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("等待并发名额超过截止时间")
+        started = time.monotonic()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            await self.release_async(time.monotonic() - started, error)
+
+    def _observe(self, latency: float, error: Optional[BaseException]):
+        """记录一次请求的结果并按需调整上限（调用方持有锁）"""
+        # 截止时间耗尽、被取消与请求本身有误（400 / 401 等）不反映服务端负载
+        if isinstance(error, (DeadlineExceeded, LLMCancelledError)) or (error is not None and not _retryable(error)):
+            return
+        if isinstance(error, (RateLimitError, APITimeoutError, asyncio.TimeoutError, TimeoutError)):
+            self._decrease(type(error).__name__)
+            return
+
+        self._samples.append((latency, error is not None))
+        if len(self._samples) < self.window:
+            return
+        latencies = sorted(l for l, failed in self._samples if not failed)
+        error_rate = sum(failed for _, failed in self._samples) / len(self._samples)
+        saturated = self._saturated
+        self._samples, self._saturated = [], False
+
+        p95 = latencies[int(0.95 * (len(latencies) - 1))] if latencies else None
+        if p95 is not None:
+            # 基线取各窗口 p95 的最小值，每个窗口允许上浮 10%，以跟随服务端延迟的缓慢变化
+            self._baseline_p95 = p95 if self._baseline_p95 is None else min(p95, self._baseline_p95 * 1.1)
+        target = self.latency_target or (self._baseline_p95 or 0) * self.latency_tolerance
+
+        if error_rate > self.max_error_rate or (p95 is not None and p95 > target):
+            self._decrease(f"p95 延迟 {p95 or 0:.2f} 秒，错误率 {error_rate:.0%}")
+        elif saturated and self._limit < self.max_limit:
+            self._set_limit(self._limit + 1, f"p95 延迟 {p95 or 0:.2f} 秒，错误率 {error_rate:.0%}")
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        if now - self._last_decrease < (self._baseline_p95 or 1.0):
+            return
+        self._last_decrease = now
+        self._samples, self._saturated = [], False
+        self._set_limit(max(self.min_limit, self._limit * self.backoff), reason)
+
+    def _set_limit(self, limit: float, reason: str):
+        old = self.limit
+        self._limit = limit
+        if self.limit != old:
+            self.logger.info(f"并发上限调整: {old} -> {self.limit}（{reason}）")
+            self.metrics.set_gauge('concurrency_limit', self.limit)
+
+
+class HedgePolicy:
+    """
+    请求对冲策略：按阶段记录近期成功请求的延迟，某次请求超过该阶段的 percentile 分位延迟仍未返回时发出对冲请求
+    样本少于 min_samples 的阶段不对冲；对冲请求数不超过已发请求数的 budget 比例；线程安全
+    """
+
+    def __init__(self, percentile: float = 90, budget: float = 0.1, min_samples: int = 20, history: int = 200):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.history = history
+        self.requests = 0
+        self.hedges = 0
+        self._latencies: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict) -> Optional['HedgePolicy']:
+        """未开启 hedge_requests 时返回 None"""
+        if not config.get('hedge_requests'):
+            return None
+        return cls(config.get('hedge_percentile', 90), config.get('hedge_budget', 0.1),
+                   config.get('hedge_min_samples', 20))
+
+    def delay(self, stage: str) -> Optional[float]:
+        """记一次请求，返回该阶段发出对冲请求前的等待秒数；不对冲时返回 None"""
+        with self._lock:
+            self.requests += 1
+            samples = self._latencies.get(stage or 'default')
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+            return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+    def try_hedge(self) -> bool:
+        """预算内时占用一次对冲额度"""
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def observe(self, stage: str, latency: float):
+        with self._lock:
+            self._latencies.setdefault(stage or 'default', deque(maxlen=self.history)).append(latency)
+
+
+class CircuitBreaker:
+    """
+    熔断器：closed -> open（连续 failure_threshold 次调用失败）-> half_open（冷却 reset_timeout 秒后）
+    half_open 状态下调用成功即回到 closed，失败则重新 open；线程安全
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def allow(self) -> bool:
+        """是否放行本次调用"""
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self.logger.info("熔断冷却结束，放行请求试探LLM服务是否恢复")
+            return self.state != 'open'
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                self.logger.info("LLM服务已恢复，熔断器关闭")
+            self.state = 'closed'
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self._failures >= self.failure_threshold):
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                self.logger.warning(f"连续 {self._failures} 次LLM调用失败，熔断 {self.reset_timeout} 秒")
+
+
+def _retryable(exc: Exception) -> bool:
+    """
+    超时、连接错误、429 与 5xx 可重试；其余错误（如 400 / 401）重试无意义。
+    DeadlineExceeded 是本地排队耗尽了截止时间，请求未发出，既不重试也不说明服务端故障
+    """
+    if isinstance(exc, DeadlineExceeded):
+        return False
+    if isinstance(exc, (APIConnectionError, RateLimitError, asyncio.TimeoutError, TimeoutError)):
+        return True
+    return isinstance(exc, APIStatusError) and exc.status_code >= 500
+
+
+def _retry_after(exc: Exception) -> float:
+    """429 响应中的 Retry-After 秒数，无则为 0"""
+    response = getattr(exc, 'response', None)
+    try:
+        return float(response.headers.get('retry-after', 0)) if response is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _client_settings(config: Dict) -> Dict:
+    """从实验配置中读取客户端参数"""
+    return {
+        'api_key': config.get('api_key'),
+        'base_url': config.get('base_url'),
+        'model': config.get('model'),
+        'timeout': config.get('timeout', 30),
+        'max_retries': config.get('max_retries', 3),
+        'max_concurrency': config.get('max_concurrency', 8),
+        'requests_per_second': config.get('requests_per_second', 0),
+        'burst': config.get('rate_burst'),
+        'backoff_base': config.get('retry_backoff_base', 0.5),
+        'backoff_max': config.get('retry_backoff_max', 8.0),
+        'breaker': CircuitBreaker(config.get('breaker_threshold', 5), config.get('breaker_reset', 30.0)),
+        'concurrency': AdaptiveConcurrency.from_config(config),
+        'hedging': HedgePolicy.from_config(config),
+        'cache': LLMCache.from_config(config),
+    }
+
+
+class _BaseLLMClient:
+    """同步 / 异步客户端共用的缓存、退避与熔断逻辑"""
+
+    def __init__(self, model: str, timeout: float = 30, max_retries: int = 3, requests_per_second: float = 0,
+                 burst: float = None, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 breaker: CircuitBreaker = None, cache: LLMCache = None, metrics: MetricsSink = None,
+                 max_concurrency: int = 8, concurrency: AdaptiveConcurrency = None, hedging: HedgePolicy = None):
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.concurrency = concurrency or AdaptiveConcurrency(max_concurrency, metrics=metrics)
+        self.hedging = hedging
+        self.cache = cache
+        self.metrics = metrics or METRICS
+        self.rate_limiter = TokenBucket(requests_per_second, burst)
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_config(cls, config: Dict):
+        return cls(**_client_settings(config))
+
+    @property
+    def available(self) -> bool:
+        """熔断器是否放行调用；为 False 时调用方应直接走回退逻辑"""
+        return self.breaker.allow()
+
+    def _cached(self, model: str, messages: List[Dict], params: Dict, stage: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+        started = time.monotonic()
+        content = self.cache.get(model, messages, params)
+        if content is not None:
+            self.metrics.record(model, time.monotonic() - started, cache_hit=True, attempts=0, stage=stage)
+        return content
+
+    def _check_breaker(self, model: str, stage: str):
+        if not self.breaker.allow():
+            self.metrics.record(model, 0.0, attempts=0, error='CircuitOpenError', stage=stage)
+            raise CircuitOpenError("LLM服务熔断中，跳过调用")
+
+    def _retry_delay(self, attempt: int, exc: Exception, deadline: float) -> Optional[float]:
+        """第 attempt 次尝试失败后的等待秒数（full jitter）；不应再重试时返回 None"""
+        if not _retryable(exc) or attempt >= self.max_retries:
+            return None
+        delay = max(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)), _retry_after(exc))
+        if time.monotonic() + delay >= deadline:
+            return None
+        self.logger.warning(f"LLM调用失败（第 {attempt + 1} 次）: {str(exc) or type(exc).__name__}，{delay:.2f} 秒后重试")
+        return delay
+
+    def _failed(self, exc: Exception, model: str, started: float, attempts: int, stage: str) -> Exception:
+        """记录一次失败的调用，返回抛给调用方的异常；不可重试的错误（含 DeadlineExceeded）不计入熔断"""
+        self.metrics.record(model, time.monotonic() - started, attempts=attempts, error=type(exc).__name__,
+                            concurrency_limit=self.concurrency.limit, stage=stage)
+        if not _retryable(exc):
+            return exc
+        self.breaker.record_failure()
+        error = LLMCallError(f"LLM调用失败（截止时间 {self.timeout} 秒，最多重试 {self.max_retries} 次）: "
+                             f"{str(exc) or type(exc).__name__}")
+        error.__cause__ = exc
+        return error
+
+    def _succeeded(self, model: str, messages: List[Dict], params: Dict, response,
+                   started: float, attempts: int, stage: str, hedged: bool = False) -> str:
+        message = response.choices[0].message
+        reasoning = getattr(message, 'reasoning_content', None)
+        if reasoning:
+            self.logger.debug(f"推理过程: {reasoning[:300]}...")
+        return self._finish(model, messages, params, message.content or "", response.usage, started, attempts, stage,
+                            hedged=hedged)
+
+    def _finish(self, model: str, messages: List[Dict], params: Dict, content: str, usage, started: float,
+                attempts: int, stage: str, ttft: float = None, completion_tokens: int = 0,
+                early_stop: bool = False, hedged: bool = False) -> str:
+        """记录成功的调用并写入缓存；usage 缺失时（流式提前关闭）completion_tokens 取收到的分块数"""
+        self.breaker.record_success()
+        self.metrics.record(model, time.monotonic() - started,
+                            prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+                            completion_tokens=getattr(usage, 'completion_tokens', 0) or completion_tokens,
+                            ttft=ttft, attempts=attempts, early_stop=early_stop, hedged=hedged,
+                            concurrency_limit=self.concurrency.limit, stage=stage)
+        if self.cache is not None and content:
+            self.cache.put(model, messages, params, content)
+        return content
+
+
+class LLMClient(_BaseLLMClient):
+    """同步客户端，可在多线程间共享"""
+
+    def __init__(self, api_key: str, base_url: str, model: str, timeout: float = 30, max_retries: int = 3,
+                 max_concurrency: int = 8, requests_per_second: float = 0, burst: float = None, **options):
+        super().__init__(model, timeout, max_retries, requests_per_second, burst,
+                         max_concurrency=max_concurrency, **options)
+        # 重试由本模块统一控制，关闭 SDK 自带的重试
+        self.client = OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+        # 对冲时主请求与对冲请求在线程池中并行等待；两者都占用并发名额，但落后的主请求在调用返回（归还名额）后
+        # 仍在后台运行，线程数按并发上限的最大值留出两倍
+        self._hedge_pool = ThreadPoolExecutor(2 * self.concurrency.max_limit, thread_name_prefix='llm-hedge') \
+            if self.hedging is not None else None
+
+    def chat(self, messages: List[Dict], model: str = None, stage: str = None,
+             cancel: CancelToken = None, **params) -> str:
+        """
+        发送一次 chat completions 请求，返回回复文本；stage 为指标中的阶段名（缺省取 metrics_context）
+        失败抛出 LLMCallError，熔断期间抛出 CircuitOpenError，被 cancel 取消时抛出 LLMCancelledError
+        """
+        model = model or self.model
+        cached = self._cached(model, messages, params, stage)
+        if cached is not None:
+            return cached
+        self._check_breaker(model, stage)
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+        attempt = 0
+        while True:
+            try:
+                if cancel is not None:
+                    cancel.check()
+                self.rate_limiter.acquire(deadline - time.monotonic())
+                with self.concurrency.slot(deadline - time.monotonic()):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise DeadlineExceeded(f"超过截止时间 {self.timeout} 秒")
+                    sent = time.monotonic()
+                    response, hedged = self._create(stage, remaining, model=model, messages=messages, **params)
+                if self.hedging is not None:
+                    self.hedging.observe(stage, time.monotonic() - sent)
+                return self._succeeded(model, messages, params, response, started, attempt + 1, stage, hedged)
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, deadline)
+                if delay is None:
+                    raise self._failed(e, model, started, attempt + 1, stage)
+                (cancel.sleep if cancel is not None else time.sleep)(delay)
+                attempt += 1
+
+    def _create(self, stage: str, timeout: float, **request):
+        """
+        发出一次请求，返回 (响应, 是否发出了对冲请求)
+        超过该阶段的对冲延迟仍未返回时再发一份相同的请求，取先成功的一个；落后的请求在后台结束，结果丢弃
+        """
+        delay = self.hedging.delay(stage) if self.hedging is not None else None
+        if delay is None or delay >= timeout:
+            return self.client.chat.completions.create(timeout=timeout, **request), False
+
+        sent = time.monotonic()
+        primary = self._hedge_pool.submit(self.client.chat.completions.create, timeout=timeout, **request)
+        try:
+            return primary.result(timeout=delay), False
+        except FutureTimeout:
+            pass
+        if not self.concurrency.try_acquire():
+            return primary.result(), False
+        if not self.hedging.try_hedge():
+            self.concurrency.release()
+            return primary.result(), False
+
+        self.logger.debug(f"请求 {delay:.2f} 秒未返回，发出对冲请求（阶段 {stage}）")
+        hedge = self._hedge_pool.submit(self.client.chat.completions.create,
+                                        timeout=timeout - (time.monotonic() - sent), **request)
+        # 两个请求各占一个名额：调用方返回时归还自己的名额，对冲占用的名额在两个请求都结束后才归还，
+        # 落后的请求（主请求或对冲请求）在后台运行期间始终占着名额
+        self._release_when_done([primary, hedge])
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result(), True
+                error = future.exception()
+        raise error
+
+    def _release_when_done(self, futures: List):
+        """futures 全部结束后归还一个并发名额"""
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def on_done(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self.concurrency.release()
+
+        for future in futures:
+            future.add_done_callback(on_done)
+
+    def chat_stream(self, messages: List[Dict], model: str = None, stage: str = None,
+                    stop_when: Callable[[str], bool] = None, cancel: CancelToken = None, **params) -> str:
+        """
+        流式发送 chat completions 请求，返回收到的回复文本
+        每收到一段内容就以累计文本调用 stop_when，返回 True 时立即关闭连接（提前结束生成）；
+        重试、截止时间与熔断同 chat，缓存键中带 stream 标记，提前结束的回复不会被 chat 读到；
+        被 cancel 取消时关闭连接并抛出 LLMCancelledError
+        """
+        model = model or self.model
+        key_params = {**params, 'stream': True}
+        cached = self._cached(model, messages, key_params, stage)
+        if cached is not None:
+            return cached
+        self._check_breaker(model, stage)
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+        attempt = 0
+        while True:
+            try:
+                if cancel is not None:
+                    cancel.check()
+                self.rate_limiter.acquire(deadline - time.monotonic())
+                with self.concurrency.slot(deadline - time.monotonic()):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise DeadlineExceeded(f"超过截止时间 {self.timeout} 秒")
+                    stream = self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        stream=True,
+                        stream_options={'include_usage': True},
+                        timeout=remaining,
+                        **params
+                    )
+                    text, usage, first_token, chunks, stopped = self._consume_stream(stream, stop_when, deadline, cancel)
+                if stopped:
+                    self.logger.debug(f"流式回复提前结束，收到 {chunks} 个分块")
+                ttft = first_token - started if first_token is not None else None
+                return self._finish(model, messages, key_params, text, usage, started, attempt + 1, stage,
+                                    ttft=ttft, completion_tokens=chunks, early_stop=stopped)
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, deadline)
+                if delay is None:
+                    raise self._failed(e, model, started, attempt + 1, stage)
+                (cancel.sleep if cancel is not None else time.sleep)(delay)
+                attempt += 1
+
+    @staticmethod
+    def _consume_stream(stream, stop_when: Optional[Callable[[str], bool]], deadline: float,
+                        cancel: CancelToken = None):
+        """读取流直到结束或 stop_when 满足，返回 (文本, usage, 首 token 时刻, 内容分块数, 是否提前结束)"""
+        text, usage, first_token, chunks = "", None, None, 0
+        try:
+            for chunk in stream:
+                if cancel is not None:
+                    cancel.check()
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if first_token is None and (delta.content or getattr(delta, 'reasoning_content', None)):
+                    first_token = time.monotonic()
+                if delta.content:
+                    text += delta.content
+                    chunks += 1
+                    if stop_when is not None and stop_when(text):
+                        return text, usage, first_token, chunks, True
+                if time.monotonic() > deadline:
+                    raise TimeoutError("流式回复超过截止时间")
+        finally:
+            stream.close()
+        return text, usage, first_token, chunks, False
+
+
+class AsyncLLMClient(_BaseLLMClient):
+    """异步客户端，供 asyncio 流水线并发发起请求"""
+
+    def __init__(self, api_key: str, base_url: str, model: str, timeout: float = 30, max_retries: int = 3,
+                 max_concurrency: int = 8, requests_per_second: float = 0, burst: float = None, **options):
+        super().__init__(model, timeout, max_retries, requests_per_second, burst,
+                         max_concurrency=max_concurrency, **options)
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+
+    async def chat(self, messages: List[Dict], model: str = None, stage: str = None, **params) -> str:
+        """
+        发送一次 chat completions 请求，返回回复文本；整个调用（含重试）严格在 timeout 秒内结束
+        stage 为指标中的阶段名（缺省取 metrics_context）；失败抛出 LLMCallError，熔断期间抛出 CircuitOpenError
+        """
+        model = model or self.model
+        cached = self._cached(model, messages, params, stage)
+        if cached is not None:
+            return cached
+        self._check_breaker(model, stage)
+
+        started = time.monotonic()
+        deadline = started + self.timeout
+        attempt = 0
+        while True:
+            try:
+                await self.rate_limiter.acquire_async(deadline - time.monotonic())
+                async with self.concurrency.slot_async(deadline - time.monotonic()):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise DeadlineExceeded(f"超过截止时间 {self.timeout} 秒")
+                    sent = time.monotonic()
+                    response, hedged = await asyncio.wait_for(
+                        self._create(stage, model=model, messages=messages, **params),
+                        timeout=remaining
+                    )
+                if self.hedging is not None:
+                    self.hedging.observe(stage, time.monotonic() - sent)
+                return self._succeeded(model, messages, params, response, started, attempt + 1, stage, hedged)
+            except Exception as e:
+                delay = self._retry_delay(attempt, e, deadline)
+                if delay is None:
+                    raise self._failed(e, model, started, attempt + 1, stage)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _create(self, stage: str, **request):
+        """_create 的异步版本，落后的请求直接取消"""
+        delay = self.hedging.delay(stage) if self.hedging is not None else None
+        if delay is None:
+            return await self.client.chat.completions.create(**request), False
+
+        tasks = [asyncio.ensure_future(self.client.chat.completions.create(**request))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not self.concurrency.try_acquire():
+                return await tasks[0], False
+            if not self.hedging.try_hedge():
+                await self.concurrency.release_async()
+                return await tasks[0], False
+
+            self.logger.debug(f"请求 {delay:.2f} 秒未返回，发出对冲请求（阶段 {stage}）")
+            hedge_started = []
+            tasks.append(asyncio.ensure_future(self._hedge_request(request, hedge_started)))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result(), True
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            # 对冲任务还没开始运行就被取消时，其协程体（含归还名额的 finally）不会执行，由这里归还
+            if len(tasks) > 1 and not hedge_started:
+                await self.concurrency.release_async()
+
+    async def _hedge_request(self, request: Dict, started_flag: List):
+        """发出对冲请求，结束或被取消后归还 _create 为其占用的并发名额；开始运行时在 started_flag 中留下标记"""
+        started_flag.append(True)
+        started = time.monotonic()
+        error = None
+        try:
+            return await self.client.chat.completions.create(**request)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            await self.concurrency.release_async(time.monotonic() - started, error)
+
+    async def close(self):
+        await self.client.close()
+        if self.cache is not None:
+            self.cache.close()
@@ -0,0 +1,255 @@
+"""
+LLM调用指标模块 - 记录每次模型调用的 token、延迟与成本，按阶段 / 问题类型汇总
+
+每次调用记录：阶段（stage）、问题 quid / qtype、模型名、prompt / completion token 数、
+首 token 时间（ttft，非流式调用等于总延迟）、总延迟、尝试次数、是否命中缓存、流式回复是否提前结束、
+是否发出了对冲请求、错误类型与估算成本（不含对冲请求的额外开销）。
+quid / qtype / stage 通过 metrics_context 设置，线程与 asyncio 任务之间互不影响。
+另有瞬时指标（gauge，如自适应并发的当前上限 concurrency_limit），保留最新值，调用记录中附带调用时的并发上限。
+记录在产生时即追加写入结果文件旁的 *_llm_calls.jsonl（MetricsSink.open），内存中只保留按阶段 / 问题类型 / 模型的累计值。
+"""
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .config import EXPERIMENT_CONFIG
+
+_context: contextvars.ContextVar = contextvars.ContextVar('llm_metrics_context', default={})
+
+
+@contextmanager
+def metrics_context(**labels):
+    """在 with 块内发起的LLM调用附加 labels（quid / qtype / stage 等），可嵌套"""
+    token = _context.set({**_context.get(), **labels})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """按 EXPERIMENT_CONFIG['llm_prices']（每百万 token 的输入 / 输出价格）估算成本，未配置的模型为 0"""
+    prices = EXPERIMENT_CONFIG.get('llm_prices', {}).get(model)
+    if not prices:
+        return 0.0
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1e6
+
+
+class MetricsSink:
+    """
+    线程安全的调用记录收集器：open 之后每条记录立即追加写入 JSONL 文件，内存中只保留各分组的累计值
+    （汇总字段见 SUMMARY_FIELDS），内存占用与调用次数无关，进程崩溃时已写出的记录不丢失
+    """
+
+    # summary 支持的分组字段
+    SUMMARY_FIELDS = ('stage', 'qtype', 'model')
+
+    def __init__(self):
+        self.gauges: Dict[str, float] = {}
+        self.calls = 0
+        self._groups: Dict[str, Dict[str, _Aggregate]] = {}
+        self._total = _Aggregate()
+        self._file = None
+        self._captured: Optional[List[Dict]] = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def open(self, path: str, append: bool = False):
+        """此后的调用记录逐条写入 path（JSONL）；append=True 时追加到已有文件（续跑）"""
+        self.close()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            self._file = open(path, 'a' if append else 'w', encoding='utf-8')
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def detach(self):
+        """fork 出的子进程调用：丢弃继承自父进程的记录文件（由父进程写入），不关闭共享的文件描述符"""
+        with self._lock:
+            self._file = None
+
+    @contextmanager
+    def capture(self):
+        """收集 with 块内产生的调用记录（不写入文件），用于进程池 worker 把记录交给父进程"""
+        records: List[Dict] = []
+        with self._lock:
+            self._captured = records
+        try:
+            yield records
+        finally:
+            with self._lock:
+                self._captured = None
+
+    def record(self, model: str, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+               ttft: float = None, cache_hit: bool = False, attempts: int = 1, error: str = None,
+               early_stop: bool = False, hedged: bool = False, concurrency_limit: int = None, stage: str = None):
+        labels = _context.get()
+        record = {
+            'time': time.time(),
+            'stage': stage or labels.get('stage', 'unknown'),
+            'quid': labels.get('quid'),
+            'qtype': labels.get('qtype'),
+            'model': model,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'ttft': latency if ttft is None else ttft,
+            'latency': latency,
+            'attempts': attempts,
+            'cache_hit': cache_hit,
+            'error': error,
+            'early_stop': early_stop,
+            'hedged': hedged,
+            'concurrency_limit': concurrency_limit,
+            'cost': 0.0 if cache_hit else call_cost(model, prompt_tokens, completion_tokens),
+        }
+        with self._lock:
+            if self._captured is not None:
+                self._captured.append(record)
+            self._add(record)
+
+    def _add(self, record: Dict):
+        """写出一条记录并计入累计值（调用方持有锁）"""
+        if self._file is not None:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+        self.calls += 1
+        self._total.add(record)
+        for field, groups in self._groups.items():
+            key = str(record.get(field))
+            if key not in groups:
+                groups[key] = _Aggregate()
+            groups[key].add(record)
+
+    def set_gauge(self, name: str, value: float):
+        """更新瞬时指标的当前值"""
+        with self._lock:
+            self.gauges[name] = value
+
+    def merge(self, records: Iterable[Dict]):
+        """并入其他进程（如进程池 worker）收集的调用记录，或从记录文件中读出的记录"""
+        with self._lock:
+            for record in records:
+                self._add(record)
+
+    def reset(self):
+        """清空累计值（不影响记录文件）"""
+        with self._lock:
+            self.calls = 0
+            self._groups = {field: {} for field in self.SUMMARY_FIELDS}
+            self._total = _Aggregate()
+
+    def summary(self, by: str = 'stage') -> List[Dict]:
+        """按 by 字段（stage / qtype / model）汇总，另加一行 'total'"""
+        if by not in self.SUMMARY_FIELDS:
+            raise ValueError(f"不支持的汇总字段: {by}，可选 {self.SUMMARY_FIELDS}")
+        with self._lock:
+            rows = [group.row(key) for key, group in sorted(self._groups[by].items())]
+            if self.calls:
+                rows.append(self._total.row('total'))
+        return rows
+
+    def format_summary(self, by: str = 'stage') -> str:
+        """汇总表的文本形式，用于写入日志"""
+        rows = self.summary(by)
+        if not rows:
+            return "无LLM调用记录"
+        columns = [(by, 14), ('calls', 6), ('hits', 6), ('errors', 6), ('early_stops', 11), ('hedges', 6),
+                   ('prompt_tokens', 13),
+                   ('completion_tokens', 17), ('ttft_p50', 8), ('latency_p50', 11), ('latency_p95', 11),
+                   ('latency_total', 13), ('cost', 9)]
+        lines = [' '.join(name.rjust(width) for name, width in columns)]
+        for row in rows:
+            cells = []
+            for name, width in columns:
+                value = row['key'] if name == by else row[name]
+                if isinstance(value, float):
+                    value = f"{value:.4f}" if name == 'cost' else f"{value:.2f}"
+                cells.append(str(value)[:width].rjust(width))
+            lines.append(' '.join(cells))
+        return '\n'.join(lines)
+
+
+class _Aggregate:
+    """
+    一组调用记录的累计值；延迟与首 token 时间的分位数由固定大小的蓄水池样本估计，
+    调用数不超过 SAMPLE_SIZE 时与全量计算相同。命中缓存的调用不计入延迟分布
+    """
+
+    SAMPLE_SIZE = 10000
+
+    def __init__(self):
+        self.calls = self.hits = self.errors = self.early_stops = self.hedges = 0
+        self.prompt_tokens = self.completion_tokens = 0
+        self.latency_total = self.cost = 0.0
+        self._called = 0
+        self._samples: List = []
+        self._random = random.Random(0)
+
+    def add(self, record: Dict):
+        self.calls += 1
+        self.hits += bool(record['cache_hit'])
+        self.errors += record['error'] is not None
+        self.early_stops += bool(record.get('early_stop', False))
+        self.hedges += bool(record.get('hedged', False))
+        self.prompt_tokens += record['prompt_tokens']
+        self.completion_tokens += record['completion_tokens']
+        self.cost += record['cost']
+        if record['cache_hit']:
+            return
+        self.latency_total += record['latency']
+        self._called += 1
+        sample = (record['latency'], record['ttft'])
+        if len(self._samples) < self.SAMPLE_SIZE:
+            self._samples.append(sample)
+        else:
+            slot = self._random.randrange(self._called)
+            if slot < self.SAMPLE_SIZE:
+                self._samples[slot] = sample
+
+    def row(self, key: str) -> Dict:
+        samples = np.array(self._samples) if self._samples else np.zeros((1, 2))
+        return {
+            'key': key,
+            'calls': self.calls,
+            'hits': self.hits,
+            'errors': self.errors,
+            'early_stops': self.early_stops,
+            'hedges': self.hedges,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'ttft_p50': float(np.percentile(samples[:, 1], 50)),
+            'latency_p50': float(np.percentile(samples[:, 0], 50)),
+            'latency_p95': float(np.percentile(samples[:, 0], 95)),
+            'latency_total': self.latency_total,
+            'cost': self.cost,
+        }
+
+
+def calls_path(results_file: str) -> str:
+    """结果文件对应的调用记录文件：<结果文件名>_llm_calls.jsonl"""
+    return os.path.splitext(results_file)[0] + "_llm_calls.jsonl"
+
+
+# 进程内默认的指标收集器，LLM客户端未指定 metrics 时记录到这里
+METRICS = MetricsSink()
+
+
+def log_summaries(logger, sink: MetricsSink = None):
+    """将按阶段与按问题类型的汇总表写入日志"""
+    sink = sink or METRICS
+    logger.info(f"LLM调用统计（按阶段）:\n{sink.format_summary('stage')}")
+    logger.info(f"LLM调用统计（按问题类型）:\n{sink.format_summary('qtype')}")
+    if sink.gauges:
+        logger.info(f"LLM瞬时指标: {sink.gauges}")
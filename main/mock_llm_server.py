@@ -0,0 +1,314 @@
+"""
+本地模拟LLM服务 - 兼容 OpenAI chat completions 接口，用于离线压测
+
+- 延迟分布：fixed / uniform / normal / lognormal，按请求独立采样
+- 故障注入：按概率返回 500 错误或 429 限流（带 Retry-After）；设置 capacity 后，
+  在途请求超过容量时直接返回 429，用于模拟服务端的并发配额
+- 预置回复：按提示哈希（messages 的 sha256）返回预置内容，未命中返回默认回复
+- 流式回复：请求带 stream=true 时以 SSE 分块返回，每块间隔 token_latency 秒；
+  客户端中途断开（提前结束生成）计入 cancelled
+- GET /stats 返回请求计数与峰值并发，用于核对客户端的并发与重试行为
+
+用法：
+    python -m MY.main.mock_llm_server --port 18000 --latency lognormal --latency-mean 0.8 --error-rate 0.02
+    LLM_BASE_URL=http://127.0.0.1:18000/v1 OPENROUTER_API_KEY=mock python -m MY.main.run_experiment --async
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+DEFAULT_RESPONSE = """```python
+def query_kg(df):
+    return []
+```"""
+
+LATENCY_KINDS = ('fixed', 'uniform', 'normal', 'lognormal')
+
+
+def prompt_hash(messages: List[Dict]) -> str:
+    """提示哈希：messages 规范化 JSON 的 sha256，与模型和采样参数无关"""
+    payload = json.dumps(messages, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LatencyModel:
+    """
+    请求延迟分布（秒）
+
+    fixed: 恒为 mean；uniform: [mean - spread, mean + spread]；
+    normal: N(mean, spread)；lognormal: 均值为 mean、对数标准差为 spread 的长尾分布
+    """
+
+    def __init__(self, kind: str = 'fixed', mean: float = 0.0, spread: float = 0.0, seed: int = None):
+        if kind not in LATENCY_KINDS:
+            raise ValueError(f"未知的延迟分布: {kind}")
+        self.kind = kind
+        self.mean = mean
+        self.spread = spread
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == 'uniform':
+                value = self._rng.uniform(self.mean - self.spread, self.mean + self.spread)
+            elif self.kind == 'normal':
+                value = self._rng.gauss(self.mean, self.spread)
+            elif self.kind == 'lognormal' and self.mean > 0:
+                # 取 mu 使分布均值为 mean
+                mu = math.log(self.mean) - self.spread ** 2 / 2
+                value = self._rng.lognormvariate(mu, self.spread)
+            else:
+                value = self.mean
+        return max(0.0, value)
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """模拟服务，配置与统计保存在服务实例上，供请求处理器读取"""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency: LatencyModel = None, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 1.0, responses: Dict[str, str] = None,
+                 default_response: str = DEFAULT_RESPONSE, token_latency: float = 0.0, capacity: int = 0,
+                 seed: int = None):
+        super().__init__(address, _Handler)
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.responses = responses or {}
+        self.default_response = default_response
+        self.token_latency = token_latency
+        self.capacity = capacity
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'completed': 0, 'errors': 0, 'rate_limited': 0,
+                      'canned_hits': 0, 'cancelled': 0, 'in_flight': 0, 'peak_in_flight': 0}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _count(self, key: str, delta: int = 1) -> int:
+        """计数加 delta，返回更新后的值（读与写在同一把锁内，可直接用于配额判断）"""
+        with self._lock:
+            self.stats[key] += delta
+            if key == 'in_flight':
+                self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.stats['in_flight'])
+            return self.stats[key]
+
+    def _draw_fault(self):
+        """按概率抽取本次请求的故障：None / 429 / 500"""
+        with self._lock:
+            draw = self._rng.random()
+        if draw < self.rate_limit_rate:
+            return 429
+        if draw < self.rate_limit_rate + self.error_rate:
+            return 500
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: MockLLMServer
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            with self.server._lock:
+                self._send_json(200, dict(self.server.stats))
+        else:
+            self._send_json(404, {'error': {'message': f'未知路径: {self.path}', 'type': 'not_found'}})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f'未知路径: {self.path}', 'type': 'not_found'}})
+            return
+
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': {'message': '请求体不是有效的JSON', 'type': 'invalid_request_error'}})
+            return
+
+        server._count('requests')
+        in_flight = server._count('in_flight')
+        try:
+            if server.capacity and in_flight > server.capacity:
+                server._count('rate_limited')
+                self._send_json(429, {'error': {'message': '超出并发配额', 'type': 'rate_limit_exceeded'}},
+                                {'Retry-After': str(server.retry_after)})
+                return
+            time.sleep(server.latency.sample())
+            fault = server._draw_fault()
+            if fault == 429:
+                server._count('rate_limited')
+                self._send_json(429, {'error': {'message': '模拟限流', 'type': 'rate_limit_exceeded'}},
+                                {'Retry-After': str(server.retry_after)})
+                return
+            if fault == 500:
+                server._count('errors')
+                self._send_json(500, {'error': {'message': '模拟服务错误', 'type': 'server_error'}})
+                return
+
+            key = prompt_hash(body.get('messages', []))
+            if key in server.responses:
+                server._count('canned_hits')
+            content = server.responses.get(key, server.default_response)
+            if body.get('stream'):
+                include_usage = bool((body.get('stream_options') or {}).get('include_usage'))
+                if not self._send_stream(body.get('model', 'mock'), content, body.get('messages', []), include_usage):
+                    server._count('cancelled')
+                    return
+            else:
+                self._send_json(200, _completion(body.get('model', 'mock'), content, body.get('messages', [])))
+            server._count('completed')
+        finally:
+            server._count('in_flight', -1)
+
+    def _send_json(self, status: int, payload: Dict, headers: Dict = None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        try:
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已超时断开
+            pass
+
+    def _send_stream(self, model: str, content: str, messages: List[Dict], include_usage: bool) -> bool:
+        """以 SSE 分块发送回复（约 4 个字符一块，对应一个 token），客户端中途断开时返回 False"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        # 不带 Content-Length，以关闭连接表示流结束
+        self.send_header('Connection', 'close')
+        self.close_connection = True
+        completion_id = f'chatcmpl-{uuid.uuid4().hex[:24]}'
+        try:
+            self.end_headers()
+            for i in range(0, len(content), 4):
+                self._send_event(_chunk(completion_id, model, {'content': content[i:i + 4]}))
+                if self.server.token_latency:
+                    time.sleep(self.server.token_latency)
+            self._send_event(_chunk(completion_id, model, {}, finish_reason='stop'))
+            if include_usage:
+                usage = _completion(model, content, messages)['usage']
+                self._send_event({**_chunk(completion_id, model, None), 'usage': usage})
+            self.wfile.write(b'data: [DONE]\n\n')
+            self.wfile.flush()
+            return True
+        except (BrokenPipeError, ConnectionResetError):
+            return False
+
+    def _send_event(self, payload: Dict):
+        self.wfile.write(b'data: ' + json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n\n')
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _approx_tokens(text: str) -> int:
+    """粗略的 token 数（约 4 个字符一个 token），供客户端的调用指标使用"""
+    return max(1, len(text) // 4)
+
+
+def _completion(model: str, content: str, messages: List[Dict]) -> Dict:
+    """chat.completion 响应体；reasoning_content 供 ex1 按 deepseek-reasoner 的格式读取"""
+    prompt_tokens = sum(_approx_tokens(str(m.get('content', ''))) for m in messages)
+    completion_tokens = _approx_tokens(content)
+    return {
+        'id': f'chatcmpl-{uuid.uuid4().hex[:24]}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content, 'reasoning_content': ''},
+            'finish_reason': 'stop',
+        }],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens},
+    }
+
+
+def _chunk(completion_id: str, model: str, delta: Dict = None, finish_reason: str = None) -> Dict:
+    """chat.completion.chunk 分块；delta 为 None 时是只携带 usage 的末尾分块（choices 为空）"""
+    return {
+        'id': completion_id,
+        'object': 'chat.completion.chunk',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [] if delta is None else [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+    }
+
+
+def load_responses(path: str) -> Dict[str, str]:
+    """加载预置回复文件：{提示哈希: 回复内容} 的JSON对象"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def start_server(host: str = '127.0.0.1', port: int = 0, **options) -> MockLLMServer:
+    """在后台线程启动模拟服务（port=0 时自动分配端口），返回服务实例，结束时调用 shutdown()"""
+    server = MockLLMServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="本地模拟 OpenAI chat completions 服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18000)
+    parser.add_argument('--latency', choices=LATENCY_KINDS, default='fixed', help="延迟分布")
+    parser.add_argument('--latency-mean', type=float, default=0.5, help="平均延迟（秒）")
+    parser.add_argument('--latency-spread', type=float, default=0.0,
+                        help="延迟离散程度：uniform 为半宽，normal 为标准差，lognormal 为对数标准差")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回 500 错误的概率")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="返回 429 限流的概率")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="429 响应的 Retry-After（秒）")
+    parser.add_argument('--capacity', type=int, default=0, help="并发配额：在途请求超过该值时返回 429，0 表示不限")
+    parser.add_argument('--token-latency', type=float, default=0.0, help="流式回复每个分块的间隔（秒）")
+    parser.add_argument('--responses', help="预置回复文件（{提示哈希: 回复内容}）")
+    parser.add_argument('--seed', type=int, help="随机种子，固定后延迟与故障序列可复现")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = MockLLMServer(
+        (args.host, args.port),
+        latency=LatencyModel(args.latency, args.latency_mean, args.latency_spread, args.seed),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        responses=load_responses(args.responses) if args.responses else None,
+        token_latency=args.token_latency,
+        capacity=args.capacity,
+        seed=args.seed,
+    )
+    print(f"模拟LLM服务已启动: {server.base_url}（统计: http://{args.host}:{args.port}/stats）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,41 @@
 """
 查询执行器 - 负责执行生成的代码并修复错误
 """
+import numpy as np
 import pandas as pd
 import traceback
 import logging
 from typing import List, Any
 from .result_processor import ResultProcessor
+from .time_utils import time_mask
+from .kg_helpers import KGHelpers
+from .kg_store import read_only_view
 
 
 class QueryExecutor:
     def __init__(self):
         self.result_processor = ResultProcessor()
+        self.logger = logging.getLogger(__name__)
     
-    def execute_query(self, code: str, kg_df: pd.DataFrame) -> list:
-        """执行查询代码并返回清理后的结果"""
+    def execute_query(self, code: str, kg_df: pd.DataFrame, kg_store=None, kg_index=None, kg_planner=None) -> list:
+        """
+        执行查询代码并返回清理后的结果
+
+        kg_store 为 KGQuadStore，生成的代码可通过全局变量 kg 访问其零拷贝整数列视图
+        （kg.heads / kg.relations / kg.tails / kg.ts_ids），行顺序与 df 一致；
+        kg_index 为 KGIndex，实体匹配可通过全局变量 kg_index 走倒排索引；
+        kg_planner 为 QueryPlanner，多条件筛选可通过全局变量 kg_planner 按基数选择访问路径；
+        time_mask(frame, op, value) 在 day / month / year 整数列上做时间过滤；
+        select_rows / first_record 等辅助函数（KGHelpers）绑定到本次的 df 与索引后注入全局变量，
+        代码模板直接调用，无需在生成的代码中重复定义；
+        df 以只读视图传入，生成的代码无法改写共享的知识图谱，因此可以并发执行
+        """
         try:
+            kg_df = read_only_view(kg_df)
             # 创建执行环境
-            exec_globals = {'df': kg_df, 'pd': pd}
+            exec_globals = {'df': kg_df, 'pd': pd, 'np': np, 'kg': kg_store, 'kg_index': kg_index,
+                            'kg_planner': kg_planner, 'time_mask': time_mask,
+                            **KGHelpers(kg_df, kg_store, kg_index, kg_planner).namespace()}
             
             # 执行代码
             exec(code, exec_globals)
@@ -35,6 +54,19 @@ class QueryExecutor:
             self.logger.error(f"查询执行失败: {str(e)}")
             return []
     
+    def execute_plan(self, plan: dict, plan_executor) -> list:
+        """
+        执行查询计划并返回清理后的结果
+
+        plan_executor 为 PlanExecutor，计划直接在KG索引上执行，无需编译和exec生成的代码
+        """
+        try:
+            raw_results = plan_executor.execute(plan)
+            return self.result_processor.process_results(raw_results)
+        except Exception as e:
+            self.logger.error(f"计划执行失败: {str(e)}")
+            return []
+
     def _try_fix_code(self, code: str, error_msg: str) -> str:
         """尝试修复代码中的常见错误"""
         fixed_code = code
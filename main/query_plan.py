@@ -0,0 +1,335 @@
+"""
+查询计划模块 - 声明式的时序查询计划（JSON）及其在KG索引上的原生执行
+
+计划是嵌套的 dict，每个节点由 "op" 指定算子。除 project 外，每个算子产生一个有序的行号数组：
+
+- entity       {"role": "head"|"tail"|"any", "names": [...], "exact": false, "input": 可选}
+               名称匹配的实体所在行；有 input 时为对 input 的过滤。多个名称按列表顺序排列结果
+- relation     {"relations": [...], "input": 可选}
+               关系属于 relations 的行，结果按关系在列表中的先后（优先级）稳定排序
+- time         {"cmp": "equal"|"before"|"after"|"same_month"|"same_year",
+                "value": "2007-06" 或 "ref": 子计划, "granularity": 可选, "input": ...}
+               时间过滤；ref 时取子计划第一行的时间戳作为比较值
+- order        {"input": ..., "desc": false}                 按时间稳定排序
+- first / last {"input": ..., "n": 1}                        时间最早 / 最晚的 n 行（last 按时间倒序）
+- join         {"left": ..., "right": ..., "left_on": "head", "right_on": "tail"}
+               left 中 left_on 位置的实体在 right 的 right_on 位置出现过的行（半连接）
+- same_period  {"input": ..., "ref": ..., "granularity": "month"|"year"}
+               与 ref 第一行处于同一月 / 同一年的行
+- union        {"inputs": [...]}                             按顺序合并并去重
+- project      {"input": ..., "field": "head"|"tail"|"relation"|"timestamp",
+                "time_level": "day"|"month"|"year", "exclude": [...], "limit": 10}
+               计划的根节点，输出去重后的答案字符串列表
+
+示例（Who first visited Qatar?）：
+    {"op": "project", "field": "head", "limit": 1,
+     "input": {"op": "first", "input": {"op": "relation", "relations": ["Make_a_visit"],
+               "input": {"op": "entity", "role": "tail", "names": ["Qatar"]}}}}
+"""
+import json
+import logging
+import re
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from typing import Dict, List
+
+from .kg_store import KGQuadStore
+from .kg_index import KGIndex
+from .time_utils import TIME_OPS
+
+ROW_OPS = ('entity', 'relation', 'time', 'order', 'first', 'last', 'join', 'same_period', 'union')
+ROLES = ('head', 'tail', 'any')
+FIELDS = ('head', 'relation', 'tail', 'timestamp')
+_TIME_LEVEL_WIDTH = {'day': 10, 'month': 7, 'year': 4}
+
+
+class PlanError(ValueError):
+    """计划格式错误"""
+
+
+def _require(node: Dict, key: str, kind):
+    value = node.get(key)
+    if not isinstance(value, kind):
+        raise PlanError(f"{node.get('op')} 算子缺少或错误的字段 '{key}'")
+    return value
+
+
+def _validate_rows(node) -> None:
+    if not isinstance(node, dict):
+        raise PlanError(f"计划节点必须是对象: {node!r}")
+    op = node.get('op')
+    if op not in ROW_OPS:
+        raise PlanError(f"未知的算子: {op!r}")
+
+    if op == 'entity':
+        if node.get('role', 'any') not in ROLES:
+            raise PlanError(f"未知的实体位置: {node.get('role')!r}")
+        if not _require(node, 'names', list):
+            raise PlanError("entity 算子的 names 不能为空")
+    elif op == 'relation':
+        _require(node, 'relations', list)
+    elif op == 'time':
+        if node.get('cmp') not in TIME_OPS:
+            raise PlanError(f"未知的时间比较: {node.get('cmp')!r}")
+        if 'ref' in node:
+            _validate_rows(node['ref'])
+        else:
+            _require(node, 'value', str)
+    elif op in ('first', 'last'):
+        if not isinstance(node.get('n', 1), int) or node.get('n', 1) < 1:
+            raise PlanError(f"{op} 算子的 n 必须是正整数")
+    elif op == 'join':
+        _validate_rows(_require(node, 'left', dict))
+        _validate_rows(_require(node, 'right', dict))
+        if node.get('left_on', 'head') not in ('head', 'tail') or node.get('right_on', 'head') not in ('head', 'tail'):
+            raise PlanError("join 算子的 left_on / right_on 只能是 head 或 tail")
+        return
+    elif op == 'same_period':
+        _validate_rows(_require(node, 'ref', dict))
+        if node.get('granularity', 'month') not in ('month', 'year'):
+            raise PlanError(f"same_period 粒度只能是 month 或 year: {node.get('granularity')!r}")
+    elif op == 'union':
+        for child in _require(node, 'inputs', list):
+            _validate_rows(child)
+        return
+
+    # entity / relation 可以作为叶子节点，其余算子必须有输入
+    if 'input' in node:
+        _validate_rows(node['input'])
+    elif op not in ('entity', 'relation'):
+        raise PlanError(f"{op} 算子缺少 input")
+
+
+def validate_plan(plan: Dict) -> Dict:
+    """校验计划结构，格式错误时抛出 PlanError"""
+    if not isinstance(plan, dict) or plan.get('op') != 'project':
+        raise PlanError("计划的根节点必须是 project 算子")
+    if plan.get('field', 'head') not in FIELDS:
+        raise PlanError(f"未知的输出字段: {plan.get('field')!r}")
+    if plan.get('time_level', 'day') not in _TIME_LEVEL_WIDTH:
+        raise PlanError(f"未知的时间粒度: {plan.get('time_level')!r}")
+    _validate_rows(_require(plan, 'input', dict))
+    return plan
+
+
+def plan_key(plan: Dict) -> str:
+    """计划的规范化JSON，作为缓存键"""
+    return json.dumps(plan, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+
+
+def untruncated_plan(plan: Dict) -> Dict:
+    """
+    去掉截断的等价计划，用于统计截断前的候选答案数：project 不设 limit，
+    first / last 改为保留与首 / 末行同一时间的全部行（time equal + ref）
+    """
+    def rewrite(node: Dict) -> Dict:
+        node = {key: rewrite(value) if isinstance(value, dict) else
+                ([rewrite(child) for child in value] if key == 'inputs' else value)
+                for key, value in node.items()}
+        if node['op'] in ('first', 'last'):
+            return {'op': 'time', 'cmp': 'equal', 'ref': node, 'input': node['input']}
+        return node
+
+    plan = rewrite(plan)
+    plan.pop('limit', None)
+    return plan
+
+
+def parse_plan(text: str) -> Dict:
+    """从LLM回复中解析计划（允许 ```json 代码块或前后说明文字）"""
+    match = re.search(r'```(?:json)?\s*(.*?)```', text, re.DOTALL)
+    if match:
+        text = match.group(1)
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end < start:
+        raise PlanError("回复中没有JSON计划")
+    try:
+        plan = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise PlanError(f"计划不是合法的JSON: {e}")
+    return validate_plan(plan)
+
+
+class PlanExecutor:
+    """
+    在 KGQuadStore 的整数列与 KGIndex 倒排表上执行查询计划，结果按计划的规范化JSON缓存；
+    提供 QueryPlanner 时，entity / relation / time 组成的条件链交由规划器按基数选择访问路径
+    """
+
+    CACHE_SIZE = 1024
+
+    def __init__(self, store: KGQuadStore, index: KGIndex, planner=None):
+        self.store = store
+        self.index = index
+        self.planner = planner
+        self.logger = logging.getLogger(__name__)
+        self._cache: OrderedDict = OrderedDict()
+        self._operators = {
+            'entity': self._entity,
+            'relation': self._relation,
+            'time': self._time,
+            'order': self._order,
+            'first': self._first,
+            'last': self._last,
+            'join': self._join,
+            'same_period': self._same_period,
+            'union': self._union,
+        }
+        self._columns = {
+            'head': (store.heads, store.entity_names),
+            'relation': (store.relations, store.relation_names),
+            'tail': (store.tails, store.entity_names),
+            'timestamp': (store.ts_ids, store.ts_names),
+        }
+
+    def execute(self, plan: Dict) -> List[str]:
+        """执行计划，返回答案字符串列表"""
+        key = plan_key(plan)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return list(self._cache[key])
+
+        validate_plan(plan)
+        answers = self._project(plan)
+
+        self._cache[key] = answers
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return list(answers)
+
+    def rows(self, node: Dict) -> np.ndarray:
+        """执行行级算子，返回有序行号"""
+        if self.planner is not None and node['op'] in ('entity', 'relation', 'time'):
+            conjuncts = self._conjuncts(node)
+            if conjuncts is not None:
+                return self._select(*conjuncts)
+        return self._operators[node['op']](node)
+
+    def _conjuncts(self, node: Dict):
+        """
+        将 entity / relation / time(value) 组成的算子链收集为 QueryPlanner.select 的参数，
+        链中含有无法交给规划器的节点（ref、重复位置、多名称叶子等）时返回 None
+        """
+        spec, relations, exact = {}, None, None
+        while node is not None:
+            op = node['op']
+            if op == 'entity':
+                key = {'head': 'heads', 'tail': 'tails', 'any': 'entities'}[node.get('role', 'any')]
+                node_exact = node.get('exact', False)
+                # 多名称的叶子节点按名称顺序排列结果，不能与其他条件合并
+                if key in spec or (exact is not None and exact != node_exact) or \
+                        ('input' not in node and len(node['names']) > 1):
+                    return None
+                spec[key], exact = node['names'], node_exact
+            elif op == 'relation':
+                if relations is not None:
+                    return None
+                relations = node['relations']
+                spec['relations'] = relations
+            elif op == 'time':
+                if 'ref' in node or 'time' in spec:
+                    return None
+                spec['time'] = (node['cmp'], node['value'], node.get('granularity'))
+            else:
+                return None
+            node = node.get('input')
+        return spec, relations, bool(exact)
+
+    def _select(self, spec: Dict, relations, exact: bool) -> np.ndarray:
+        rows = self.planner.select(exact=exact, **spec)
+        return rows if relations is None else self._by_relation_priority(rows, relations)
+
+    def _input_rows(self, node: Dict):
+        return self.rows(node['input']) if 'input' in node else None
+
+    def _entity(self, node: Dict) -> np.ndarray:
+        role = node.get('role', 'any')
+        exact = node.get('exact', False)
+        rows = self._input_rows(node)
+
+        if rows is None:
+            parts = [self.index.entity_rows(role, [name] if exact else name) for name in node['names']]
+            return pd.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int32)
+
+        entity_ids = self.index.entity_ids(node['names'], exact)
+        roles = ('head', 'tail') if role == 'any' else (role,)
+        keep = np.zeros(len(rows), dtype=bool)
+        for r in roles:
+            keep |= np.isin(self._columns[r][0][rows], entity_ids)
+        return rows[keep]
+
+    def _relation(self, node: Dict) -> np.ndarray:
+        rows = self._input_rows(node)
+        if rows is None:
+            rows = self.index.relation_rows(self.index.relation_ids(node['relations']))
+        return self._by_relation_priority(rows, node['relations'])
+
+    def _by_relation_priority(self, rows: np.ndarray, relations) -> np.ndarray:
+        """保留关系属于 relations 的行，按关系在列表中的位置排序，同一关系内保持输入顺序"""
+        relation_ids = self.index.relation_ids(relations)
+        rank = np.full(len(self.store.relation_names), len(relation_ids), dtype=np.int64)
+        rank[relation_ids[::-1]] = np.arange(len(relation_ids))[::-1]
+        ranks = rank[self.store.relations[rows]]
+        rows = rows[ranks < len(relation_ids)]
+        ranks = ranks[ranks < len(relation_ids)]
+        return rows[np.argsort(ranks, kind='stable')]
+
+    def _ref_timestamp(self, ref: Dict):
+        rows = self.rows(ref)
+        return self.store.ts_names[self.store.ts_ids[rows[0]]] if len(rows) else None
+
+    def _time(self, node: Dict) -> np.ndarray:
+        rows = self._input_rows(node)
+        value = self._ref_timestamp(node['ref']) if 'ref' in node else node['value']
+        if value is None:
+            return rows[:0]
+        # 行按时间排序，时间谓词对应连续行区间
+        start, end = self.store.time_range(node['cmp'], value, node.get('granularity'))
+        return rows[(rows >= start) & (rows < end)]
+
+    def _order(self, node: Dict) -> np.ndarray:
+        rows = self._input_rows(node)
+        order = np.argsort(self.store.days[rows], kind='stable')
+        return rows[order[::-1]] if node.get('desc') else rows[order]
+
+    def _first(self, node: Dict) -> np.ndarray:
+        rows = self._input_rows(node)
+        return rows[np.lexsort((rows, self.store.days[rows]))][:node.get('n', 1)]
+
+    def _last(self, node: Dict) -> np.ndarray:
+        rows = self._input_rows(node)
+        return rows[np.lexsort((rows, self.store.days[rows]))[::-1]][:node.get('n', 1)]
+
+    def _join(self, node: Dict) -> np.ndarray:
+        left = self.rows(node['left'])
+        right = self.rows(node['right'])
+        right_entities = self._columns[node.get('right_on', 'head')][0][right]
+        return left[np.isin(self._columns[node.get('left_on', 'head')][0][left], right_entities)]
+
+    def _same_period(self, node: Dict) -> np.ndarray:
+        granularity = node.get('granularity', 'month')
+        return self._time({'input': node['input'], 'ref': node['ref'], 'cmp': 'equal', 'granularity': granularity})
+
+    def _union(self, node: Dict) -> np.ndarray:
+        parts = [self.rows(child) for child in node['inputs']]
+        return pd.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int32)
+
+    def _project(self, plan: Dict) -> List[str]:
+        rows = self.rows(plan['input'])
+        codes, names = self._columns[plan.get('field', 'head')]
+        width = _TIME_LEVEL_WIDTH[plan.get('time_level', 'day')]
+        exclude = set(plan.get('exclude', []))
+        limit = plan.get('limit')
+
+        answers = []
+        for code in pd.unique(codes[rows]):
+            answer = names[code]
+            if plan.get('field') == 'timestamp':
+                answer = answer[:width]
+            if answer in exclude or answer in answers:
+                continue
+            answers.append(answer)
+            if limit is not None and len(answers) >= limit:
+                break
+        return answers
@@ -0,0 +1,113 @@
+"""
+查询规划模块 - 基于 KGStatistics 的基数估计，为实体 / 关系 / 时间的合取条件选择访问路径
+
+每个条件既可以作为访问路径（实体 / 关系取倒排表，时间取按时间排序的连续行区间），
+也可以作为过滤条件（在已取出的行上判断）。
+规划器选择估计行数最少的条件作为访问路径，其余条件按估计行数从小到大依次过滤。
+"""
+import logging
+import numpy as np
+from typing import Dict, List, Tuple
+
+from .kg_index import KGIndex
+from .kg_stats import KGStatistics
+
+# select 参数名 -> 实体位置
+_ENTITY_ROLES = (('heads', 'head'), ('tails', 'tail'), ('entities', 'any'))
+
+
+class QueryPlanner:
+    """
+    代价驱动的行选择
+
+    每次规划的决策保存在 last_decision 中；log_decisions=True 时以 INFO 级别写入日志，
+    否则为 DEBUG 级别，便于排查慢查询。
+    """
+
+    def __init__(self, index: KGIndex, stats: KGStatistics, log_decisions: bool = False):
+        self.index = index
+        self.stats = stats
+        self.store = index.store
+        self.logger = logging.getLogger(__name__)
+        self.log_level = logging.INFO if log_decisions else logging.DEBUG
+        self.last_decision: Dict = {}
+
+    def _entity_path(self, role: str, spec, exact: bool) -> Dict:
+        entity_ids = self.index.entity_ids(spec, exact)
+        columns = [self.store.heads, self.store.tails] if role == 'any' else \
+            [self.store.heads if role == 'head' else self.store.tails]
+        return {
+            'name': f'entity:{role}',
+            'estimate': self.stats.entity_degree(role, entity_ids),
+            'fetch': lambda: self.index.rows_for_ids(role, entity_ids),
+            'keep': lambda rows: np.logical_or.reduce([np.isin(col[rows], entity_ids) for col in columns]),
+        }
+
+    def _relation_path(self, relations) -> Dict:
+        relation_ids = self.index.relation_ids(relations)
+        return {
+            'name': 'relation',
+            'estimate': self.stats.relation_count(relation_ids),
+            'fetch': lambda: self.index.relation_rows(relation_ids),
+            'keep': lambda rows: np.isin(self.store.relations[rows], relation_ids),
+        }
+
+    def _time_path(self, time: Tuple) -> Dict:
+        # 行按时间排序，满足时间谓词的行是一段连续区间 [start, end)，估计值即精确行数
+        start, end = self.store.time_range(*time)
+        return {
+            'name': f'time:{time[0]} {time[1]}',
+            'estimate': end - start,
+            'fetch': lambda: np.arange(start, end, dtype=np.int32),
+            'keep': lambda rows: (rows >= start) & (rows < end),
+        }
+
+    def plan(self, heads=None, tails=None, entities=None, relations=None, time=None,
+             exact: bool = False) -> List[Dict]:
+        """返回按估计行数排序的访问路径列表，第一个为驱动路径"""
+        paths = []
+        specs = {'heads': heads, 'tails': tails, 'entities': entities}
+        for key, role in _ENTITY_ROLES:
+            if specs[key] is not None:
+                paths.append(self._entity_path(role, specs[key], exact))
+        if relations is not None:
+            paths.append(self._relation_path(relations))
+        if time is not None:
+            paths.append(self._time_path(tuple(time)))
+        if not paths:
+            raise ValueError("至少需要一个实体、关系或时间条件")
+        return sorted(paths, key=lambda p: p['estimate'])
+
+    def select(self, heads=None, tails=None, entities=None, relations=None, time=None,
+               exact: bool = False) -> np.ndarray:
+        """
+        满足全部条件的有序行号
+
+        heads / tails / entities: 对应 head / tail / 任一位置的实体（匹配模式字符串或列表，exact=True 时为精确实体名）
+        relations: 关系名列表
+        time: (op, value) 或 (op, value, granularity)，语义同 time_mask
+        """
+        paths = self.plan(heads, tails, entities, relations, time, exact)
+        driver = paths[0]
+        rows = driver['fetch']()
+        for path in paths[1:]:
+            if len(rows) == 0:
+                break
+            rows = rows[path['keep'](rows)]
+
+        self.last_decision = {
+            'driver': driver['name'],
+            'estimates': {p['name']: p['estimate'] for p in paths},
+            'rows': int(len(rows)),
+        }
+        self.logger.log(self.log_level, self.explain())
+        return rows
+
+    def explain(self) -> str:
+        """最近一次规划决策的文字描述"""
+        decision = self.last_decision
+        if not decision:
+            return "尚未执行规划"
+        filters = [f"{name}(≈{est})" for name, est in decision['estimates'].items() if name != decision['driver']]
+        return (f"访问路径: {decision['driver']}(≈{decision['estimates'][decision['driver']]})"
+                f"，过滤顺序: {' -> '.join(filters) or '无'}，结果 {decision['rows']} 行")
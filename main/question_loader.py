@@ -0,0 +1,155 @@
+"""
+问题加载模块 - 流式读取问题文件，内存占用与问题数无关
+
+支持两种格式：JSON 数组（如 dev_25.json、MultiTQ 各划分）与 JSONL（每行一个问题），按文件首个非空白字符判断。
+JSON 数组分块读入，用 JSONDecoder.raw_decode 逐个解析元素，不把整个文件读入内存。
+读取时按 qtype / answer_type / time_level 过滤、截取前 limit 个问题，再按 quid 哈希选取分片：
+各分片的并集与不分片运行处理的问题相同。
+"""
+import json
+import logging
+from itertools import islice
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from .sharding import shard_of
+
+logger = logging.getLogger(__name__)
+
+# 可过滤的问题字段 -> 配置键
+FILTER_FIELDS = {
+    'qtype': 'question_qtypes',
+    'answer_type': 'question_answer_types',
+    'time_level': 'question_time_levels',
+}
+
+_CHUNK_SIZE = 1 << 16
+
+
+def _iter_json_array(f, path: str) -> Iterator[Dict]:
+    """逐个解析 JSON 数组的元素；f 已定位到 '[' 之后"""
+    decoder = json.JSONDecoder()
+    buffer, pos, eof, count = '', 0, False, 0
+    while True:
+        # 跳过元素之间的空白与逗号
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError(f"问题文件不完整，缺少 ']': {path}")
+            buffer, pos = f.read(_CHUNK_SIZE), 0
+            eof = not buffer
+            continue
+        if buffer[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # 元素跨越了分块边界：读入下一块后重试
+            if eof:
+                raise ValueError(f"无法解析问题文件 {path} 中的第 {count + 1} 个问题")
+            chunk = f.read(max(_CHUNK_SIZE, len(buffer) - pos))
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield item
+        count += 1
+        pos = end
+
+
+def _iter_jsonl(f, path: str) -> Iterator[Dict]:
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            logger.warning(f"跳过无法解析的问题行 {path}:{number}")
+
+
+def read_questions(path: str) -> Iterator[Dict]:
+    """按文件中的顺序逐个产出问题"""
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        first = ''
+        while True:
+            first = f.read(1)
+            if not first or not first.isspace():
+                break
+        if first == '[':
+            yield from _iter_json_array(f, path)
+        elif first:
+            f.seek(0)
+            yield from _iter_jsonl(f, path)
+
+
+def filters_from_config(config: Dict) -> Dict[str, Iterable[str]]:
+    """配置中的过滤条件：{字段: 允许的取值}"""
+    return {field: config.get(key) for field, key in FILTER_FIELDS.items()}
+
+
+def _as_set(values) -> Optional[frozenset]:
+    if values is None:
+        return None
+    return frozenset([values] if isinstance(values, str) else values)
+
+
+class QuestionSet:
+    """
+    可重复迭代的问题集合：每次迭代重新流式读取文件并应用过滤条件，不在内存中保留问题
+    filters 为 {字段: 允许的取值}（字段见 FILTER_FIELDS，取值为 None 表示不过滤）；
+    limit 为过滤后、分片前最多取用的问题数（None 或 0 表示不限）；shard 为 (i, N)，从这些问题中选取分到第 i 个分片的
+    """
+
+    def __init__(self, path: str, filters: Dict[str, Iterable[str]] = None, shard: Tuple[int, int] = None,
+                 limit: int = None):
+        self.path = path
+        self.filters = {field: allowed for field, allowed in
+                        ((field, _as_set(values)) for field, values in (filters or {}).items())
+                        if allowed is not None}
+        self.shard = tuple(shard) if shard else None
+        self.limit = limit if limit and limit > 0 else None
+        self._count = None
+
+    @classmethod
+    def from_config(cls, config: Dict, path: str = None) -> 'QuestionSet':
+        """按配置中的 questions_path、question_qtypes / question_answer_types / question_time_levels、
+        shard 与 max_questions 构建"""
+        return cls(path or config['questions_path'], filters_from_config(config), config.get('shard'),
+                   config.get('max_questions'))
+
+    def matches(self, question: Dict) -> bool:
+        """问题是否满足字段过滤条件（不含分片与 limit）"""
+        return all(question.get(field) in allowed for field, allowed in self.filters.items())
+
+    def indexed(self) -> Iterator[Tuple[int, Dict]]:
+        """产出 (位置, 问题)，位置为问题在不分片时的处理顺序中的序号，用于分片合并后恢复该顺序"""
+        questions = islice((q for q in read_questions(self.path) if self.matches(q)), self.limit)
+        for position, question in enumerate(questions):
+            if self.shard is None or shard_of(question['quid'], self.shard[1]) == self.shard[0]:
+                yield position, question
+
+    def __iter__(self) -> Iterator[Dict]:
+        return (question for _, question in self.indexed())
+
+    def __len__(self) -> int:
+        """符合条件的问题数；第一次调用时流式计数一遍并缓存"""
+        if self._count is None:
+            self._count = sum(1 for _ in self)
+        return self._count
+
+    def __getitem__(self, index: int) -> Dict:
+        """按位置取一个问题（逐个读到该位置，供调试脚本使用）"""
+        if index < 0:
+            index += len(self)
+        question = next(islice(self, index, None), None) if index >= 0 else None
+        if question is None:
+            raise IndexError(index)
+        return question
+
+    def describe(self) -> str:
+        """过滤条件的文本形式，用于日志"""
+        parts = [f"{field} in {sorted(allowed)}" for field, allowed in self.filters.items()]
+        if self.limit:
+            parts.append(f"前 {self.limit} 个")
+        if self.shard:
+            parts.append(f"其中分片 {self.shard[0]}/{self.shard[1]}")
+        return '，'.join(parts) or '全部问题'
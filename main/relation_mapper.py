@@ -113,8 +113,8 @@ class RelationMapper:
         
         return significant_overlap or multiple_overlap
     
-    def map_from_question(self, question: str) -> list:
-        """从完整问题中提取和映射关系"""
+    def map_from_question(self, question: str, use_default: bool = True) -> list:
+        """从完整问题中提取和映射关系；use_default=False 时未匹配返回空列表，由调用方检索候选关系"""
         question_lower = question.lower()
         all_relations = []
         
@@ -145,7 +145,7 @@ class RelationMapper:
                     all_relations.extend(mapped)
         
         # 默认关系 - 如果还是没有找到
-        if not all_relations:
+        if not all_relations and use_default:
             all_relations = [
                 'Make_a_visit', 'Host_a_visit', 'Express_intent_to_cooperate',
                 'Criticize_or_denounce', 'Use_conventional_military_force',
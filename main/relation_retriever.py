@@ -0,0 +1,89 @@
+"""
+关系检索模块 - 在KG关系词表上做BM25词法检索，为每个问题挑选 top-k 候选关系
+
+每个关系作为一篇文档，词项来自关系名本身（按下划线与标点切分）以及 RelationMapper 中映射到它的同义短语。
+BM25 权重矩阵（关系数 × 词表大小）预先算好存为 NumPy 数组，检索时只需对问题词项的列求和。
+"""
+import re
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from .relation_mapper import RelationMapper
+
+# 问句中的功能词，不参与检索
+_STOPWORDS = {
+    'a', 'an', 'the', 'of', 'to', 'in', 'on', 'at', 'for', 'with', 'from', 'by', 'and', 'or', 'as',
+    'who', 'whom', 'what', 'when', 'which', 'where', 'how', 'did', 'do', 'does', 'was', 'were', 'is',
+    'are', 'be', 'been', 'first', 'last', 'before', 'after', 'same', 'month', 'year', 'day', 'time',
+    'country', 'want', 'wanted', 'would', 'like', 'that', 'this', 'it', 'its',
+}
+
+_SUFFIXES = ('ations', 'ation', 'ings', 'ing', 'ies', 'ied', 'ed', 'es', 's')
+
+
+def _stem(word: str) -> str:
+    """极简的后缀剥离，使 visited / visits / visiting 归并到 visit，praise / praised 归并到 prais"""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)] + ('y' if suffix in ('ies', 'ied') else '')
+            break
+    return word[:-1] if word.endswith('e') and len(word) > 4 else word
+
+
+def tokenize(text: str) -> List[str]:
+    """小写、按非字母切分、去停用词并剥离后缀"""
+    words = re.findall(r'[a-z]+', text.lower().replace('_', ' '))
+    return [_stem(w) for w in words if w not in _STOPWORDS and len(w) > 1]
+
+
+class RelationRetriever:
+    """BM25 关系检索器；k1 / b 为 BM25 的标准参数"""
+
+    def __init__(self, relations: Iterable[str], mapper: RelationMapper = None, k1: float = 1.2, b: float = 0.75):
+        self.relations = list(relations)
+        mapper = mapper or RelationMapper()
+
+        # 关系 -> 同义短语
+        synonyms: Dict[str, List[str]] = {}
+        for phrase, targets in mapper.relation_mappings.items():
+            for target in targets:
+                synonyms.setdefault(target, []).append(phrase)
+
+        documents = [tokenize(rel) + [t for phrase in synonyms.get(rel, []) for t in tokenize(phrase)]
+                     for rel in self.relations]
+        self.vocab = {term: i for i, term in enumerate(sorted({t for doc in documents for t in doc}))}
+
+        tf = np.zeros((len(documents), len(self.vocab)), dtype=np.float32)
+        for d, doc in enumerate(documents):
+            for term in doc:
+                tf[d, self.vocab[term]] += 1
+
+        lengths = tf.sum(axis=1, keepdims=True)
+        avg_length = float(lengths.mean()) if len(documents) else 1.0
+        df = (tf > 0).sum(axis=0)
+        idf = np.log(1 + (len(documents) - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * lengths / max(avg_length, 1e-9))
+        self.weights = idf * tf * (k1 + 1) / (tf + norm)
+
+    @classmethod
+    def from_store(cls, store, mapper: RelationMapper = None) -> 'RelationRetriever':
+        """以 KGQuadStore 的关系词表构建"""
+        return cls(store.relation_names, mapper)
+
+    def scores(self, question: str) -> np.ndarray:
+        """每个关系对问题的 BM25 得分"""
+        term_ids = [self.vocab[t] for t in tokenize(question) if t in self.vocab]
+        if not term_ids:
+            return np.zeros(len(self.relations), dtype=np.float32)
+        return self.weights[:, term_ids].sum(axis=1)
+
+    def top_k(self, question: str, k: int = 10) -> List[str]:
+        """得分最高的 k 个关系（得分为 0 的不返回），按得分降序"""
+        scores = self.scores(question)
+        k = min(k, int((scores > 0).sum()))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [self.relations[i] for i in top]
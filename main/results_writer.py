@@ -0,0 +1,150 @@
+"""
+结果写入模块 - 追加写入的 JSONL 结果文件，支持断点续跑
+
+每个问题的结果追加为一行并立即 flush，写入耗时与已写入的结果数无关；每 fsync_interval 条 fsync 一次，
+进程崩溃不丢结果，断电最多丢失最近未同步的几条。
+resume=True 时保留已有文件并截掉崩溃时写了一半的末行，文件中已有的 quid 记录在 done 中，调用方据此跳过。
+写入器只保留 ResultStats 累计值（续跑时另有已有结果的 quid），不在内存中保留结果，
+新写入的结果不再记录 quid，内存占用与本次处理的结果数无关。
+"""
+import json
+import logging
+import os
+from typing import Dict, Iterable, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+
+def iter_results(path: str) -> Iterator[Dict]:
+    """逐条读取结果文件：JSONL（跳过无法解析的行，如崩溃时写了一半的末行），或旧格式的JSON数组"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.json'):
+            yield from json.load(f)
+            return
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"跳过无法解析的结果行 {path}:{number}")
+
+
+def read_results(path: str) -> List[Dict]:
+    """读取结果文件的全部结果"""
+    return list(iter_results(path))
+
+
+class ResultStats:
+    """
+    结果的累计统计：总数、错误数、成功数（F1 > 0）、精确率 / 召回率 / F1 之和与各问题类型的数量和 F1 之和
+    评估分数取结果本身的字段，或 ex1 结果中的 evaluation 子字典
+    """
+
+    def __init__(self, results: Iterable[Dict] = ()):
+        self.total = 0
+        self.errors = 0
+        self.successes = 0
+        self.exact_matches = 0
+        self.sums = {'precision': 0.0, 'recall': 0.0, 'f1': 0.0}
+        self.by_qtype: Dict[str, List] = {}
+        for result in results:
+            self.add(result)
+
+    def add(self, result: Dict):
+        scores = result.get('evaluation', result)
+        self.total += 1
+        self.errors += 'error' in result
+        self.successes += scores.get('f1', 0) > 0
+        self.exact_matches += bool(scores.get('exact_match'))
+        for key in self.sums:
+            self.sums[key] += scores.get(key, 0)
+        tally = self.by_qtype.setdefault(str(result.get('qtype', 'unknown')), [0, 0.0])
+        tally[0] += 1
+        tally[1] += scores.get('f1', 0)
+
+    def mean(self, key: str) -> float:
+        return self.sums[key] / self.total if self.total else 0.0
+
+    def summary(self) -> Dict:
+        """全局指标：平均精确率 / 召回率 / F1、成功率（F1 > 0）与各问题类型的平均 F1"""
+        return {
+            'total_questions': self.total,
+            'errors': self.errors,
+            'success_rate': self.successes / self.total if self.total else 0.0,
+            'avg_precision': self.mean('precision'),
+            'avg_recall': self.mean('recall'),
+            'avg_f1': self.mean('f1'),
+            'f1_by_qtype': {qtype: f1_sum / count for qtype, (count, f1_sum) in sorted(self.by_qtype.items())},
+        }
+
+
+class ResultsWriter:
+    """追加写入的结果文件，可用作上下文管理器"""
+
+    def __init__(self, path: str, fsync_interval: int = 10, resume: bool = False):
+        self.path = path
+        self.fsync_interval = max(1, fsync_interval or 1)
+        self.done = set()
+        self.stats = ResultStats()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 续跑时一次性读取已有结果：记录其 quid 供调用方跳过，并计入统计
+        if resume and os.path.exists(path):
+            self._truncate_partial_line()
+            for result in iter_results(path):
+                self.done.add(str(result.get('quid')))
+                self.stats.add(result)
+        self.resumed = self.stats.total
+
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        self._unsynced = 0
+
+    def _truncate_partial_line(self):
+        """截掉末尾没有换行符的不完整行；从文件末尾向前分块查找最后一个换行符"""
+        with open(self.path, 'rb+') as f:
+            size = end = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - 65536)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b'\n')
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                f.truncate(end)
+                logger.warning(f"结果文件末行不完整，已截断: {self.path}")
+
+    def is_done(self, quid) -> bool:
+        """quid 是否已在续跑前的结果文件中"""
+        return str(quid) in self.done
+
+    def write(self, result: Dict):
+        """追加一条结果并计入 stats"""
+        self._file.write(json.dumps(result, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self.stats.add(result)
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """将已写入的结果落盘"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self) -> 'ResultsWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -6,11 +6,20 @@
 import sys
 import os
 import logging
-import json
+import argparse
+import asyncio
+import gc
+import multiprocessing
+from collections import deque
 from datetime import datetime
 sys.path.append('/mnt/nvme0n1/tyj/TKGQA')
 
 from .temporal_kgqa_experiment import TemporalKGQASystem
+from .llm_client import AsyncLLMClient, LLMClient
+from .llm_metrics import METRICS, calls_path, log_summaries
+from .question_loader import FILTER_FIELDS
+from .results_writer import ResultStats, ResultsWriter
+from .sharding import parse_shard, shard_name, write_manifest
 from .config import DEEPSEEK_CONFIG, PATHS, EXPERIMENT_CONFIG
 
 def setup_logging():
@@ -34,68 +43,81 @@ def setup_logging():
     logger.info(f"日志系统初始化完成，日志文件: {log_path}")
     return logger
 
-def run_complete_experiment(system, logger):
-    """运行完整实验"""
+def log_summary(stats: ResultStats, results_file, logger, resumed=False):
+    """打印实验统计信息（由结果写入器的累计统计得出，含续跑前已有的结果）"""
+    summary = stats.summary()
+    
+    logger.info(f"\n{'='*60}")
+    logger.info(f"📊 实验统计信息:")
+    logger.info(f"总问题数: {stats.total}")
+    logger.info(f"成功回答数: {stats.successes}")
+    logger.info(f"成功率: {summary['success_rate']:.2%}")
+    logger.info(f"平均F1分数: {summary['avg_f1']:.3f}")
+    logger.info(f"{'='*60}")
+    logger.info(f"📁 最终结果文件: {results_file}")
+    
+    # LLM调用指标：记录已逐条写入结果文件旁的 JSONL，这里按阶段 / 问题类型汇总
+    METRICS.close()
+    if METRICS.calls:
+        log_summaries(logger)
+        logger.info(f"📁 LLM调用记录: {calls_path(results_file)}")
+
+def open_results_writer(system, logger, resume: str = None) -> ResultsWriter:
+    """
+    结果写入器：resume 为要续跑的结果文件（跳过其中已有的 quid），否则新建带时间戳的 JSONL 文件；
+    分片运行时结果文件名为 shard_{i}_of_{N}.jsonl，并在旁边写出分片清单。
+    LLM调用记录同时开始逐条写入结果文件旁的 *_llm_calls.jsonl（续跑时追加）
+    """
+    shard = system.config.get('shard')
+    name = shard_name(*shard) if shard else f"final_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    path = resume or os.path.join(system.results_dir, f"{name}.jsonl")
+    writer = ResultsWriter(path, system.config.get('save_interval') or 10, resume=bool(resume))
+    METRICS.open(calls_path(path), append=bool(resume))
+    if writer.resumed:
+        logger.info(f"续跑 {path}：已有 {writer.resumed} 个结果，跳过对应问题")
+    if shard:
+        manifest = write_manifest(path, *shard, system.questions, system.config.get('questions_path'))
+        logger.info(f"分片清单: {manifest}")
+    return writer
+
+def run_complete_experiment(system, logger, resume: str = None):
+    """运行完整实验，返回全局指标"""
     try:
         # 加载数据
         system.load_data()
         
-        # 准备结果文件
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        results_file = os.path.join(system.results_dir, f"final_results_{timestamp}.json")
-        
-        # 确保结果目录存在
-        os.makedirs(system.results_dir, exist_ok=True)
+        # 准备结果文件（追加写入，每个问题一行）
+        writer = open_results_writer(system, logger, resume)
+        results_file = writer.path
         
-        # 处理所有问题，边处理边保存
-        results = []
-        total_questions = len(system.questions)
+        # 逐个读取并处理问题（过滤、分片与最大问题数限制已在读取时应用），边处理边保存，内存中只保留累计统计
+        questions = (q for q in system.questions if not writer.is_done(q['quid']))
+        total_questions = max(len(system.questions) - len(writer.done), 0)
         
-        logger.info(f"开始处理 {total_questions} 个问题")
+        logger.info(f"开始处理 {total_questions} 个问题（问题分析: {system.analysis_mode}）")
         
-        for i, question_data in enumerate(system.questions):
+        # llm_batch 模式下每 analysis_batch_size 个问题合并分析一次
+        for i, (question_data, analysis) in enumerate(system.with_analysis(questions)):
             logger.info(f"\n{'='*60}")
             logger.info(f"进度: {i+1}/{total_questions}")
             
             # 处理单个问题
-            result = system.process_single_question(question_data)
-            results.append(result)
+            result = system.process_single_question(question_data, analysis=analysis)
             
-            # 实时保存结果到文件
-            with open(results_file, 'w', encoding='utf-8') as f:
-                json.dump(results, f, ensure_ascii=False, indent=2)
-            
-            logger.info(f"结果已更新到: {results_file}")
-            
-            # 如果设置了最大问题数限制
-            max_questions = system.config.get('max_questions')
-            if max_questions and max_questions > 0 and i + 1 >= max_questions:
-                logger.info(f"达到最大问题数限制: {max_questions}")
-                break
+            # 追加写入结果文件
+            writer.write(result)
+        writer.close()
+        logger.info(f"结果已写入: {results_file}")
         
         # 打印最终统计信息 - 修改这里
         # system.print_final_stats(results)  # 原来的错误调用
         system.print_final_stats()  # 修改为不传参数
         
         # 或者手动打印统计信息
-        total_questions = len(results)
-        successful_results = [r for r in results if r.get('f1', 0) > 0]
-        success_rate = len(successful_results) / total_questions if total_questions > 0 else 0
-        avg_f1 = sum(r.get('f1', 0) for r in results) / total_questions if total_questions > 0 else 0
-        
-        logger.info(f"\n{'='*60}")
-        logger.info(f"📊 实验统计信息:")
-        logger.info(f"总问题数: {total_questions}")
-        logger.info(f"成功回答数: {len(successful_results)}")
-        logger.info(f"成功率: {success_rate:.2%}")
-        logger.info(f"平均F1分数: {avg_f1:.3f}")
-        logger.info(f"{'='*60}")
-        
+        log_summary(writer.stats, results_file, logger, resumed=bool(resume))
         logger.info(f"✅ 实验成功完成！")
-        logger.info(f"📊 处理问题数: {len(results)}")
-        logger.info(f"📁 最终结果文件: {results_file}")
         
-        return results
+        return writer.stats.summary()
         
     except Exception as e:
         logger.error(f"实验执行失败: {e}")
@@ -103,7 +125,154 @@ def run_complete_experiment(system, logger):
         logger.error(traceback.format_exc())
         raise
 
+# 进程池 worker 使用的系统实例：fork 时从父进程继承（含已加载的KG与索引），不经过序列化
+_worker_system = None
+
+def _init_worker():
+    """
+    worker 初始化：重建LLM客户端（HTTP连接池与SQLite连接不能跨进程共享），KG与索引沿用继承的内存；
+    调用记录不写入继承的记录文件，随结果交给父进程写入
+    """
+    METRICS.detach()
+    _worker_system.llm_client = LLMClient.from_config(_worker_system.config)
+    _worker_system.code_generator.client = _worker_system.llm_client
+
+def _process_in_worker(question_data, analysis=None):
+    """在 worker 中处理一个问题，返回结果与本题的LLM调用记录（由父进程汇总）；analysis 为父进程批量分析的结果"""
+    with METRICS.capture() as records:
+        result = _worker_system.process_single_question(question_data, analysis=analysis)
+    return result, records
+
+def run_complete_experiment_parallel(system, logger, workers, resume: str = None):
+    """
+    多进程并行处理问题：KG与索引在父进程加载一次，fork 出的 worker 以写时复制共享
+    （快照为内存映射时直接共享页缓存）；问题从文件中逐个读取，同时提交给进程池的问题不超过 worker 数的 4 倍，
+    结果按提交顺序（即问题文件中的顺序，与顺序运行相同）收集并追加写入；返回全局指标
+    """
+    global _worker_system
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        logger.warning("当前平台不支持 fork，回退到顺序处理")
+        return run_complete_experiment(system, logger, resume)
+    
+    system.load_data()
+    writer = open_results_writer(system, logger, resume)
+    
+    questions = (q for q in system.questions if not writer.is_done(q['quid']))
+    total = max(len(system.questions) - len(writer.done), 0)
+    
+    logger.info(f"开始以 {workers} 个进程处理 {total} 个问题")
+    _worker_system = system
+    # 冻结父进程已有的对象，避免 worker 中的垃圾回收遍历它们而触发写时复制
+    gc.freeze()
+    pending = deque()
+    
+    def collect():
+        result, records = pending.popleft().get()
+        writer.write(result)
+        METRICS.merge(records)
+        logger.info(f"进度: {writer.stats.total - writer.resumed}/{total}")
+    
+    try:
+        with multiprocessing.get_context('fork').Pool(workers, initializer=_init_worker) as pool:
+            # 不用 imap：它会在后台线程中一次性取完全部问题；这里按提交顺序取结果，窗口满时先等最早的问题
+            # llm_batch 模式下由父进程批量分析，分析结果随问题一起提交
+            for question_data, analysis in system.with_analysis(questions):
+                pending.append(pool.apply_async(_process_in_worker, (question_data, analysis)))
+                if len(pending) >= workers * 4:
+                    collect()
+            while pending:
+                collect()
+    finally:
+        gc.unfreeze()
+        _worker_system = None
+        writer.close()
+    
+    log_summary(writer.stats, writer.path, logger, resumed=bool(resume))
+    return writer.stats.summary()
+
+async def process_questions_async(system, questions, logger, writer: ResultsWriter, total: int = None):
+    """
+    并发处理问题：在途LLM请求数与请求速率由 AsyncLLMClient 控制；
+    问题从 questions 中逐个取用，同时处理的问题数不超过并发上限（自适应时为其最大值）的 2 倍，
+    结果按完成顺序追加写入，返回处理的问题数
+    """
+    llm = AsyncLLMClient.from_config(system.config)
+    window = 2 * llm.concurrency.max_limit
+    questions = system.with_analysis(questions)
+    processed, pending = 0, set()
+    
+    async def process(question_data, analysis):
+        writer.write(await system.process_single_question_async(question_data, llm, analysis))
+    
+    try:
+        while True:
+            while len(pending) < window:
+                # 在线程中取下一个问题：llm_batch 模式下取新一批问题时同步请求LLM，不阻塞事件循环
+                item = await asyncio.to_thread(next, questions, None)
+                if item is None:
+                    break
+                pending.add(asyncio.create_task(process(*item)))
+            if not pending:
+                break
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                task.result()
+                processed += 1
+                logger.info(f"进度: {processed}/{total or '?'}")
+    finally:
+        if llm.cache is not None:
+            logger.info(f"LLM缓存统计: {llm.cache.stats()}")
+        await llm.close()
+    
+    return processed
+
+def run_complete_experiment_async(system, logger, resume: str = None):
+    """并发运行完整实验，返回全局指标；按当前配置不会请求LLM时并发没有意义，直接报错"""
+    if not system.uses_llm:
+        raise ValueError("当前配置不会请求LLM（analysis_mode 为 dataset 且未开启 use_llm_plan，代码生成只使用模板），"
+                         "--async 不起作用；请同时指定 --llm-plan 或 --analysis llm / llm_batch")
+    system.load_data()
+    writer = open_results_writer(system, logger, resume)
+    
+    questions = (q for q in system.questions if not writer.is_done(q['quid']))
+    total = max(len(system.questions) - len(writer.done), 0)
+    
+    logger.info(f"开始并发处理 {total} 个问题（并发上限 {system.config.get('max_concurrency')}，"
+                f"速率上限 {system.config.get('requests_per_second') or '不限'} 请求/秒）")
+    try:
+        asyncio.run(process_questions_async(system, questions, logger, writer, total))
+    finally:
+        writer.close()
+    
+    log_summary(writer.stats, writer.path, logger, resumed=bool(resume))
+    return writer.stats.summary()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="时序知识图谱问答实验")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="使用asyncio并发处理问题（LLM请求并发进行）")
+    parser.add_argument('--workers', type=int, help="并行处理问题的进程数（共享只读KG），不指定时使用配置中的 num_workers")
+    parser.add_argument('--concurrency', type=int, help="同时在途的LLM请求数上限")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="自适应并发：以 --concurrency 为初始值，按延迟与 429 / 超时自动调整")
+    parser.add_argument('--rps', type=float, help="LLM请求速率上限（每秒请求数）")
+    parser.add_argument('--replay', action='store_true',
+                        help="离线回放：LLM回复只从缓存读取，未命中直接失败而不请求LLM")
+    parser.add_argument('--shard', type=parse_shard, metavar='i/N',
+                        help="只运行按 quid 哈希分到第 i 个（共 N 个）分片的问题，结果用 python -m MY.main.sharding merge 合并")
+    parser.add_argument('--llm-plan', action='store_true', help="由LLM生成查询计划（否则使用计划模板，不请求LLM）")
+    parser.add_argument('--analysis', choices=['dataset', 'llm', 'llm_batch'],
+                        help="问题分析方式，llm_batch 每 --analysis-batch-size 个问题合并为一次LLM请求")
+    parser.add_argument('--analysis-batch-size', type=int, help="llm_batch 模式下每次请求分析的问题数")
+    parser.add_argument('--qtype', nargs='+', help="只处理这些问题类型（流式读取问题文件时过滤）")
+    parser.add_argument('--answer-type', nargs='+', help="只处理这些答案类型（entity / time）")
+    parser.add_argument('--time-level', nargs='+', help="只处理这些时间粒度（day / month / year）")
+    parser.add_argument('--resume', metavar='RESULTS_JSONL',
+                        help="续跑：向已有的结果文件追加，跳过其中已完成的问题")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     print("=" * 60)
     print("时序知识图谱问答实验")
     print("=" * 60)
@@ -130,13 +299,43 @@ def main():
             **PATHS,
             **EXPERIMENT_CONFIG
         }
+        if args.concurrency:
+            config['max_concurrency'] = args.concurrency
+        if args.adaptive:
+            config['adaptive_concurrency'] = True
+        if args.rps is not None:
+            config['requests_per_second'] = args.rps
+        if args.replay:
+            config['llm_replay'] = True
+        if args.shard:
+            config['shard'] = args.shard
+        if args.llm_plan:
+            config['use_llm_plan'] = True
+        if args.analysis:
+            config['analysis_mode'] = args.analysis
+        if args.analysis_batch_size:
+            config['analysis_batch_size'] = args.analysis_batch_size
+        for field, key in FILTER_FIELDS.items():
+            if getattr(args, field):
+                config[key] = getattr(args, field)
         
         # 创建系统实例
         system = TemporalKGQASystem(config)
+        if not system.uses_llm and (args.concurrency or args.adaptive or args.rps is not None):
+            logger.warning("当前配置不会请求LLM，--concurrency / --adaptive / --rps 不起作用；"
+                           "需要时指定 --llm-plan 或 --analysis llm / llm_batch")
         
         # 运行完整实验
-        results = run_complete_experiment(system, logger)
+        workers = args.workers if args.workers is not None else config.get('num_workers', 0)
+        if args.use_async:
+            run_complete_experiment_async(system, logger, args.resume)
+        elif workers > 1:
+            run_complete_experiment_parallel(system, logger, workers, args.resume)
+        else:
+            run_complete_experiment(system, logger, args.resume)
         
+        if not args.use_async and workers <= 1 and system.llm_client.cache is not None:
+            logger.info(f"LLM缓存统计: {system.llm_client.cache.stats()}")
         logger.info("🎉 实验全部完成！")
         
     except Exception as e:
@@ -0,0 +1,161 @@
+"""
+分片运行模块 - 按 quid 哈希把问题确定性地划分到 N 个分片，各机器独立运行，最后合并
+
+- 分片：sha1(quid) 取模，与问题文件中的顺序和运行机器无关，同一 quid 总是落在同一分片
+- 清单：每个分片写出 shard_{i}_of_{N}.manifest.json，记录分到的 quid、它们在不分片时的处理顺序中的位置与结果文件名
+- 合并：读取各分片的清单与结果，检查分片是否齐全、每个 quid 是否都有结果，去重后按不分片运行的顺序排列并计算全局指标
+- max_questions 在分片前应用：各分片的并集与不分片运行处理的问题相同
+
+用法：
+    python -m MY.main.run_experiment --shard 0/4          # 每台机器运行一个分片
+    python -m MY.main.sharding merge results_a/ results_b/ --output merged.jsonl
+"""
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Tuple
+
+from .llm_metrics import MetricsSink, calls_path
+from .results_writer import ResultStats, iter_results
+
+logger = logging.getLogger(__name__)
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """解析 'i/N'（0 <= i < N）"""
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"分片格式应为 i/N: {spec}")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"分片序号应满足 0 <= i < N: {spec}")
+    return index, count
+
+
+def shard_of(quid, num_shards: int) -> int:
+    """quid 所在的分片；使用 sha1 而非内置 hash，不受进程的哈希随机化影响"""
+    digest = hashlib.sha1(str(quid).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards
+
+
+def shard_name(index: int, num_shards: int) -> str:
+    return f"shard_{index}_of_{num_shards}"
+
+
+def write_manifest(results_file: str, index: int, num_shards: int, questions,
+                   questions_path: str = None) -> str:
+    """
+    在结果文件旁写出分片清单（questions 为本分片的 QuestionSet），返回清单路径；内容只取决于分片与问题集，重复运行结果相同
+    quids 按问题文件中的顺序排列，positions 为对应问题在不分片时的处理顺序中的位置
+    """
+    indexed = list(questions.indexed())
+    manifest = {
+        'shard': index,
+        'num_shards': num_shards,
+        'questions_path': questions_path,
+        'results_file': os.path.basename(results_file),
+        'quids': [q['quid'] for _, q in indexed],
+        'positions': [position for position, _ in indexed],
+    }
+    path = os.path.join(os.path.dirname(results_file), f"{shard_name(index, num_shards)}.manifest.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def find_manifests(directories: List[str]) -> List[Dict]:
+    """在各目录中查找分片清单，附带清单所在目录"""
+    manifests = []
+    for directory in directories:
+        for path in sorted(glob.glob(os.path.join(directory, "shard_*_of_*.manifest.json"))):
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            manifest['dir'] = directory
+            manifests.append(manifest)
+    return manifests
+
+
+def _prefer(old: Dict, new: Dict) -> Dict:
+    """同一 quid 的两条结果取一条：无错误的优先，其次取后出现的（续跑时写入的）"""
+    if 'error' in new and 'error' not in old:
+        return old
+    return new
+
+
+def merge_shards(directories: List[str]) -> Tuple[List[Dict], Dict, MetricsSink]:
+    """
+    合并各分片的结果，返回 (按不分片运行的顺序排列的去重结果, 全局指标, 合并的LLM调用记录)
+    分片不齐、分片数不一致或有 quid 缺少结果时记录警告，指标中给出缺失情况
+    """
+    manifests = find_manifests(directories)
+    if not manifests:
+        raise ValueError(f"未找到分片清单: {directories}")
+    counts = {m['num_shards'] for m in manifests}
+    if len(counts) > 1:
+        raise ValueError(f"分片数不一致: {sorted(counts)}")
+    num_shards = counts.pop()
+    missing_shards = sorted(set(range(num_shards)) - {m['shard'] for m in manifests})
+    if missing_shards:
+        logger.warning(f"缺少分片: {missing_shards}（共 {num_shards} 个）")
+
+    merged: Dict[str, Dict] = {}
+    positions: Dict[str, int] = {}
+    calls = MetricsSink()
+    for manifest in manifests:
+        positions.update(zip((str(q) for q in manifest['quids']), manifest['positions']))
+        results_file = os.path.join(manifest['dir'], manifest['results_file'])
+        for result in iter_results(results_file):
+            key = str(result.get('quid'))
+            merged[key] = _prefer(merged[key], result) if key in merged else result
+        calls.merge(iter_results(calls_path(results_file)))
+
+    # 清单之外的 quid（如问题集变化前写入的结果）排在最后，保持读入顺序
+    order = lambda key: positions.get(key, len(positions))
+    missing = sorted(set(positions) - set(merged), key=order)
+    if missing:
+        logger.warning(f"{len(missing)} 个问题没有结果，如: {missing[:10]}")
+    results = sorted(merged.values(), key=lambda r: order(str(r.get('quid'))))
+    metrics = compute_metrics(results)
+    metrics.update({'num_shards': num_shards, 'missing_shards': missing_shards,
+                    'expected_questions': len(positions), 'missing_quids': missing})
+    return results, metrics, calls
+
+
+def compute_metrics(results: List[Dict]) -> Dict:
+    """全局指标：平均精确率 / 召回率 / F1、成功率（F1 > 0）与各问题类型的平均 F1"""
+    return ResultStats(results).summary()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="分片实验结果合并")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    merge = subparsers.add_parser('merge', help="合并各分片的结果并计算全局指标")
+    merge.add_argument('directories', nargs='+', help="包含分片清单与结果文件的目录")
+    merge.add_argument('--output', default='merged_results.jsonl', help="合并结果（JSONL），指标写入同名 _metrics.json")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = parse_args()
+    results, metrics, calls = merge_shards(args.directories)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+    metrics_file = os.path.splitext(args.output)[0] + "_metrics.json"
+    with open(metrics_file, 'w', encoding='utf-8') as f:
+        json.dump(metrics, f, ensure_ascii=False, indent=2)
+
+    logger.info(f"合并 {metrics['num_shards']} 个分片: {metrics['total_questions']} 个问题，"
+                f"平均F1 {metrics['avg_f1']:.3f}，成功率 {metrics['success_rate']:.2%}")
+    logger.info(f"合并结果: {args.output}，全局指标: {metrics_file}")
+    if calls.calls:
+        logger.info(f"LLM调用统计（全部分片，按阶段）:\n{calls.format_summary('stage')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,29 @@
 import os
+import asyncio
 import json
 import logging
 import pandas as pd
 import time
 import traceback
 from datetime import datetime
-from typing import List, Dict, Any
+from itertools import islice
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 
 # 导入自定义模块
-from .utils import extract_json, extract_query_code, normalize_answer, evaluate_answers, analyze_question_simple
+from .utils import (extract_json, extract_query_code, normalize_answer, evaluate_answers, analyze_question_simple,
+                    analyze_question, analyze_questions_batch, merge_analysis)
 from .code_generator import CodeGenerator
 from .query_executor import QueryExecutor
+from .llm_client import LLMClient
+from .llm_metrics import metrics_context
+from .kg_store import load_kg_store
+from .kg_index import KGIndex
+from .query_plan import PlanExecutor
+from .kg_stats import KGStatistics
+from .query_planner import QueryPlanner
+from .relation_retriever import RelationRetriever
+from .question_loader import QuestionSet
+from .time_utils import format_day
 
 class TemporalKGQASystem:
     
@@ -32,6 +45,9 @@ class TemporalKGQASystem:
         # 实验配置
         self.save_interval = config.get("save_interval", 10)
         self.max_questions = config.get("max_questions", None)
+        self.use_llm_plan = config.get("use_llm_plan", False)
+        self.analysis_mode = config.get("analysis_mode", "dataset")
+        self.analysis_batch_size = config.get("analysis_batch_size", 10)
         
         # 初始化状态变量
         self.current_question_index = 0
@@ -39,10 +55,9 @@ class TemporalKGQASystem:
         # 获取logger（由run_experiment.py设置）
         self.logger = logging.getLogger(__name__)
         
-        # 初始化组件
-        from openai import OpenAI
-        client = OpenAI(api_key=self.api_key, base_url=self.base_url)
-        self.code_generator = CodeGenerator(client, self.model)
+        # 初始化组件（同步LLM客户端，带并发上限、限流与请求超时）
+        self.llm_client = LLMClient.from_config(config)
+        self.code_generator = CodeGenerator(self.llm_client, self.model)
         self.query_executor = QueryExecutor()
         
         self.logger.info("TemporalKGQASystem 初始化完成")
@@ -51,30 +66,31 @@ class TemporalKGQASystem:
         """加载知识图谱和问题数据"""
         # 加载知识图谱
         self.logger.info(f"加载知识图谱: {self.config['kg_path']}")
-        self.kg_df = pd.read_csv(self.config['kg_path'], sep='\t', header=0)
-        
-        # 确保数据类型正确
-        for col in ['head', 'relation', 'tail', 'timestamp']:
-            if col in self.kg_df.columns:
-                self.kg_df[col] = self.kg_df[col].astype(str)
+        self.kg_store = load_kg_store(self.config['kg_path'], self.config.get('kg_snapshot_path'), self.logger)
+        # 只读共享视图：查询执行不再复制或改写整张表
+        self.kg_df = self.kg_store.to_view()
+        self.kg_index = KGIndex(self.kg_store)
+        self.kg_stats = KGStatistics(self.kg_store)
+        self.query_planner = QueryPlanner(self.kg_index, self.kg_stats, self.config.get('log_plan_decisions', False))
+        self.plan_executor = PlanExecutor(self.kg_store, self.kg_index, self.query_planner)
+        self.code_generator.relation_retriever = RelationRetriever.from_store(
+            self.kg_store, self.code_generator.relation_mapper)
+        self.code_generator.relation_top_k = self.config.get('relation_top_k', 8)
+        self.logger.info(f"知识图谱统计: {self.kg_stats.summary()}")
         
         self.logger.info(f"数据形状: {self.kg_df.shape}")
         self.logger.info(f"列名: {self.kg_df.columns.tolist()}")
         
-        # 分析时间范围
-        timestamps = pd.to_datetime(self.kg_df['timestamp'])
-        min_time = timestamps.min()
-        max_time = timestamps.max()
+        # 分析时间范围（直接使用整数日序数列）
+        min_time = format_day(self.kg_store.days.min())
+        max_time = format_day(self.kg_store.days.max())
         
         self.logger.info(f"知识图谱加载完成，共 {len(self.kg_df)} 条记录")
         self.logger.info(f"时间范围: {min_time} 到 {max_time}")
         
-        # 加载问题数据
-        self.logger.info(f"加载问题数据: {self.config['questions_path']}")
-        with open(self.config['questions_path'], 'r', encoding='utf-8') as f:
-            self.questions = json.load(f)
-        
-        self.logger.info(f"问题数据加载完成，共 {len(self.questions)} 个问题")
+        # 问题数据：流式读取，按问题类型等条件过滤、截取前 max_questions 个后按 quid 哈希分片，由运行器逐个取用
+        self.questions = QuestionSet.from_config(self.config)
+        self.logger.info(f"问题数据: {self.config['questions_path']}（{self.questions.describe()}）")
 
     def analyze_question_step(self, question_data):
         """步骤1: 问题分析"""
@@ -173,10 +189,7 @@ class TemporalKGQASystem:
         # 对于after_first类型，需要找到参考事件的时间
         if qtype == 'after_first' and 'algerian extremist' in question_lower:
             # 查找Algerian extremist事件的时间
-            algerian_events = self.kg_df[
-                (self.kg_df['head'].str.contains('Algeria', case=False, na=False)) |
-                (self.kg_df['tail'].str.contains('Algeria', case=False, na=False))
-            ]
+            algerian_events = self.kg_df.iloc[self.kg_index.entity_rows('any', 'Algeria')]
             if not algerian_events.empty:
                 # 使用最晚的Algerian事件作为参考时间
                 ref_time = algerian_events['timestamp'].max()
@@ -217,14 +230,86 @@ class TemporalKGQASystem:
         """代码生成步骤 - 委托给CodeGenerator"""
         return self.code_generator.generate_code(question, analysis, quid)
 
+    def generate_plan_step(self, question: str, analysis: Dict, quid: str, use_llm: bool = None):
+        """查询计划生成步骤 - 委托给CodeGenerator，无对应计划时返回 None"""
+        use_llm = self.use_llm_plan if use_llm is None else use_llm
+        return self.code_generator.generate_plan(question, analysis, quid, use_llm=use_llm)
+
+    def execute_plan_step(self, plan: Dict, quid: str) -> List[str]:
+        """计划执行步骤 - 委托给QueryExecutor"""
+        return self.query_executor.execute_plan(plan, self.plan_executor)
+
     def execute_query_step(self, query_code: str, quid: str) -> List[str]:
         """执行查询步骤 - 委托给QueryExecutor"""
-        return self.query_executor.execute_query(query_code, self.kg_df)
+        return self.query_executor.execute_query(query_code, self.kg_df, self.kg_store, self.kg_index,
+                                                 self.query_planner)
 
 
 
-    def process_single_question(self, question_data: Dict) -> Dict:
-        """处理单个问题"""
+    @property
+    def uses_llm(self) -> bool:
+        """按当前配置处理问题时是否会请求LLM：只有LLM分析与LLM生成计划会请求，代码生成只使用模板"""
+        return self.use_llm_plan or self.analysis_mode != 'dataset'
+
+    def analyze_questions(self, questions: List[Dict]) -> Dict[str, Dict]:
+        """
+        按 analysis_mode 分析一组问题，返回 {quid: 分析结果}：
+        dataset 直接使用数据集提供的信息；llm 每个问题一次LLM分析；llm_batch 每 analysis_batch_size 个问题合并为一次请求。
+        LLM分析结果经 merge_analysis 补充到数据集信息上
+        """
+        llm_analyses = {}
+        if self.analysis_mode == 'llm_batch':
+            llm_analyses = analyze_questions_batch(questions, self.llm_client, self.model, self.logger,
+                                                   self.analysis_batch_size)
+        elif self.analysis_mode == 'llm':
+            for q in questions:
+                with metrics_context(quid=q['quid'], qtype=q.get('qtype')):
+                    llm_analyses[str(q['quid'])] = analyze_question(q['question'], self.llm_client, self.model,
+                                                                    self.logger)
+        return {str(q['quid']): merge_analysis(analyze_question_simple(q), llm_analyses.get(str(q['quid'])))
+                for q in questions}
+
+    def with_analysis(self, questions: Iterable[Dict]) -> Iterator[Tuple[Dict, Optional[Dict]]]:
+        """
+        逐个产出 (问题, 预先得到的分析结果)：llm_batch 模式下每取 analysis_batch_size 个问题合并分析一次，
+        其余模式产出 None，由 process_single_question 自行分析
+        """
+        questions = iter(questions)
+        if self.analysis_mode != 'llm_batch':
+            for question_data in questions:
+                yield question_data, None
+            return
+        while True:
+            batch = list(islice(questions, self.analysis_batch_size))
+            if not batch:
+                return
+            analyses = self.analyze_questions(batch)
+            for question_data in batch:
+                yield question_data, analyses[str(question_data['quid'])]
+
+    async def process_single_question_async(self, question_data: Dict, llm, analysis: Dict = None) -> Dict:
+        """
+        异步处理单个问题：LLM请求通过 AsyncLLMClient 与其他问题并发进行，
+        KG查询为毫秒级的同步计算，直接在事件循环中执行（逐题LLM分析在线程中进行，不阻塞事件循环）
+        """
+        if analysis is None:
+            if self.analysis_mode == 'dataset':
+                analysis = analyze_question_simple(question_data)
+            else:
+                analysis = (await asyncio.to_thread(self.analyze_questions, [question_data]))[str(question_data['quid'])]
+        query_plan = None
+        if self.use_llm_plan:
+            with metrics_context(quid=question_data['quid'], qtype=question_data.get('qtype')):
+                query_plan = await self.code_generator.generate_plan_async(
+                    question_data['question'], analysis, str(question_data['quid']), llm)
+        return self.process_single_question(question_data, query_plan=query_plan, use_llm=False, analysis=analysis)
+
+    def process_single_question(self, question_data: Dict, query_plan: Dict = None, use_llm: bool = None,
+                                analysis: Dict = None) -> Dict:
+        """
+        处理单个问题；query_plan 为预先生成的查询计划（异步流水线中由LLM并发生成），
+        analysis 为预先得到的分析结果（批量分析时由 with_analysis 给出），缺省时按 analysis_mode 分析
+        """
         quid = question_data['quid']
         question = question_data['question']
         expected_answers = question_data['answers']
@@ -236,14 +321,20 @@ class TemporalKGQASystem:
         self.logger.info(f"答案类型: {question_data.get('answer_type', 'unknown')}")
         
         try:
-            # 直接使用数据集提供的分析信息
-            analysis = analyze_question_simple(question_data)
-            
-            # 生成查询代码
-            query_code = self.generate_code_step(question, analysis, str(quid))
+            # 问题分析：默认直接使用数据集提供的信息，analysis_mode 为 llm / llm_batch 时由LLM补充
+            if analysis is None:
+                analysis = self.analyze_questions([question_data])[str(quid)]
             
-            # 执行查询
-            predicted_answers = self.execute_query_step(query_code, str(quid))
+            # 优先生成查询计划并原生执行，无对应计划时回退到生成代码
+            if query_plan is None:
+                with metrics_context(quid=quid, qtype=question_data.get('qtype')):
+                    query_plan = self.generate_plan_step(question, analysis, str(quid), use_llm)
+            if query_plan is not None:
+                query_code = None
+                predicted_answers = self.execute_plan_step(query_plan, str(quid))
+            else:
+                query_code = self.generate_code_step(question, analysis, str(quid))
+                predicted_answers = self.execute_query_step(query_code, str(quid))
             
             # 使用utils中的评估函数
             metrics = evaluate_answers(predicted_answers, expected_answers)
@@ -257,6 +348,7 @@ class TemporalKGQASystem:
                 'expected_answers': expected_answers,
                 'predicted_answers': predicted_answers,
                 'analysis': analysis,
+                'query_plan': query_plan,
                 'query_code': query_code,
                 **metrics
             }
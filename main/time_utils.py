@@ -0,0 +1,158 @@
+"""
+时间工具模块 - 时间表达解析与整数时间列上的向量化谓词
+
+时间列均为整数序数：
+- day   : date.toordinal()
+- month : year * 12 + (month - 1)
+- year  : 公历年份
+"""
+import re
+import numpy as np
+from datetime import date, datetime
+from typing import List, Tuple
+
+GRANULARITIES = ('day', 'month', 'year')
+TIME_OPS = ('equal', 'before', 'after', 'same_month', 'same_year')
+
+_MONTHS = {
+    'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6,
+    'july': 7, 'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12
+}
+
+
+def parse_time(text: str) -> Tuple[str, date]:
+    """
+    解析时间表达，返回 (粒度, 该时间段的第一天)
+
+    支持 2009-12-11 / 2009-12-11 00:00:00 / 2007-06 / 2015 / 11 December 2009 / July 2007 / June, 2007
+    """
+    text = str(text).strip()
+
+    match = re.match(r'^(\d{4})-(\d{1,2})-(\d{1,2})', text)
+    if match:
+        return 'day', date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+
+    match = re.match(r'^(\d{4})-(\d{1,2})$', text)
+    if match:
+        return 'month', date(int(match.group(1)), int(match.group(2)), 1)
+
+    match = re.match(r'^(\d{4})$', text)
+    if match:
+        return 'year', date(int(match.group(1)), 1, 1)
+
+    match = re.match(r'^(\d{1,2})\s+([A-Za-z]+),?\s+(\d{4})$', text)
+    if match and match.group(2).lower() in _MONTHS:
+        return 'day', date(int(match.group(3)), _MONTHS[match.group(2).lower()], int(match.group(1)))
+
+    match = re.match(r'^([A-Za-z]+),?\s+(\d{4})$', text)
+    if match and match.group(1).lower() in _MONTHS:
+        return 'month', date(int(match.group(2)), _MONTHS[match.group(1).lower()], 1)
+
+    raise ValueError(f"无法解析的时间表达: {text}")
+
+
+def month_ordinal(d: date) -> int:
+    return d.year * 12 + d.month - 1
+
+
+def ordinal_at(d: date, granularity: str) -> int:
+    """日期在指定粒度下的序数"""
+    if granularity == 'day':
+        return d.toordinal()
+    if granularity == 'month':
+        return month_ordinal(d)
+    if granularity == 'year':
+        return d.year
+    raise ValueError(f"未知的时间粒度: {granularity}")
+
+
+def _period_bounds(start: date, granularity: str) -> Tuple[int, int]:
+    """start 所在时间段（按 granularity）的日序数闭区间"""
+    if granularity == 'day':
+        return start.toordinal(), start.toordinal()
+    if granularity == 'month':
+        first = date(start.year, start.month, 1)
+        next_month = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+        return first.toordinal(), next_month.toordinal() - 1
+    if granularity == 'year':
+        return date(start.year, 1, 1).toordinal(), date(start.year, 12, 31).toordinal()
+    raise ValueError(f"未知的时间粒度: {granularity}")
+
+
+def period_day_bounds(text: str) -> Tuple[int, int]:
+    """时间表达覆盖的日序数闭区间 [first_day, last_day]"""
+    granularity, start = parse_time(text)
+    return _period_bounds(start, granularity)
+
+
+def predicate_day_range(op: str, value: str, granularity: str = None) -> Tuple[int, int]:
+    """
+    时间谓词（语义同 compare_time）满足条件的日序数闭区间 (lo, hi)，None 表示该侧无界
+    """
+    value_granularity, start = parse_time(value)
+    if op == 'same_month':
+        op, granularity = 'equal', 'month'
+    elif op == 'same_year':
+        op, granularity = 'equal', 'year'
+    first_day, last_day = _period_bounds(start, granularity or value_granularity)
+
+    if op == 'equal':
+        return first_day, last_day
+    if op == 'before':
+        return None, first_day - 1
+    if op == 'after':
+        return last_day + 1, None
+    raise ValueError(f"未知的时间谓词: {op}")
+
+
+def format_day(day: int, granularity: str = 'day') -> str:
+    """日序数 -> 指定粒度的时间字符串（YYYY-MM-DD / YYYY-MM / YYYY）"""
+    text = date.fromordinal(int(day)).isoformat()
+    return {'day': text, 'month': text[:7], 'year': text[:4]}[granularity]
+
+
+def timestamp_tables(ts_names: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """时间戳字典 -> 按 ts_id 排列的 (day, month, year) 查找表，无法解析的时间戳记为 -1"""
+    days = np.full(len(ts_names), -1, dtype=np.int32)
+    months = np.full(len(ts_names), -1, dtype=np.int32)
+    years = np.full(len(ts_names), -1, dtype=np.int32)
+    for i, ts in enumerate(ts_names):
+        try:
+            d = datetime.strptime(ts[:10], '%Y-%m-%d').date()
+        except ValueError:
+            continue
+        days[i], months[i], years[i] = d.toordinal(), month_ordinal(d), d.year
+    return days, months, years
+
+
+def compare_time(days: np.ndarray, months: np.ndarray, years: np.ndarray,
+                 op: str, value: str, granularity: str = None) -> np.ndarray:
+    """
+    整数时间列上的向量化时间谓词
+
+    op: equal / before / after / same_month / same_year
+    granularity 默认取 value 自身的精度（如 "2007-06" 为 month），same_month / same_year 固定粒度
+    """
+    value_granularity, start = parse_time(value)
+    if op == 'same_month':
+        op, granularity = 'equal', 'month'
+    elif op == 'same_year':
+        op, granularity = 'equal', 'year'
+    granularity = granularity or value_granularity
+
+    column = {'day': days, 'month': months, 'year': years}[granularity]
+    target = ordinal_at(start, granularity)
+
+    if op == 'equal':
+        return column == target
+    if op == 'before':
+        return column < target
+    if op == 'after':
+        return column > target
+    raise ValueError(f"未知的时间谓词: {op}")
+
+
+def time_mask(frame, op: str, value: str, granularity: str = None) -> np.ndarray:
+    """DataFrame（含 day / month / year 整数列）上的时间谓词掩码"""
+    return compare_time(frame['day'].to_numpy(), frame['month'].to_numpy(), frame['year'].to_numpy(),
+                        op, value, granularity)
@@ -6,6 +6,9 @@ import re
 import logging
 from typing import List, Dict, Any
 
+from .llm_cache import CacheMissError, cached_completion
+from .llm_client import LLMClient
+
 def extract_json(text: str) -> Dict:
     """从文本中提取JSON"""
     try:
@@ -36,6 +39,17 @@ def extract_query_code(text: str) -> str:
     # 如果没有找到代码块，返回原文本
     return text
 
+_FENCED_BLOCK = re.compile(r'```[ \t]*(?:python|py)?[ \t]*\n(.*?)\n[ \t]*```', re.DOTALL)
+
+def extract_fenced_query_kg(text: str) -> str:
+    """第一个包含 def query_kg 且已闭合的围栏代码块，没有则返回空字符串（用于流式回复的提前结束判断）"""
+    if text.count('```') < 2:
+        return ""
+    for match in _FENCED_BLOCK.finditer(text):
+        if 'def query_kg' in match.group(1):
+            return match.group(1).strip()
+    return ""
+
 def normalize_answer(answer: str) -> str:
     """标准化答案"""
     if not answer:
@@ -81,8 +95,24 @@ def evaluate_answers(predicted: List[str], ground_truth: List[str]) -> Dict:
         'f1': f1
     }
 
-def analyze_question(question: str, client, model: str, logger) -> Dict:
-    """问题分析函数"""
+ANALYSIS_SYSTEM_PROMPT = "你是一个专业的问题分析助手，擅长分析时序知识图谱问答问题。"
+
+
+def _complete(client, model: str, messages: List[Dict], cache=None, stage: str = None, **params) -> str:
+    """LLMClient 走带重试与熔断的 chat；原始 OpenAI 客户端经 cache 调用"""
+    if isinstance(client, LLMClient):
+        return client.chat(messages, model=model, stage=stage, **params)
+    return cached_completion(client, cache, model, messages, stage=stage, **params)
+
+def analyze_question(question: str, client, model: str, logger, cache=None) -> Dict:
+    """
+    问题分析函数
+    client 为 LLMClient 时调用带重试、截止时间与熔断保护，熔断期间直接使用基于规则的分析；
+    为原始 OpenAI 客户端时，cache 为 LLMCache 则相同的请求直接复用缓存的回复
+    """
+    if isinstance(client, LLMClient) and not client.available:
+        logger.warning("LLM服务熔断中，使用基于规则的问题分析")
+        return rule_based_analysis(question)
     try:
         # 构建分析prompt
         analysis_prompt = f"""
@@ -103,30 +133,108 @@ def analyze_question(question: str, client, model: str, logger) -> Dict:
 请确保返回有效的JSON格式。
 """
 
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "你是一个专业的问题分析助手，擅长分析时序知识图谱问答问题。"},
-                {"role": "user", "content": analysis_prompt}
-            ],
-            temperature=0.1,
-            max_tokens=1000
-        )
-        
-        analysis_text = response.choices[0].message.content.strip()
+        messages = [
+            {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+            {"role": "user", "content": analysis_prompt}
+        ]
+        analysis_text = _complete(client, model, messages, cache, 'analysis', temperature=0.1, max_tokens=1000).strip()
         analysis = extract_json(analysis_text)
         
-        if not analysis:
+        if not isinstance(analysis, dict) or not analysis:
             # 使用基于规则的分析作为备用
             analysis = rule_based_analysis(question)
         
         logger.info(f"问题分析完成: {analysis}")
         return analysis
         
+    except CacheMissError:
+        raise
     except Exception as e:
         logger.error(f"问题分析失败: {e}")
         return rule_based_analysis(question)
 
+def _extract_json_array(text: str) -> List:
+    """从文本中提取JSON数组（允许代码块包裹或前后有说明文字）"""
+    text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text.strip())
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find('['), text.rfind(']')
+        if start < 0 or end <= start:
+            return []
+        try:
+            data = json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            return []
+    return data if isinstance(data, list) else []
+
+def _valid_analysis(item) -> bool:
+    """批量分析结果中单个条目的字段校验"""
+    return (isinstance(item, dict)
+            and isinstance(item.get('question_type'), str)
+            and isinstance(item.get('key_entities'), list)
+            and isinstance(item.get('target_relations', []), list)
+            and isinstance(item.get('answer_type'), str))
+
+def analyze_questions_batch(questions: List[Dict], client, model: str, logger, batch_size: int = 10,
+                            cache=None) -> Dict[str, Dict]:
+    """
+    批量问题分析：每 batch_size 个问题合并为一次请求，返回 {quid: 分析结果}
+
+    questions 为含 quid 与 question 的问题数据；LLM返回以 quid 标识的JSON数组，
+    缺失或校验失败的条目单独调用 analyze_question（其失败时再回退到基于规则的分析）
+    """
+    results = {}
+    for start in range(0, len(questions), batch_size):
+        batch = questions[start:start + batch_size]
+        items = [{'quid': str(q['quid']), 'question': q['question']} for q in batch]
+        wanted = {i['quid'] for i in items}
+        parsed = {}
+
+        analysis_prompt = f"""
+请分析以下每个时序知识图谱问答问题，提取关键信息：
+
+{json.dumps(items, ensure_ascii=False, indent=2)}
+
+请返回JSON数组，每个问题对应一个对象，用 quid 标识：
+[
+    {{
+        "quid": "问题的quid",
+        "question_type": "问题类型(entity_query/time_query/relation_query/count_query)",
+        "key_entities": ["实体1", "实体2"],
+        "target_relations": ["关系1", "关系2"],
+        "time_constraints": "时间约束(如2015, 2015-01等)",
+        "answer_type": "答案类型(entity/time/number/boolean)",
+        "query_strategy": "查询策略描述"
+    }}
+]
+
+只返回JSON数组，不要添加其他内容。
+"""
+        messages = [
+            {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+            {"role": "user", "content": analysis_prompt}
+        ]
+        try:
+            reply = _complete(client, model, messages, cache, 'analysis_batch', temperature=0.1,
+                              max_tokens=200 + 250 * len(batch))
+            for item in _extract_json_array(reply):
+                if _valid_analysis(item) and str(item.get('quid')) in wanted:
+                    quid = str(item.pop('quid'))
+                    item.setdefault('target_relations', [])
+                    parsed[quid] = item
+        except CacheMissError:
+            raise
+        except Exception as e:
+            logger.error(f"批量问题分析失败: {e}")
+
+        missing = [q for q in batch if str(q['quid']) not in parsed]
+        logger.info(f"批量问题分析: {len(batch)} 个问题，{len(parsed)} 个有效，{len(missing)} 个逐个重新分析")
+        for q in missing:
+            parsed[str(q['quid'])] = analyze_question(q['question'], client, model, logger, cache)
+        results.update(parsed)
+    return results
+
 def rule_based_analysis(question: str) -> Dict:
     """基于规则的问题分析（备用方案）"""
     # 实体识别
@@ -163,6 +271,25 @@ def rule_based_analysis(question: str) -> Dict:
         'query_strategy': f'Rule-based analysis for {question_type}'
     }
 
+def merge_analysis(base: Dict, llm_analysis: Dict = None) -> Dict:
+    """
+    以数据集提供的分析信息（analyze_question_simple）为准，用LLM分析结果补充：
+    候选关系取自LLM，实体与时间约束只在数据集未提供时采用LLM的结果
+    """
+    if not llm_analysis:
+        return base
+    analysis = dict(base)
+    analysis['target_relations'] = list(llm_analysis.get('target_relations') or [])
+    if not analysis.get('entities') and llm_analysis.get('key_entities'):
+        analysis['entities'] = analysis['key_entities'] = list(llm_analysis['key_entities'])
+    time_constraints = llm_analysis.get('time_constraints')
+    if not analysis.get('time') and time_constraints:
+        time_constraints = [time_constraints] if isinstance(time_constraints, str) else list(time_constraints)
+        analysis['time'] = analysis['time_constraints'] = time_constraints
+    if llm_analysis.get('query_strategy'):
+        analysis['query_strategy'] = llm_analysis['query_strategy']
+    return analysis
+
 def analyze_question_simple(question_data: dict) -> Dict:
     """
     直接使用数据集提供的问题分析信息，并从问题文本中补充缺失信息